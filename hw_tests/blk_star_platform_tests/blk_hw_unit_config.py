@@ -27,10 +27,10 @@ import os
 import time
 
 # Third-party imports -----------------------------------------------
-from PyCRC.CRCCCITT import CRCCCITT
 from intelhex import IntelHex
 
 # Our own imports ---------------------------------------------------
+from crc_ccitt import crc_ccitt
 from pca9500bs import PCA9500BS
 from i2c import I2C
 
@@ -192,7 +192,7 @@ def set_config_info(serial_no, rev_no, batch_no, assembly_type, config_version=1
             data = hex(pca9500_i2c.read_register(detail.get("addr_offset")))
             time.sleep(0.02)
             data = ih.gets(0, detail.get("addr_offset"))
-            crc = CRCCCITT(version="FFFF").calculate(data)
+            crc = crc_ccitt(data)
             log.debug("%s will be set to \"0x%x\" at address offset 0x%x" %
                       (detail.get("name"), crc, detail.get("addr_offset"))) 
             try:    
@@ -283,7 +283,7 @@ def get_config_info(assembly_type, config_version=1):
 
         elif detail.get("type") == "CRC16-CCITT":
             data = file_contents[0:detail.get("addr_offset")]
-            calc_crc = CRCCCITT(version="FFFF").calculate(data)
+            calc_crc = crc_ccitt(data)
             read_crc = (file_contents[detail.get("addr_offset")+1] << 8) | file_contents[detail.get("addr_offset")]
             detail_str = "{} read: 0x{} calculated: 0x{}".format(detail.get("type"), hex(read_crc), hex(calc_crc))
             if calc_crc == read_crc:
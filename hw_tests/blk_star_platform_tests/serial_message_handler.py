@@ -32,10 +32,10 @@ import collections
 import time
 
 # Third-party imports -----------------------------------------------
-from PyCRC.CRCCCITT import CRCCCITT
 import serial
 
 # Our own imports ---------------------------------------------------
+from crc_ccitt import append_crc, crc_ccitt
 
 
 # -----------------------------------------------------------------------------
@@ -201,11 +201,7 @@ class MessageHandler:
             header_bytes.append(MessageStatus.NOT_ACKNOWLEDGE.value << 5)
         header_bytes.append(message_id)                         # Message ID
         header_bytes.append(0)                                  # Payload Length
-
-        header_crc = CRCCCITT(version="FFFF").calculate(bytes(header_bytes))
-        header_crc_bytes = header_crc.to_bytes(2, byteorder="little")
-        header_bytes.append(header_crc_bytes[0])  # CRC LSB
-        header_bytes.append(header_crc_bytes[1])  # CRC MSB
+        append_crc(header_bytes)                                # CRC LSB, MSB
 
         log.debug("Tx Ack: {}".format(" ".join(format(x, '02x') for x in header_bytes)))
 
@@ -229,10 +225,7 @@ class MessageHandler:
         header_bytes.append((status << 5) & 0xE0)  # Status and Protocol
         header_bytes.append(msg_id)  # Message ID
         header_bytes.append(pl_len)  # Payload Length
-        header_crc = CRCCCITT(version="FFFF").calculate(bytes(header_bytes))
-        header_crc_bytes = header_crc.to_bytes(2, byteorder="little")
-        header_bytes.append(header_crc_bytes[0])  # CRC LSB
-        header_bytes.append(header_crc_bytes[1])  # CRC MSB
+        append_crc(header_bytes)  # CRC LSB, MSB
         return header_bytes
 
     @staticmethod
@@ -312,8 +305,7 @@ class MessageHandler:
                         crc_bytes_read += 1
 
                         if crc_bytes_read == CRC_LENGTH:
-                            calculated_crc = CRCCCITT(version="FFFF").calculate(
-                                bytes(message_buffer[0:HEADER_LENGTH]))
+                            calculated_crc = crc_ccitt(memoryview(message_buffer)[0:HEADER_LENGTH])
                             log.debug("Rx Header Calculated CRC = {}".format(hex(calculated_crc)))
 
                             header_crc = int.from_bytes(
@@ -353,8 +345,8 @@ class MessageHandler:
 
                         if crc_bytes_read == CRC_LENGTH:
                             log.debug("Raw Rx Msg: {}".format(" ".join(format(x, '02x') for x in message_buffer[:read_position])))
-                            calculated_crc = CRCCCITT(version="FFFF").calculate(
-                                bytes(message_buffer[TOTAL_HEADER_LENGTH: read_position - CRC_LENGTH]))
+                            calculated_crc = crc_ccitt(
+                                memoryview(message_buffer)[TOTAL_HEADER_LENGTH: read_position - CRC_LENGTH])
                             log.debug("Rx Payload Calculated CRC = {}".format(hex(calculated_crc)))
 
                             payload_crc = int.from_bytes(
@@ -28,9 +28,10 @@ import time
 
 
 # Third-party imports -----------------------------------------------
-from PyCRC.CRCCCITT import CRCCCITT
+
 
 # Our own imports ---------------------------------------------------
+from crc_ccitt import append_crc
 import serial_message_handler as smh
 
 # -----------------------------------------------------------------------------
@@ -186,10 +187,7 @@ class SerialMsgInterface:
         payload_bytes.extend(key)
 
         # Add the payload CRC
-        payload_crc = CRCCCITT(version="FFFF").calculate(bytes(payload_bytes))
-        payload_crc_bytes = payload_crc.to_bytes(2, byteorder="little")
-        payload_bytes.append(payload_crc_bytes[0])  # CRC LSB
-        payload_bytes.append(payload_crc_bytes[1])  # CRC MSB
+        append_crc(payload_bytes)  # CRC LSB, MSB
 
         # Build and send the message
         msg_bytes = header_bytes + payload_bytes
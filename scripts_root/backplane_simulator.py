@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Simulator of the Active Backplane Firmware, KT-956-0194-00, serving the
+Blackstar serial protocol specified in KT-957-0143-00 on a pseudo-terminal.
+Allows serial_message_handler.py and serial_msg_intf.py to be exercised and
+benchmarked without the real board, with configurable response delay, byte
+corruption, dropped frames and line noise.
+"""
+# -----------------------------------------------------------------------------
+# Copyright (c) 2021, Kirintec
+#
+# -----------------------------------------------------------------------------
+"""
+OPTIONS ------------------------------------------------------------------
+-d, --delay     response delay in seconds
+-c, --corrupt   probability of corrupting a byte in each transmitted frame
+-x, --drop      probability of dropping each transmitted frame
+-z, --noise     probability of sending noise bytes before each frame
+-s, --seed      random seed
+
+ARGUMENTS -------------------------------------------------------------
+None
+"""
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# stdlib imports -------------------------------------------------------
+import argparse
+import heapq
+import logging
+import multiprocessing
+import os
+import random
+import select
+import threading
+import time
+
+# Third-party imports -----------------------------------------------
+
+
+# Our own imports ---------------------------------------------------
+import serial_message_handler as smh
+from serial_msg_codec import Direction
+from serial_msg_intf import CODECS, MsgId
+
+# -----------------------------------------------------------------------------
+# GLOBALS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# CONSTANTS
+# -----------------------------------------------------------------------------
+SOFTWARE_VERSION = (1, 2, 3, 4)
+HARDWARE_INFO = ("KT-950-0543", "A", "000001", "2021-01", "1.0.0")
+BIT_DATA = bytes(9)
+HW_CONFIG_VERSION = 1
+MAX_NOISE_LENGTH = 16
+POLL_INTERVAL = 0.1
+
+# -----------------------------------------------------------------------------
+# LOCAL UTILITIES
+# -----------------------------------------------------------------------------
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+# -----------------------------------------------------------------------------
+# CLASSES
+# -----------------------------------------------------------------------------
+class BackplaneSimulator:
+    """
+    Simulated Active Backplane firmware.  Every valid new (or retransmitted)
+    message is Acked and GET commands are followed by a RESPONSE_OK message
+    carrying the requested data; messages with a bad payload CRC are Nacked.
+    SET_KEY and SET_UNIT_INFO payloads are stored and returned by GET_KEY and
+    GET_UNIT_INFO.  Payloads are encoded and decoded using the CODECS table
+    in serial_msg_intf.py.
+
+    The simulator runs in a thread, or in a child process so that its CPU
+    time is not charged to a benchmark.
+    """
+    def __init__(self, delay=0.0, corrupt=0.0, drop=0.0, noise=0.0, seed=None):
+        """
+        Class constructor
+        :param delay: delay before sending each Ack/response, seconds :type Float
+        :param corrupt: probability of corrupting a byte of each transmitted frame :type Float
+        :param drop: probability of dropping each transmitted frame :type Float
+        :param noise: probability of sending noise bytes before each transmitted frame :type Float
+        :param seed: random seed, for reproducible fault injection :type Integer
+        """
+        self.delay = delay
+        self.corrupt = corrupt
+        self.drop = drop
+        self.noise = noise
+        self._random = random.Random(seed)
+        self._master_fd, self._slave_fd = os.openpty()
+        self.port = os.ttyname(self._slave_fd)
+        self._sequence_number = 0
+        self._key = bytes(32)
+        self._unit_info = ("", "", "", "")
+        self._pending = []
+        self._pending_count = 0
+        self._stop_event = None
+        self._worker = None
+        self.frames_received = 0
+        self.frames_sent = 0
+        self.crc_errors = 0
+
+    def start(self, use_process=False):
+        """
+        Start serving the pseudo-terminal
+        :param use_process: True to run in a child process rather than a thread :type Boolean
+        :return: NA
+        """
+        if use_process:
+            self._stop_event = multiprocessing.Event()
+            self._worker = multiprocessing.Process(target=self.run, args=(self._stop_event,), daemon=True)
+        else:
+            self._stop_event = threading.Event()
+            self._worker = threading.Thread(target=self.run, args=(self._stop_event,), daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        """
+        Stop serving and close the pseudo-terminal
+        :return: NA
+        """
+        if self._worker is not None:
+            self._stop_event.set()
+            self._worker.join()
+            self._worker = None
+        os.close(self._master_fd)
+        os.close(self._slave_fd)
+
+    def run(self, stop_event):
+        """
+        Serve the pseudo-terminal until stop_event is set
+        :param stop_event: event which stops the simulator :type threading.Event or multiprocessing.Event
+        :return: NA
+        """
+        parser = smh.MessageParser()
+        while not stop_event.is_set():
+            timeout = POLL_INTERVAL
+            if self._pending:
+                timeout = min(timeout, max(0.0, self._pending[0][0] - time.monotonic()))
+
+            readable, _, _ = select.select([self._master_fd], [], [], timeout)
+            if readable:
+                for msg, crc_ok in parser.parse(os.read(self._master_fd, 4096)):
+                    self.__process_message(msg, crc_ok)
+
+            now = time.monotonic()
+            while self._pending and self._pending[0][0] <= now:
+                self.__write_frame(heapq.heappop(self._pending)[2])
+
+    def __next_sequence_number(self):
+        self._sequence_number = (self._sequence_number + 1) % 256
+        return self._sequence_number
+
+    def __queue_frame(self, frame):
+        """
+        Queue a frame to be sent after the response delay, preserving order
+        :param frame: frame to send :type bytearray
+        :return: NA
+        """
+        self._pending_count += 1
+        heapq.heappush(self._pending, (time.monotonic() + self.delay, self._pending_count, frame))
+
+    def __write_frame(self, frame):
+        """
+        Write a frame to the pseudo-terminal, applying any fault injection
+        :param frame: frame to send :type bytearray
+        :return: NA
+        """
+        if self.drop and self._random.random() < self.drop:
+            return
+        data = bytearray(frame)
+        if self.corrupt and self._random.random() < self.corrupt:
+            data[self._random.randrange(len(data))] ^= 1 << self._random.randrange(8)
+        if self.noise and self._random.random() < self.noise:
+            noise = bytes(self._random.randrange(256)
+                          for _ in range(self._random.randint(1, MAX_NOISE_LENGTH)))
+            data[0:0] = noise
+        os.write(self._master_fd, data)
+        self.frames_sent += 1
+
+    def __send_acknowledge(self, seq_no, msg_id, ack=True):
+        status = smh.MessageStatus.ACKNOWLEDGE.value if ack else smh.MessageStatus.NOT_ACKNOWLEDGE.value
+        self.__queue_frame(smh.MessageHandler.build_message_header(
+            self.__next_sequence_number(), seq_no, status, msg_id, 0))
+
+    def __response_values(self, msg_id):
+        """
+        Get the response payload field values for a GET command
+        :param msg_id: command ID :type Integer
+        :return: field values, or None if the command has no response :type Tuple
+        """
+        if msg_id == MsgId.GET_SOFTWARE_VERSION_NUMBER.value:
+            return SOFTWARE_VERSION
+        elif msg_id == MsgId.GET_KEY.value:
+            return (self._key,)
+        elif msg_id == MsgId.GET_UNIT_INFO.value:
+            return self._unit_info + (HW_CONFIG_VERSION,)
+        elif msg_id == MsgId.GET_HARDWARE_INFO.value:
+            return HARDWARE_INFO
+        elif msg_id == MsgId.GET_BIT_INFO.value:
+            return (BIT_DATA,)
+        return None
+
+    def __process_message(self, msg, crc_ok):
+        """
+        Handle a message received from the host
+        :param msg: complete frame :type bytearray
+        :param crc_ok: False if the payload CRC check failed :type Boolean
+        :return: NA
+        """
+        self.frames_received += 1
+        seq_no = msg[smh.HeaderOffset.MESSAGE_SEQUENCE_NO.value]
+        msg_id = msg[smh.HeaderOffset.MESSAGE_ID.value]
+        status = msg[smh.HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] >> 5
+
+        if not crc_ok:
+            self.crc_errors += 1
+            self.__send_acknowledge(seq_no, msg_id, ack=False)
+            return
+
+        if status not in (smh.MessageStatus.NEW_MESSAGE.value, smh.MessageStatus.RETRANSMIT.value):
+            # Acks of our responses need no action
+            return
+
+        codec = CODECS.get(msg_id, Direction.COMMAND)
+        if codec is not None and len(msg) == codec.frame_length:
+            values = codec.decode(msg)[1:]
+            if msg_id == MsgId.SET_KEY.value:
+                self._key = values[0]
+            elif msg_id == MsgId.SET_UNIT_INFO.value:
+                self._unit_info = tuple(values)
+
+        self.__send_acknowledge(seq_no, msg_id)
+        values = self.__response_values(msg_id)
+        if values is not None:
+            self.__queue_frame(CODECS.get(msg_id, Direction.RESPONSE).encode(
+                self.__next_sequence_number(), values, smh.MessageStatus.RESPONSE_OK.value, seq_no))
+
+
+# -----------------------------------------------------------------------------
+# FUNCTIONS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# RUNTIME PROCEDURE
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Active Backplane firmware simulator")
+    parser.add_argument("-d", "--delay", type=float, default=0.0, help="response delay in seconds")
+    parser.add_argument("-c", "--corrupt", type=float, default=0.0, help="probability of corrupting each frame")
+    parser.add_argument("-x", "--drop", type=float, default=0.0, help="probability of dropping each frame")
+    parser.add_argument("-z", "--noise", type=float, default=0.0, help="probability of noise before each frame")
+    parser.add_argument("-s", "--seed", type=int, default=None, help="random seed")
+    args = parser.parse_args()
+
+    simulator = BackplaneSimulator(args.delay, args.corrupt, args.drop, args.noise, args.seed)
+    print("Simulating Active Backplane on {}".format(simulator.port))
+    try:
+        simulator.run(threading.Event())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Module providing a fast CRC-CCITT implementation for the Blackstar serial
+protocol and EEPROM configuration checksums.  Results are bit-exact with
+PyCRC.CRCCCITT for the XModem, FFFF and 1D0F variants.
+"""
+# -----------------------------------------------------------------------------
+# Copyright (c) 2020, Kirintec
+#
+# -----------------------------------------------------------------------------
+"""
+OPTIONS ------------------------------------------------------------------
+None
+
+ARGUMENTS -------------------------------------------------------------
+None
+"""
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# stdlib imports -------------------------------------------------------
+from binascii import crc_hqx
+
+# Third-party imports -----------------------------------------------
+
+
+# Our own imports ---------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# GLOBALS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# CONSTANTS
+# -----------------------------------------------------------------------------
+CRC_LENGTH = 2
+STARTING_VALUES = {'XModem': 0x0000, 'FFFF': 0xFFFF, '1D0F': 0x1D0F}
+
+# -----------------------------------------------------------------------------
+# LOCAL UTILITIES
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# CLASSES
+# -----------------------------------------------------------------------------
+class CrcCcitt:
+    """
+    Incremental CRC-CCITT (polynomial 0x1021) calculator.  Data may be added
+    in pieces using update() as it arrives, digest() returns the CRC of all
+    the data added since construction or the last reset().
+
+    The table-driven calculation is done by binascii.crc_hqx, which operates
+    directly on any bytes-like object (bytes, bytearray, memoryview) without
+    copying.
+    """
+    def __init__(self, version="FFFF"):
+        """
+        Class constructor
+        :param version: one of 'XModem', 'FFFF' or '1D0F' :type String
+        """
+        if version not in STARTING_VALUES:
+            raise ValueError("version must be one of {}".format("|".join(STARTING_VALUES.keys())))
+        self._starting_value = STARTING_VALUES[version]
+        self._crc = self._starting_value
+
+    def reset(self):
+        """
+        Reset the CRC back to the starting value
+        :return: NA
+        """
+        self._crc = self._starting_value
+
+    def update(self, data):
+        """
+        Add data to the CRC calculation
+        :param data: data to add :type bytes-like object
+        :return: self, so that calls may be chained
+        """
+        self._crc = crc_hqx(data, self._crc)
+        return self
+
+    def digest(self):
+        """
+        :return: CRC of all the data added so far :type Integer
+        """
+        return self._crc
+
+    def calculate(self, data):
+        """
+        One-shot CRC calculation, does not affect the incremental state.
+        Strings are accepted for compatibility with PyCRC.CRCCCITT
+        :param data: data to calculate CRC over :type bytes-like object or String
+        :return: CRC :type Integer
+        """
+        if isinstance(data, str):
+            data = data.encode("latin-1")
+        return crc_hqx(data, self._starting_value)
+
+
+# -----------------------------------------------------------------------------
+# FUNCTIONS
+# -----------------------------------------------------------------------------
+def crc_ccitt(data, version="FFFF"):
+    """
+    Calculate the CRC-CCITT of a bytes-like object
+    :param data: data to calculate CRC over :type bytes-like object
+    :param version: one of 'XModem', 'FFFF' or '1D0F' :type String
+    :return: CRC :type Integer
+    """
+    return crc_hqx(data, STARTING_VALUES[version])
+
+
+def append_crc(ba, start=0, version="FFFF"):
+    """
+    Calculate the CRC of ba[start:] and append it, LSB first, to ba
+    :param ba: buffer to calculate CRC over and extend :type bytearray
+    :param start: offset in ba of the first byte covered by the CRC :type Integer
+    :param version: one of 'XModem', 'FFFF' or '1D0F' :type String
+    :return: the calculated CRC :type Integer
+    """
+    crc = crc_hqx(memoryview(ba)[start:], STARTING_VALUES[version])
+    ba.append(crc & 0xFF)
+    ba.append(crc >> 8)
+    return crc
+
+
+def pack_crc_into(buffer, start, end, version="FFFF"):
+    """
+    Calculate the CRC of buffer[start:end] and write it, LSB first, to
+    buffer[end:end + CRC_LENGTH] without resizing the buffer
+    :param buffer: pre-allocated buffer :type bytearray or writable memoryview
+    :param start: offset of the first byte covered by the CRC :type Integer
+    :param end: offset one past the last byte covered by the CRC :type Integer
+    :param version: one of 'XModem', 'FFFF' or '1D0F' :type String
+    :return: the calculated CRC :type Integer
+    """
+    crc = crc_hqx(memoryview(buffer)[start:end], STARTING_VALUES[version])
+    buffer[end] = crc & 0xFF
+    buffer[end + 1] = crc >> 8
+    return crc
+
+
+def check_crc(data, start=0, end=None, version="FFFF"):
+    """
+    Check the CRC of data[start:end - CRC_LENGTH] against the little-endian
+    CRC held in the last two bytes of data[start:end]
+    :param data: buffer holding data and trailing CRC :type bytes-like object
+    :param start: offset of the first byte covered by the CRC :type Integer
+    :param end: offset one past the CRC MSB, defaults to len(data) :type Integer
+    :param version: one of 'XModem', 'FFFF' or '1D0F' :type String
+    :return: True if the CRC is correct, else False :type Boolean
+    """
+    if end is None:
+        end = len(data)
+    if end - start < CRC_LENGTH:
+        return False
+    crc_pos = end - CRC_LENGTH
+    calculated_crc = crc_hqx(memoryview(data)[start:crc_pos], STARTING_VALUES[version])
+    return calculated_crc == (data[crc_pos] | (data[crc_pos + 1] << 8))
+
+
+def verify_many(buffers, version="FFFF"):
+    """
+    Check the trailing little-endian CRC of many buffers in one call
+    :param buffers: iterable of buffers, each ending in its CRC :type iterable of bytes-like objects
+    :param version: one of 'XModem', 'FFFF' or '1D0F' :type String
+    :return: list with True for each buffer whose CRC is correct :type List of Boolean
+    """
+    starting_value = STARTING_VALUES[version]
+    results = []
+    for data in buffers:
+        if len(data) < CRC_LENGTH:
+            results.append(False)
+        else:
+            mv = memoryview(data)
+            results.append(crc_hqx(mv[:-CRC_LENGTH], starting_value) == (mv[-2] | (mv[-1] << 8)))
+    return results
+
+
+# -----------------------------------------------------------------------------
+# RUNTIME PROCEDURE
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    """
+    Module is NOT intended to be executed stand-alone, print warning message
+    """
+    print("Module is NOT intended to be executed stand-alone")
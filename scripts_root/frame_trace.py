@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Fixed-size binary ring buffer of timestamped raw serial frames, recorded by
+the MessageHandler so that link failures in the field can be diagnosed after
+the event without enabling debug logging.  Frames are stored as raw bytes,
+formatting is only done when a trace is dumped or printed.
+"""
+# -----------------------------------------------------------------------------
+# Copyright (c) 2021, Kirintec
+#
+# -----------------------------------------------------------------------------
+"""
+OPTIONS ------------------------------------------------------------------
+None
+
+ARGUMENTS -------------------------------------------------------------
+trace_file      frame trace file written by FrameTrace.dump() to print
+"""
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# stdlib imports -------------------------------------------------------
+import argparse
+import datetime
+import logging
+import struct
+import threading
+
+# Third-party imports -----------------------------------------------
+
+
+# Our own imports ---------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# GLOBALS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# CONSTANTS
+# -----------------------------------------------------------------------------
+DIRECTION_RX = 0
+DIRECTION_TX = 1
+DIRECTION_TEXT = ["Rx", "Tx"]
+# Longest frame: header, header CRC, 255-byte payload and payload CRC
+MAX_FRAME_LENGTH = 8 + 255 + 2
+FILE_MAGIC = b"BSFT"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<4sHI")
+RECORD_HEADER = struct.Struct("<dBH")
+SLOT_LENGTH = RECORD_HEADER.size + MAX_FRAME_LENGTH
+
+# -----------------------------------------------------------------------------
+# LOCAL UTILITIES
+# -----------------------------------------------------------------------------
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+# -----------------------------------------------------------------------------
+# CLASSES
+# -----------------------------------------------------------------------------
+class HexDump:
+    """
+    Lazily formatted hex dump of a frame, for use as a logging argument so
+    that the string is only built if the record is actually emitted:
+
+        log.debug("Tx: %s", HexDump(frame))
+    """
+    __slots__ = ("_data",)
+
+    def __init__(self, data):
+        """
+        Class constructor
+        :param data: bytes to dump :type bytes-like
+        """
+        self._data = data
+
+    def __str__(self):
+        return bytes(self._data).hex(" ")
+
+
+class FrameTrace:
+    """
+    Ring buffer holding the most recent capacity frames.  Storage is a single
+    pre-allocated bytearray of fixed-size slots, each holding a record header
+    (timestamp, direction, length) followed by the raw frame, so recording a
+    frame is a pair of copies with no allocation.  Once full the oldest frame
+    is overwritten.
+    """
+    def __init__(self, capacity):
+        """
+        Class constructor
+        :param capacity: number of frames to keep :type Integer
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self._capacity = capacity
+        self._buffer = bytearray(capacity * SLOT_LENGTH)
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        """ Maximum number of frames held """
+        return self._capacity
+
+    def clear(self):
+        """
+        Discard all recorded frames
+        :return: NA
+        """
+        with self._lock:
+            self._next = 0
+            self._count = 0
+
+    def record(self, direction, frame, timestamp):
+        """
+        Record a frame, frames longer than MAX_FRAME_LENGTH are truncated
+        :param direction: DIRECTION_RX or DIRECTION_TX :type Integer
+        :param frame: raw frame :type bytes-like
+        :param timestamp: time the frame was sent/received, seconds since the epoch :type Float
+        :return: NA
+        """
+        length = min(len(frame), MAX_FRAME_LENGTH)
+        with self._lock:
+            offset = self._next * SLOT_LENGTH
+            RECORD_HEADER.pack_into(self._buffer, offset, timestamp, direction, length)
+            offset += RECORD_HEADER.size
+            self._buffer[offset:offset + length] = frame[:length]
+            self._next = (self._next + 1) % self._capacity
+            if self._count < self._capacity:
+                self._count += 1
+
+    def records(self):
+        """
+        Get a snapshot of the recorded frames, oldest first
+        :return: list of (timestamp, direction, frame) tuples :type List
+        """
+        with self._lock:
+            first = (self._next - self._count) % self._capacity
+            snapshot = []
+            for i in range(self._count):
+                offset = ((first + i) % self._capacity) * SLOT_LENGTH
+                timestamp, direction, length = RECORD_HEADER.unpack_from(self._buffer, offset)
+                offset += RECORD_HEADER.size
+                snapshot.append((timestamp, direction, bytes(self._buffer[offset:offset + length])))
+        return snapshot
+
+    def dump(self, path):
+        """
+        Write the recorded frames, oldest first, to a binary trace file
+        which may be read back with read_trace()
+        :param path: file to write :type String
+        :return: number of frames written :type Integer
+        """
+        records = self.records()
+        with open(path, "wb") as f:
+            f.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, len(records)))
+            for timestamp, direction, frame in records:
+                f.write(RECORD_HEADER.pack(timestamp, direction, len(frame)))
+                f.write(frame)
+        return len(records)
+
+
+# -----------------------------------------------------------------------------
+# FUNCTIONS
+# -----------------------------------------------------------------------------
+def read_trace(path):
+    """
+    Read a trace file written by FrameTrace.dump()
+    :param path: file to read :type String
+    :return: list of (timestamp, direction, frame) tuples, oldest first :type List
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version, count = FILE_HEADER.unpack_from(data, 0)
+    if magic != FILE_MAGIC or version != FILE_VERSION:
+        raise ValueError("{} is not a version {} frame trace file".format(path, FILE_VERSION))
+
+    records = []
+    offset = FILE_HEADER.size
+    for i in range(count):
+        timestamp, direction, length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        records.append((timestamp, direction, data[offset:offset + length]))
+        offset += length
+    return records
+
+
+def format_record(timestamp, direction, frame):
+    """
+    Format a trace record for display
+    :param timestamp: seconds since the epoch :type Float
+    :param direction: DIRECTION_RX or DIRECTION_TX :type Integer
+    :param frame: raw frame :type bytes
+    :return: formatted record :type String
+    """
+    return "{} {} {:3d}: {}".format(
+        datetime.datetime.fromtimestamp(timestamp).strftime("%H:%M:%S.%f"),
+        DIRECTION_TEXT[direction] if direction < len(DIRECTION_TEXT) else "??",
+        len(frame), HexDump(frame))
+
+
+# -----------------------------------------------------------------------------
+# RUNTIME PROCEDURE
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Print a serial frame trace file")
+    parser.add_argument("trace_file", help="frame trace file written by FrameTrace.dump()")
+    args = parser.parse_args()
+
+    for record in read_trace(args.trace_file):
+        print(format_record(*record))
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
-from serial_msg_intf import SerialMsgInterface, MsgId, MsgPayloadLen
+from serial_msg_intf import MsgId, MsgPayloadLen
+from serial_session import sessions
 import argparse
 import os
 import subprocess
@@ -17,6 +18,8 @@ MOUNT_POINT = "/mnt/sed"
 CMD_FILE_WATCHER = "/mnt/sed/admin-data/scripts/watch_active_file.sh"
 CMD_BLACKSTAR_ECM = "/mnt/sed/admin-data/apps/BlackStarECM"
 CMD_UBX_EPHEMERIDES = "/mnt/sed/admin-data/apps/ubx-ephemerides"
+CMD_EPHEMERIS_STORE = ["/usr/bin/python3", "/mnt/sed/admin-data/scripts/ephemeris_store.py", "-s", "0"]
+CMD_EPHEMERIS_DAEMON = ["/usr/bin/python3", "/mnt/sed/admin-data/scripts/ephemeris_daemon.py"]
 
 USER = "root"
 GROUP = "sed"
@@ -37,7 +40,7 @@ def get_key_from_bscm():
     if DEBUG_KEY:
         return "1234567890ABCDEFGHIJKLMNOPQRSTUV"
     else:
-        with SerialMsgInterface(SERIAL_PORT, BAUD_RATE) as smi:
+        with sessions.session(SERIAL_PORT, BAUD_RATE) as smi:
                 result, msg = smi.get_command(MsgId.GET_KEY, MsgPayloadLen.GET_KEY)
                 if result:
                     payload_version, key = smi.unpack_get_key_response(msg)
@@ -49,7 +52,7 @@ def get_key_from_bscm():
     return None
 
 def send_key_to_bscm(key):
-    with SerialMsgInterface(SERIAL_PORT, BAUD_RATE) as smi:
+    with sessions.session(SERIAL_PORT, BAUD_RATE) as smi:
         key_ba = bytearray()
         key_ba.extend(map(ord, key))
         return smi.send_set_key(key_ba)
@@ -180,18 +183,16 @@ if __name__ == "__main__":
     else:
         print("no SED detected")
 
+    # Finished with the backplane, release the serial port
+    sessions.close_all()
+
     if not locked:
-        # If SED has been detected and unlocked then remove all previous ephemeris files
-        if False:
-            ephem_dir = "/mnt/sed/admin-data/ephem"
-            for filename in os.listdir(ephem_dir):
-                filepath = os.path.join(ephem_dir, filename)
-                try:
-                    if os.path.isfile(filepath):
-                        os.unlink(filepath)
-                except Exception as e:
-                    print("Failed to delete {}: {}".format(filepath, e))
-        
+        # If SED has been detected and unlocked then merge the ephemeris files from previous runs into
+        # the ephemeris store, evicting old ephemerides, before ubx-ephemerides starts adding more
+        print("compacting ephemeris files...")
+        if subprocess.call(CMD_EPHEMERIS_STORE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) != 0:
+            print("ephemeris compaction failed")
+
         # Now run the apps which should never exit
         print("starting BlackStar file watcher...")
         proc1 = subprocess.Popen(CMD_FILE_WATCHER, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -201,6 +202,11 @@ if __name__ == "__main__":
         time.sleep(2)
         print("starting ubx-ephemerides...")
         proc3 = subprocess.Popen(CMD_UBX_EPHEMERIDES, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # Pre-generate the ephemeris files gnss_spoof needs from the nav files ubx-ephemerides writes. It
+        # runs as root to see which nav files ubx-ephemerides has open, the cache it shares with
+        # app_launcher (run as blackstar) is group writable
+        print("starting ephemeris daemon...")
+        proc4 = subprocess.Popen(CMD_EPHEMERIS_DAEMON, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         while True:
             time.sleep(1)
             if proc1.poll():
@@ -212,6 +218,9 @@ if __name__ == "__main__":
             if proc3.poll():
                 # Process 2 ended
                 print("{} ended".format(CMD_UBX_EPHEMERIDES))
+            if proc4.poll():
+                # Process 4 ended
+                print("{} ended".format(CMD_EPHEMERIS_DAEMON[1]))
 
     # If we reach this point then spin here, slowly
     print("spinning...")
@@ -0,0 +1,705 @@
+#!/usr/bin/env python3
+"""
+Single-threaded gateway serving any number of serial ports using the
+Blackstar serial protocol specified in KT-957-0143-00 to local clients over
+a Unix socket.  All serial ports and client connections are multiplexed with
+selectors, so adding ports adds no threads.  Each port has its own protocol
+state (sequence numbers, Ack/Nack generation, parser, statistics), shared by
+every client using the port.
+"""
+# -----------------------------------------------------------------------------
+# Copyright (c) 2021, Kirintec
+#
+# -----------------------------------------------------------------------------
+"""
+OPTIONS ------------------------------------------------------------------
+-s, --socket    Unix socket path to listen on
+-p, --port      serial port to open at start up, as device[:baud], may be repeated
+
+ARGUMENTS -------------------------------------------------------------
+None
+
+CLIENT PROTOCOL ----------------------------------------------------------
+Every record, in both directions, is a RECORD_HEADER (opcode, port ID,
+body length) followed by the body:
+OPEN    body: baud rate (uint32) + port device name; reply OPENED with the port ID
+SEND    body: status, message ID, sequence no + payload; the gateway builds the
+        frame, allocating a sequence number unless the status is RETRANSMIT,
+        and replies SENT with the sequence number (one byte)
+RX      sent by the gateway: a received frame.  Acks and responses go to the
+        client which sent the command, other frames to every client of the port
+ERROR   sent by the gateway: UTF-8 error text, in reply to a record which failed or
+        to every client of a port whose serial port has failed
+"""
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# stdlib imports -------------------------------------------------------
+import argparse
+import collections
+import logging
+import os
+import selectors
+import socket
+import struct
+import time
+
+# Third-party imports -----------------------------------------------
+import serial
+
+# Our own imports ---------------------------------------------------
+from crc_ccitt import append_crc
+from serial_message_handler import MessageHandler, MessageStatus, HeaderOffset
+
+# -----------------------------------------------------------------------------
+# GLOBALS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# CONSTANTS
+# -----------------------------------------------------------------------------
+DEFAULT_SOCKET_PATH = "/tmp/blackstar_serial_gateway.sock"
+DEFAULT_BAUD_RATE = 115200
+RECORD_HEADER = struct.Struct("<BBH")
+OPEN_HEADER = struct.Struct("<I")
+SEND_HEADER = struct.Struct("<BBB")
+OP_OPEN = 0x01
+OP_SEND = 0x02
+OP_OPENED = 0x81
+OP_SENT = 0x82
+OP_RX = 0x83
+OP_ERROR = 0xFF
+READ_SIZE = 4096
+# A client which stops reading is disconnected once this much is queued for it
+MAX_CLIENT_BACKLOG = 1 << 20
+
+# -----------------------------------------------------------------------------
+# LOCAL UTILITIES
+# -----------------------------------------------------------------------------
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+# -----------------------------------------------------------------------------
+# CLASSES
+# -----------------------------------------------------------------------------
+class GatewayPort(MessageHandler):
+    """
+    Protocol state for one serial port served by a SerialGateway.  The port
+    is read and written, non-blocking, when the gateway's selector reports it
+    ready; framing, Ack/Nack handling and statistics are shared with
+    MessageHandler.  Received messages are passed to on_message rather than
+    an rx queue.
+    """
+    def __init__(self, port_id, selector, on_message, trace_size=0, on_failure=None):
+        """
+        Class constructor
+        :param port_id: gateway port ID :type Integer
+        :param selector: the gateway's selector :type selectors.BaseSelector
+        :param on_message: called with (port, msg) for each received message :type Callable
+        :param trace_size: number of frames to keep in the frame trace, 0 to disable :type Integer
+        :param on_failure: called with (port, error) once the port has been stopped
+                           after a read or write fails :type Callable
+        """
+        super().__init__(trace_size)
+        self.port_id = port_id
+        self.serial_port = None
+        self.baud_rate = None
+        self._selector = selector
+        self._on_message = on_message
+        self._on_failure = on_failure
+        self._fd = None
+        self._tx_pending = bytearray()
+
+    def start(self, serial_port, baud_rate):
+        """
+        Open the serial port and register it with the selector
+        :param serial_port: serial port device name :type String
+        :param baud_rate: baud rate :type Integer
+        :return: True if started, else False :type: Boolean
+        """
+        try:
+            self._serial_device = serial.Serial(serial_port, baud_rate, timeout=0,
+                                                xonxoff=False, rtscts=True, dsrdtr=False)
+            try:
+                self._serial_device.rts = False # Set RTS to 0 to enable EPU RS-422 transmitter
+            except OSError:
+                # Pseudo-terminals, e.g. a backplane simulator, have no modem control lines
+                log.warning("Unable to set RTS on {}".format(serial_port))
+
+            self.serial_port = serial_port
+            self.baud_rate = baud_rate
+            self._event.clear()
+            self._reset_stats()
+            self._fd = self._serial_device.fileno()
+            os.set_blocking(self._fd, False)
+            self._selector.register(self._fd, selectors.EVENT_READ, self)
+
+        except Exception as ex:
+            self._event.set()
+            if self._serial_device is not None:
+                self._serial_device.close()
+            log.critical("Failed to start GatewayPort on {}: {}".format(serial_port, ex))
+            return False
+
+        return True
+
+    def stop(self):
+        """
+        Unregister from the selector and close the serial port
+        :return: NA
+        """
+        if self._fd is not None and not self._event.is_set():
+            self._event.set()
+            self._selector.unregister(self._fd)
+            self._serial_device.close()
+            self._fd = None
+
+    def send_to_tx_queue(self, msg):
+        """
+        Add a message to the tx queue, it is written when the port is writable
+        :param msg: message to be sent :type ByteArray
+        :return: NA
+        """
+        with self._tx_thread_lock:
+            self._tx_queue.append(msg)
+            if len(self._tx_queue) > self._max_tx_queue_depth:
+                self._max_tx_queue_depth = len(self._tx_queue)
+        if self._fd is not None and not self._tx_pending:
+            self._selector.modify(self._fd, selectors.EVENT_READ | selectors.EVENT_WRITE, self)
+
+    def _queue_rx_message(self, msg):
+        """
+        Pass a received message to the gateway for routing
+        :param msg: received message :type bytearray
+        :return: NA
+        """
+        self._on_message(self, msg)
+
+    def on_ready(self, events):
+        """
+        Selector callback, service the port
+        :param events: ready events :type Integer
+        :return: NA
+        """
+        if events & selectors.EVENT_READ:
+            self.__read()
+        if events & selectors.EVENT_WRITE and self._fd is not None:
+            self.__write()
+
+    def __read(self):
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as ex:
+            log.critical("Serial port {} read failed: {}".format(self.serial_port, ex))
+            self.__fail(ex)
+            return
+
+        if data:
+            self._record_rx(len(data))
+            for msg, crc_ok in self._parser.parse(data):
+                self._process_rx_message(msg, crc_ok)
+
+    def __write(self):
+        if not self._tx_pending:
+            with self._tx_thread_lock:
+                messages_to_send = list(self._tx_queue)
+                self._tx_queue.clear()
+            for msg in messages_to_send:
+                self._tx_pending += msg
+            if messages_to_send:
+                self._record_tx(messages_to_send, len(self._tx_pending))
+
+        try:
+            written = os.write(self._fd, self._tx_pending)
+        except BlockingIOError:
+            written = 0
+        except OSError as ex:
+            log.critical("Serial port {} write failed: {}".format(self.serial_port, ex))
+            self.__fail(ex)
+            return
+        del self._tx_pending[:written]
+
+        if not self._tx_pending and not self._tx_queue:
+            self._selector.modify(self._fd, selectors.EVENT_READ, self)
+
+
+    def __fail(self, ex):
+        self.stop()
+        if self._on_failure is not None:
+            self._on_failure(self, ex)
+
+
+class ClientConnection:
+    """
+    A client connected to a SerialGateway
+    """
+    def __init__(self, sock):
+        """
+        Class constructor
+        :param sock: connected, non-blocking socket :type socket.socket
+        """
+        self.sock = sock
+        self.connected = True
+        self.rx_buffer = bytearray()
+        self.tx_buffer = bytearray()
+        self.port_ids = set()
+
+
+class SerialGateway:
+    """
+    Gateway serving serial ports to clients connected to a Unix socket, see
+    CLIENT PROTOCOL above.  serve_forever() runs the gateway in the calling
+    thread until stop() is called from any thread.
+    """
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, trace_size=0):
+        """
+        Class constructor
+        :param socket_path: Unix socket path to listen on :type String
+        :param trace_size: frame trace size for each port, 0 to disable :type Integer
+        """
+        self._socket_path = socket_path
+        self._trace_size = trace_size
+        self._selector = selectors.DefaultSelector()
+        self._ports = {}
+        self._port_ids = {}
+        self._clients = {}
+        # Per port, the client which sent each sequence number
+        self._owners = {}
+        self._listener = None
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._running = False
+
+    @property
+    def ports(self):
+        """ Dictionary of open GatewayPorts keyed by port ID """
+        return dict(self._ports)
+
+    def open_port(self, serial_port, baud_rate=DEFAULT_BAUD_RATE):
+        """
+        Open a serial port, or get the ID of the port if it is already open
+        :param serial_port: serial port device name :type String
+        :param baud_rate: baud rate :type Integer
+        :return: port ID :type Integer
+        """
+        port_id = self._port_ids.get(serial_port)
+        if port_id is not None:
+            if self._ports[port_id].baud_rate != baud_rate:
+                raise ValueError("{} already open at {} baud".format(serial_port, self._ports[port_id].baud_rate))
+            return port_id
+
+        port_id = next(i for i in range(256) if i not in self._ports)
+        port = GatewayPort(port_id, self._selector, self.__route_message, self._trace_size, self.__port_failed)
+        if not port.start(serial_port, baud_rate):
+            raise RuntimeError("Failed to open {}".format(serial_port))
+        self._ports[port_id] = port
+        self._port_ids[serial_port] = port_id
+        self._owners[port_id] = {}
+        log.info("Opened {} at {} baud as port {}".format(serial_port, baud_rate, port_id))
+        return port_id
+
+    def close_port(self, port_id):
+        """
+        Close a serial port
+        :param port_id: port ID returned by open_port :type Integer
+        :return: NA
+        """
+        port = self._ports.pop(port_id)
+        del self._port_ids[port.serial_port]
+        del self._owners[port_id]
+        port.stop()
+        for client in self._clients.values():
+            client.port_ids.discard(port_id)
+
+    def serve_forever(self):
+        """
+        Listen for clients and service serial ports until stop() is called
+        :return: NA
+        """
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self._socket_path)
+        self._listener.listen()
+        self._listener.setblocking(False)
+        self._selector.register(self._listener, selectors.EVENT_READ, self.__accept)
+        self._wake_r.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._running = True
+        log.info("Serial gateway listening on {}".format(self._socket_path))
+
+        try:
+            while self._running:
+                for key, events in self._selector.select():
+                    if key.data is None:
+                        self._wake_r.recv(READ_SIZE)
+                    elif isinstance(key.data, GatewayPort):
+                        key.data.on_ready(events)
+                    elif isinstance(key.data, ClientConnection):
+                        self.__service_client(key.data, events)
+                    else:
+                        key.data()
+        finally:
+            self.__shutdown()
+
+    def stop(self):
+        """
+        Stop serve_forever(), may be called from any thread
+        :return: NA
+        """
+        self._running = False
+        self._wake_w.send(b"\x00")
+
+    def __shutdown(self):
+        for port_id in list(self._ports):
+            self.close_port(port_id)
+        for client in list(self._clients.values()):
+            self.__drop_client(client)
+        self._selector.unregister(self._listener)
+        self._selector.unregister(self._wake_r)
+        self._listener.close()
+        self._listener = None
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        log.info("Serial gateway stopped")
+
+    def __accept(self):
+        sock, _ = self._listener.accept()
+        sock.setblocking(False)
+        client = ClientConnection(sock)
+        self._clients[sock.fileno()] = client
+        self._selector.register(sock, selectors.EVENT_READ, client)
+        log.debug("Client connected")
+
+    def __drop_client(self, client):
+        if not client.connected:
+            return
+        client.connected = False
+        self._selector.unregister(client.sock)
+        del self._clients[client.sock.fileno()]
+        client.sock.close()
+        # Nothing more is sent to or read from a dropped client
+        client.tx_buffer.clear()
+        client.rx_buffer.clear()
+        for owners in self._owners.values():
+            for seq_no in [seq_no for seq_no, owner in owners.items() if owner is client]:
+                del owners[seq_no]
+        log.debug("Client disconnected")
+
+    def __send_record(self, client, opcode, port_id, body=b""):
+        """
+        Queue a record for a client
+        :param client: client to send to :type ClientConnection
+        :param opcode: record opcode :type Integer
+        :param port_id: port ID :type Integer
+        :param body: record body :type bytes-like
+        :return: NA
+        """
+        if not client.connected:
+            return
+        if not client.tx_buffer:
+            self._selector.modify(client.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+        client.tx_buffer += RECORD_HEADER.pack(opcode, port_id, len(body))
+        client.tx_buffer += body
+        if len(client.tx_buffer) > MAX_CLIENT_BACKLOG:
+            log.error("Client backlog exceeded, disconnecting")
+            self.__drop_client(client)
+
+    def __service_client(self, client, events):
+        if events & selectors.EVENT_READ:
+            try:
+                data = client.sock.recv(READ_SIZE)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError:
+                data = b""
+            if data == b"":
+                self.__drop_client(client)
+                return
+            if data:
+                client.rx_buffer += data
+                self.__process_client_records(client)
+
+        if events & selectors.EVENT_WRITE and client.connected:
+            try:
+                sent = client.sock.send(client.tx_buffer)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError:
+                self.__drop_client(client)
+                return
+            del client.tx_buffer[:sent]
+            if not client.tx_buffer:
+                self._selector.modify(client.sock, selectors.EVENT_READ, client)
+
+    def __process_client_records(self, client):
+        buf = client.rx_buffer
+        pos = 0
+        while len(buf) - pos >= RECORD_HEADER.size:
+            opcode, port_id, length = RECORD_HEADER.unpack_from(buf, pos)
+            if len(buf) - pos - RECORD_HEADER.size < length:
+                break
+            body = buf[pos + RECORD_HEADER.size:pos + RECORD_HEADER.size + length]
+            pos += RECORD_HEADER.size + length
+            try:
+                self.__process_client_record(client, opcode, port_id, body)
+            except Exception as ex:
+                self.__send_record(client, OP_ERROR, port_id, str(ex).encode("utf8"))
+            if not client.connected:
+                return
+        del buf[:pos]
+
+    def __process_client_record(self, client, opcode, port_id, body):
+        if opcode == OP_OPEN:
+            baud_rate, = OPEN_HEADER.unpack_from(body)
+            port_id = self.open_port(body[OPEN_HEADER.size:].decode("utf8"), baud_rate)
+            client.port_ids.add(port_id)
+            self.__send_record(client, OP_OPENED, port_id)
+
+        elif opcode == OP_SEND:
+            port = self._ports.get(port_id)
+            if port is None or port_id not in client.port_ids:
+                raise ValueError("Port {} is not open".format(port_id))
+            status, msg_id, seq_no = SEND_HEADER.unpack_from(body)
+            payload = body[SEND_HEADER.size:]
+            if status != MessageStatus.RETRANSMIT.value:
+                seq_no = port.get_next_sequence_number()
+            msg = MessageHandler.build_message_header(seq_no, 0, status, msg_id, len(payload))
+            if payload:
+                payload_start = len(msg)
+                msg += payload
+                append_crc(msg, payload_start)
+            self._owners[port_id][seq_no] = client
+            port.send_to_tx_queue(msg)
+            self.__send_record(client, OP_SENT, port_id, bytes([seq_no]))
+
+        else:
+            raise ValueError("Unknown opcode 0x{:02x}".format(opcode))
+
+    def __port_failed(self, port, ex):
+        """
+        Close a serial port which has failed and tell its clients, later
+        SENDs to the port get an error reply
+        :param port: the failed port, already stopped :type GatewayPort
+        :param ex: the error :type OSError
+        :return: NA
+        """
+        clients = [client for client in self._clients.values() if port.port_id in client.port_ids]
+        self.close_port(port.port_id)
+        for client in clients:
+            self.__send_record(client, OP_ERROR, port.port_id,
+                               "Port {} ({}) failed: {}".format(port.port_id, port.serial_port, ex).encode("utf8"))
+
+    def __route_message(self, port, msg):
+        """
+        Deliver a received message: Acks and responses to the client which
+        sent the command, anything else to every client using the port
+        :param port: port the message was received on :type GatewayPort
+        :param msg: received message :type bytearray
+        :return: NA
+        """
+        status = msg[HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] >> 5
+        owner = None
+        if status >= MessageStatus.ACKNOWLEDGE.value:
+            owner = self._owners[port.port_id].get(msg[HeaderOffset.ACKNOWLEDGEMENT_NO.value])
+
+        if owner is not None:
+            self.__send_record(owner, OP_RX, port.port_id, msg)
+        else:
+            for client in list(self._clients.values()):
+                if port.port_id in client.port_ids:
+                    self.__send_record(client, OP_RX, port.port_id, msg)
+
+
+class GatewayClient:
+    """
+    Blocking client for a SerialGateway.  Received frames which arrive while
+    waiting for a reply are buffered and returned by receive().
+    """
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH):
+        """
+        Class constructor
+        :param socket_path: gateway Unix socket path :type String
+        """
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+        self._rx_buffer = bytearray()
+        self._rx_frames = collections.deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Disconnect from the gateway
+        :return: NA
+        """
+        self._sock.close()
+
+    def __send_record(self, opcode, port_id, body):
+        self._sock.sendall(RECORD_HEADER.pack(opcode, port_id, len(body)) + body)
+
+    def __read_record(self, timeout):
+        """
+        Read the next record from the gateway
+        :param timeout: timeout in seconds, None to block :type Float
+        :return: (opcode, port ID, body), or None if the timeout expired :type Tuple
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if len(self._rx_buffer) >= RECORD_HEADER.size:
+                opcode, port_id, length = RECORD_HEADER.unpack_from(self._rx_buffer)
+                end = RECORD_HEADER.size + length
+                if len(self._rx_buffer) >= end:
+                    body = bytearray(self._rx_buffer[RECORD_HEADER.size:end])
+                    del self._rx_buffer[:end]
+                    return opcode, port_id, body
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._sock.settimeout(remaining)
+            else:
+                self._sock.settimeout(None)
+            try:
+                data = self._sock.recv(READ_SIZE)
+            except socket.timeout:
+                return None
+            if not data:
+                raise ConnectionError("Gateway closed the connection")
+            self._rx_buffer += data
+
+    def __wait_reply(self, reply_opcode):
+        while True:
+            opcode, port_id, body = self.__read_record(None)
+            if opcode == reply_opcode:
+                return port_id, body
+            elif opcode == OP_RX:
+                self._rx_frames.append((port_id, body))
+            elif opcode == OP_ERROR:
+                raise RuntimeError("Gateway error: {}".format(body.decode("utf8", errors="replace")))
+
+    def open_port(self, serial_port, baud_rate=DEFAULT_BAUD_RATE):
+        """
+        Open a serial port on the gateway, or join it if already open
+        :param serial_port: serial port device name :type String
+        :param baud_rate: baud rate :type Integer
+        :return: port ID :type Integer
+        """
+        self.__send_record(OP_OPEN, 0, OPEN_HEADER.pack(baud_rate) + serial_port.encode("utf8"))
+        port_id, _ = self.__wait_reply(OP_OPENED)
+        return port_id
+
+    def send(self, port_id, msg_id, payload=b"", status=MessageStatus.NEW_MESSAGE.value, seq_no=0):
+        """
+        Send a message, the gateway builds the header and CRCs
+        :param port_id: port ID returned by open_port :type Integer
+        :param msg_id: message ID :type Integer
+        :param payload: payload including the payload version byte :type bytes-like
+        :param status: message status :type Integer
+        :param seq_no: sequence number to reuse, RETRANSMIT status only :type Integer
+        :return: sequence number of the message sent :type Integer
+        """
+        self.__send_record(OP_SEND, port_id, SEND_HEADER.pack(status, msg_id, seq_no) + bytes(payload))
+        _, body = self.__wait_reply(OP_SENT)
+        return body[0]
+
+    def receive(self, timeout=None):
+        """
+        Get the next frame received from any port this client has opened
+        :param timeout: timeout in seconds, None to block :type Float
+        :return: (port ID, frame), or None if the timeout expired :type Tuple
+        """
+        if self._rx_frames:
+            return self._rx_frames.popleft()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            record = self.__read_record(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            if record is None:
+                return None
+            opcode, port_id, body = record
+            if opcode == OP_RX:
+                return port_id, body
+            elif opcode == OP_ERROR:
+                raise RuntimeError("Gateway error: {}".format(body.decode("utf8", errors="replace")))
+
+    def transact(self, port_id, msg_id, payload=b"", expect_response=False, timeout=2.0):
+        """
+        Send a command and wait for its Ack and, optionally, its response.
+        Frames for other commands received meanwhile are kept for receive()
+        :param port_id: port ID returned by open_port :type Integer
+        :param msg_id: message ID :type Integer
+        :param payload: payload including the payload version byte :type bytes-like
+        :param expect_response: True to wait for a response after the Ack :type Boolean
+        :param timeout: overall timeout in seconds :type Float
+        :return: [0] True if Acked (and response received); [1] response or None
+        """
+        seq_no = self.send(port_id, msg_id, payload)
+        deadline = time.monotonic() + timeout
+        acked = False
+        others = []
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False, None
+                record = self.__read_record(remaining)
+                if record is None:
+                    return False, None
+                opcode, rx_port_id, frame = record
+                if opcode != OP_RX:
+                    continue
+                if rx_port_id != port_id or frame[HeaderOffset.ACKNOWLEDGEMENT_NO.value] != seq_no or \
+                        frame[HeaderOffset.MESSAGE_ID.value] != msg_id:
+                    others.append((rx_port_id, frame))
+                    continue
+                status = frame[HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] >> 5
+                if status == MessageStatus.NOT_ACKNOWLEDGE.value:
+                    return False, None
+                elif status == MessageStatus.ACKNOWLEDGE.value:
+                    acked = True
+                    if not expect_response:
+                        return True, None
+                elif acked and status == MessageStatus.RESPONSE_OK.value:
+                    return True, frame
+                else:
+                    others.append((rx_port_id, frame))
+        finally:
+            self._rx_frames.extend(others)
+
+
+# -----------------------------------------------------------------------------
+# FUNCTIONS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# RUNTIME PROCEDURE
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Blackstar serial protocol gateway")
+    parser.add_argument("-s", "--socket", default=DEFAULT_SOCKET_PATH, help="Unix socket path to listen on")
+    parser.add_argument("-p", "--port", action="append", default=[],
+                        help="serial port to open at start up, as device[:baud], may be repeated")
+    args = parser.parse_args()
+
+    fmt = "%(asctime)s: %(message)s"
+    logging.basicConfig(format=fmt, level=logging.INFO, datefmt="%H:%M:%S")
+
+    gateway = SerialGateway(args.socket)
+    for port_arg in args.port:
+        device, _, baud = port_arg.partition(":")
+        gateway.open_port(device, int(baud) if baud else DEFAULT_BAUD_RATE)
+    try:
+        gateway.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -22,20 +22,19 @@ None
 # -----------------------------------------------------------------------------
 
 # stdlib imports -------------------------------------------------------
-import queue
 import threading
-from threading import Lock
-from enum import Enum, auto, unique
+from threading import Condition, Lock
+from enum import Enum
 import logging
-import struct
 import collections
 import time
 
 # Third-party imports -----------------------------------------------
-from PyCRC.CRCCCITT import CRCCCITT
 import serial
 
 # Our own imports ---------------------------------------------------
+from crc_ccitt import append_crc, check_crc, crc_ccitt
+from frame_trace import FrameTrace, HexDump, DIRECTION_RX, DIRECTION_TX
 
 
 # -----------------------------------------------------------------------------
@@ -59,6 +58,8 @@ MESSAGE_STATUS_TEXT = ['NewMessage',
                        'ResponseNotOk',
                        'Invalid (0x6)',
                        'Invalid (0x7)']
+# Latency histogram buckets, bucket n counts latencies below 2^n microseconds
+LATENCY_BUCKETS = 24
 
 # -----------------------------------------------------------------------------
 # LOCAL UTILITIES
@@ -70,17 +71,6 @@ log.addHandler(logging.NullHandler())
 # -----------------------------------------------------------------------------
 # CLASSES
 # -----------------------------------------------------------------------------
-@unique
-class MessageHandlerRxState(Enum):
-    """ Enumeration class for rx state machine """
-    IDLE = auto()
-    RECEIVING_HEADER = auto()
-    AWAITING_HEADER_CRC = auto()
-    RECEIVING_PAYLOAD = auto()
-    AWAITING_PAYLOAD_CRC = auto()
-    MESSAGE_COMPLETE = auto()
-
-
 class MessageStatus(Enum):
     """ Enumeration class for message status """
     NEW_MESSAGE = 0x0
@@ -115,25 +105,278 @@ class Header:
     crc:    int = -1
 
 
+class LatencyHistogram:
+    """
+    Histogram of latencies with power-of-two microsecond buckets, cheap
+    enough to update for every frame.  Percentiles are reported as the upper
+    bound of the bucket they fall in.
+    """
+    def __init__(self):
+        """ Class constructor """
+        self._counts = [0] * LATENCY_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def clear(self):
+        """
+        Discard all samples
+        :return: NA
+        """
+        self._counts = [0] * LATENCY_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        """
+        Add a sample
+        :param latency: latency in seconds :type Float
+        :return: NA
+        """
+        self._counts[min(LATENCY_BUCKETS - 1, int(latency * 1e6).bit_length())] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, fraction):
+        """
+        Get an upper bound for a percentile of the samples
+        :param fraction: percentile as a fraction, e.g. 0.99 :type Float
+        :return: latency in seconds, None if there are no samples :type Float
+        """
+        if not self.count:
+            return None
+        target = fraction * self.count
+        cumulative = 0
+        for bucket, count in enumerate(self._counts):
+            cumulative += count
+            if count and cumulative >= target:
+                return min(self.max, (1 << bucket) / 1e6)
+        return self.max
+
+    def as_dict(self):
+        """
+        Get the histogram contents
+        :return: dictionary of sample count, mean, p50, p99 and max in seconds
+                 and the non-empty buckets keyed by upper bound in
+                 microseconds :type Dict
+        """
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else None,
+                "p50": self.percentile(0.5),
+                "p99": self.percentile(0.99),
+                "max": self.max,
+                "buckets_us": {1 << bucket: count for bucket, count in enumerate(self._counts) if count}}
+
+
+class MessageWaiter:
+    """
+    Represents a caller waiting for a specific message, identified by the
+    acknowledgement number and message ID it will carry.  The rx thread
+    completes the waiter as soon as a matching message has been parsed.
+    """
+    def __init__(self, ack_no, msg_id, statuses, msg_len=None, event=None):
+        """
+        Class constructor
+        :param ack_no: expected acknowledgement number :type Integer
+        :param msg_id: expected message ID :type Integer
+        :param statuses: acceptable message status values :type collection of Integer
+        :param msg_len: expected total message length, None for any length :type Integer
+        :param event: event to set on completion, may be shared by several
+                      waiters so that a caller can wait for any of them :type threading.Event
+        """
+        self.ack_no = ack_no
+        self.msg_id = msg_id
+        self.statuses = statuses
+        self.msg_len = msg_len
+        self.msg = None
+        self.completed_at = None
+        self._event = event if event is not None else threading.Event()
+
+    @property
+    def done(self):
+        """ True once the waiter has been completed """
+        return self.msg is not None
+
+    def matches(self, msg):
+        """
+        Check whether a received message is the one being waited for
+        :param msg: received message :type bytearray
+        :return: True if the message matches, else False :type Boolean
+        """
+        return (msg[HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] >> 5) in self.statuses and \
+            (self.msg_len is None or len(msg) == self.msg_len)
+
+    def complete(self, msg):
+        """
+        Complete the waiter with the matching message, waking the waiting thread
+        :param msg: received message :type bytearray
+        :return: NA
+        """
+        self.completed_at = time.monotonic()
+        self.msg = msg
+        self._event.set()
+
+    def wait(self, timeout):
+        """
+        Block until the waiter has been completed or the timeout expires
+        :param timeout: timeout in seconds :type Float
+        :return: the matching message, or None if timed out :type bytearray
+        """
+        self._event.wait(timeout)
+        return self.msg
+
+
+class MessageParser:
+    """
+    Incremental frame parser for the rx path.  Received bytes are appended to
+    a reusable buffer which is scanned using offsets, so a burst of bytes is
+    parsed in one pass and bytes consumed by complete frames (or discarded
+    while searching for a start of frame) are only trimmed once per call.
+
+    Resynchronisation follows the original rx state machine: bytes are
+    skipped until a start of frame is found and a header with a bad CRC is
+    discarded in its entirety.  The number of bytes discarded and of header
+    and payload CRC failures are counted.
+    """
+    def __init__(self):
+        """ Class constructor """
+        self._buffer = bytearray()
+        self._frame_length = 0
+        self.header_crc_errors = 0
+        self.payload_crc_errors = 0
+        self.resync_bytes = 0
+
+    def reset(self):
+        """
+        Discard any partially received frame and zero the counters
+        :return: NA
+        """
+        self._buffer.clear()
+        self._frame_length = 0
+        self.header_crc_errors = 0
+        self.payload_crc_errors = 0
+        self.resync_bytes = 0
+
+    def parse(self, data):
+        """
+        Add received bytes to the parse buffer and extract all complete frames
+        :param data: bytes read from the serial port :type bytes
+        :return: list of (frame, crc_ok) tuples, crc_ok is False for frames
+                 whose payload CRC check failed and which should be Nacked
+        """
+        buf = self._buffer
+        buf += data
+        end = len(buf)
+        pos = 0
+        frames = []
+
+        while pos < end:
+            # _frame_length is non-zero if the header at pos has already been
+            # validated on a previous call and we are waiting for the payload
+            frame_length = self._frame_length
+
+            if not frame_length:
+                if buf[pos] != START_OF_FRAME:
+                    sof = buf.find(START_OF_FRAME, pos)
+                    if sof < 0:
+                        self.resync_bytes += end - pos
+                        pos = end
+                        break
+                    self.resync_bytes += sof - pos
+                    pos = sof
+
+                if end - pos < TOTAL_HEADER_LENGTH:
+                    break
+
+                if not check_crc(buf, pos, pos + TOTAL_HEADER_LENGTH):
+                    # Need to go back to idle and find the start again
+                    log.error("Header CRC: calculated {}; received {}".format(
+                        hex(crc_ccitt(bytes(buf[pos:pos + HEADER_LENGTH]))),
+                        hex(buf[pos + HEADER_LENGTH] | (buf[pos + HEADER_LENGTH + 1] << 8))))
+                    self.header_crc_errors += 1
+                    self.resync_bytes += TOTAL_HEADER_LENGTH
+                    pos += TOTAL_HEADER_LENGTH
+                    continue
+
+                payload_length = buf[pos + HeaderOffset.PAYLOAD_LENGTH.value]
+                frame_length = TOTAL_HEADER_LENGTH
+                if payload_length != 0:
+                    frame_length += payload_length + CRC_LENGTH
+                self._frame_length = frame_length
+
+            if end - pos < frame_length:
+                break
+
+            self._frame_length = 0
+            msg = buf[pos:pos + frame_length]
+            pos += frame_length
+            crc_ok = True
+
+            if frame_length > TOTAL_HEADER_LENGTH and not check_crc(msg, TOTAL_HEADER_LENGTH):
+                log.error("Payload CRC: calculated {}; received {}".format(
+                    hex(crc_ccitt(bytes(msg[TOTAL_HEADER_LENGTH:frame_length - CRC_LENGTH]))),
+                    hex(msg[frame_length - CRC_LENGTH] | (msg[frame_length - 1] << 8))))
+                self.payload_crc_errors += 1
+                crc_ok = False
+
+            frames.append((msg, crc_ok))
+
+        del buf[:pos]
+        return frames
+
+
 class MessageHandler:
     """
     Class for handling serial messages using the Blackstar serial protocol
     specified in KT-957-0143-00, sets up tx/rx threads which use
     queues to pass messages between the application and a serial port.
 
-    The rx thread operates as a state machine that is stepped through as
-    bytes are received on te serial interface.  The rx state machine automatically
+    The rx thread reads received bytes in bulk and passes them to a
+    MessageParser to extract complete frames.  The rx thread automatically
     handles sending Ack/Nacks in response to received messages.
+
+    Link statistics are always collected, see get_link_stats().  If
+    trace_size is non-zero the most recent frames in both directions are
+    also kept in a FrameTrace which can be written out with dump_trace().
     """
-    def __init__(self):
-        """ Class constructor """
+    def __init__(self, trace_size=0):
+        """
+        Class constructor
+        :param trace_size: number of frames to keep in the frame trace, 0 to disable :type Integer
+        """
         self._next_sequence_number = 255
+        self._sequence_number_lock = Lock()
+        self._next_rx_sequence_number = None
+        self._parser = MessageParser()
+        self._trace = FrameTrace(trace_size) if trace_size else None
+        self._stats_lock = Lock()
+        self._rx_frames = 0
+        self._rx_bytes = 0
+        self._rx_unclaimed = 0
+        self._acks_received = 0
+        self._nacks_received = 0
+        self._nacks_sent = 0
+        self._sequence_errors = 0
+        self._max_tx_queue_depth = 0
+        self._tx_times = {}
+        self._ack_latency = LatencyHistogram()
+        self._response_latency = LatencyHistogram()
         self._tx_queue = collections.deque()
         self._rx_queue = collections.deque()
         self._rx_thread = None
         self._rx_thread_lock = Lock()
+        self._waiters = {}
+        self._waiters_lock = Lock()
         self._tx_thread = None
         self._tx_thread_lock = Lock()
+        self._tx_condition = Condition(self._tx_thread_lock)
+        self._tx_frames = 0
+        self._tx_bytes = 0
+        self._tx_writes = 0
+        self._tx_frames_per_write = collections.Counter()
         self._event = threading.Event()
         self._serial_device = None
         self._message_statuses_to_acknowledge = [MessageStatus.NEW_MESSAGE.value,
@@ -153,8 +396,134 @@ class MessageHandler:
         :param msg: message to be sent :type ByteArray
         :return: NA
         """
-        with self._tx_thread_lock:
+        with self._tx_condition:
             self._tx_queue.append(msg)
+            if len(self._tx_queue) > self._max_tx_queue_depth:
+                self._max_tx_queue_depth = len(self._tx_queue)
+            self._tx_condition.notify()
+
+    def get_tx_stats(self):
+        """
+        Get the tx thread counters
+        :return: dictionary of frames and bytes written, number of serial
+                 writes and a histogram of frames coalesced per write :type Dict
+        """
+        with self._tx_thread_lock:
+            return {"frames": self._tx_frames,
+                    "bytes": self._tx_bytes,
+                    "writes": self._tx_writes,
+                    "frames_per_write": dict(self._tx_frames_per_write)}
+
+    @property
+    def rx_queue_depth(self):
+        """ Number of received messages waiting in the rx queue """
+        return len(self._rx_queue)
+
+    @property
+    def trace(self):
+        """ The FrameTrace, None if tracing is disabled """
+        return self._trace
+
+    def get_link_stats(self):
+        """
+        Get the link statistics
+        :return: dictionary of tx stats (see get_tx_stats), rx frame/byte
+                 counts, Acks and Nacks received, Nacks sent, received frames
+                 not claimed by a waiter, header and payload CRC failures,
+                 bytes discarded while resynchronising, rx sequence number
+                 errors, queue depths and Ack/response latency histograms
+                 (see LatencyHistogram.as_dict) :type Dict
+        """
+        stats = self.get_tx_stats()
+        with self._stats_lock:
+            stats.update({"rx_frames": self._rx_frames,
+                          "rx_bytes": self._rx_bytes,
+                          "rx_unclaimed": self._rx_unclaimed,
+                          "acks_received": self._acks_received,
+                          "nacks_received": self._nacks_received,
+                          "nacks_sent": self._nacks_sent,
+                          "header_crc_errors": self._parser.header_crc_errors,
+                          "payload_crc_errors": self._parser.payload_crc_errors,
+                          "resync_bytes": self._parser.resync_bytes,
+                          "sequence_errors": self._sequence_errors,
+                          "ack_latency": self._ack_latency.as_dict(),
+                          "response_latency": self._response_latency.as_dict()})
+        with self._tx_thread_lock:
+            stats["tx_queue_depth"] = len(self._tx_queue)
+            stats["max_tx_queue_depth"] = self._max_tx_queue_depth
+        with self._waiters_lock:
+            stats["waiters"] = sum(len(waiters) for waiters in self._waiters.values())
+        stats["rx_queue_depth"] = self.rx_queue_depth
+        return stats
+
+    def dump_trace(self, path):
+        """
+        Write the frame trace to a file, see frame_trace.read_trace()
+        :param path: file to write :type String
+        :return: number of frames written :type Integer
+        """
+        if self._trace is None:
+            raise RuntimeError("Frame trace is not enabled")
+        return self._trace.dump(path)
+
+    def _reset_stats(self):
+        """
+        Zero the link statistics and clear the frame trace
+        :return: NA
+        """
+        with self._stats_lock:
+            self._parser.reset()
+            self._next_rx_sequence_number = None
+            self._rx_frames = 0
+            self._rx_bytes = 0
+            self._rx_unclaimed = 0
+            self._acks_received = 0
+            self._nacks_received = 0
+            self._nacks_sent = 0
+            self._sequence_errors = 0
+            self._tx_times.clear()
+            self._ack_latency.clear()
+            self._response_latency.clear()
+        with self._tx_thread_lock:
+            self._tx_frames = 0
+            self._tx_bytes = 0
+            self._tx_writes = 0
+            self._tx_frames_per_write.clear()
+            self._max_tx_queue_depth = 0
+        if self._trace is not None:
+            self._trace.clear()
+
+    def _record_tx(self, messages, data_length):
+        """
+        Update the tx counters and frame trace after a serial port write
+        :param messages: frames written :type List of bytearray
+        :param data_length: number of bytes written :type Integer
+        :return: NA
+        """
+        now = time.monotonic()
+        with self._tx_thread_lock:
+            self._tx_frames += len(messages)
+            self._tx_bytes += data_length
+            self._tx_writes += 1
+            self._tx_frames_per_write[len(messages)] += 1
+        with self._stats_lock:
+            for msg in messages:
+                # Time commands for the Ack/response latency histograms
+                if (msg[HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] >> 5) <= MessageStatus.RETRANSMIT.value:
+                    self._tx_times[msg[HeaderOffset.MESSAGE_SEQUENCE_NO.value]] = now
+        if self._trace is not None:
+            timestamp = time.time()
+            for msg in messages:
+                self._trace.record(DIRECTION_TX, msg, timestamp)
+
+    def _record_rx(self, data_length):
+        """
+        Update the rx byte counter after a serial port read
+        :param data_length: number of bytes read :type Integer
+        :return: NA
+        """
+        with self._stats_lock:
+            self._rx_bytes += data_length
 
     def get_from_rx_queue(self):
         """
@@ -175,13 +544,67 @@ class MessageHandler:
         with self._rx_thread_lock:
             self._rx_queue.clear()
 
+    def add_waiter(self, ack_no, msg_id, statuses, msg_len=None, event=None):
+        """
+        Register interest in a message which is expected to be received, the
+        waiter must be registered before the message that provokes it is sent.
+        A matching message completes the waiter and is not added to the rx queue
+        :param ack_no: expected acknowledgement number :type Integer
+        :param msg_id: expected message ID :type Integer
+        :param statuses: acceptable message status values :type collection of Integer
+        :param msg_len: expected total message length, None for any length :type Integer
+        :param event: optional event to set on completion, see MessageWaiter :type threading.Event
+        :return: MessageWaiter instance to wait on
+        """
+        waiter = MessageWaiter(ack_no, msg_id, statuses, msg_len, event)
+        with self._waiters_lock:
+            self._waiters.setdefault((ack_no, msg_id), []).append(waiter)
+        return waiter
+
+    def remove_waiter(self, waiter):
+        """
+        Remove a waiter which is no longer required, e.g. after a timeout
+        :param waiter: waiter returned by add_waiter :type MessageWaiter
+        :return: NA
+        """
+        with self._waiters_lock:
+            waiters = self._waiters.get((waiter.ack_no, waiter.msg_id))
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[(waiter.ack_no, waiter.msg_id)]
+
+    def __complete_waiter(self, msg):
+        """
+        Complete the first registered waiter matching a received message
+        :param msg: received message :type bytearray
+        :return: True if a waiter was completed, else False :type Boolean
+        """
+        key = (msg[HeaderOffset.ACKNOWLEDGEMENT_NO.value], msg[HeaderOffset.MESSAGE_ID.value])
+        with self._waiters_lock:
+            waiters = self._waiters.get(key)
+            if not waiters:
+                return False
+            for waiter in waiters:
+                if waiter.matches(msg):
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self._waiters[key]
+                    break
+            else:
+                return False
+        waiter.complete(msg)
+        return True
+
     def get_next_sequence_number(self):
         """
         Get the next serial tx sequence number
         :return: Next sequence number
         """
-        self._next_sequence_number = (self._next_sequence_number + 1) % 256
-        return self._next_sequence_number
+        # Called from both the rx thread (Acks) and application threads
+        with self._sequence_number_lock:
+            self._next_sequence_number = (self._next_sequence_number + 1) % 256
+            return self._next_sequence_number
 
     def send_acknowledge(self, acknowledgment_number, message_id, ack=True):
         """
@@ -201,13 +624,9 @@ class MessageHandler:
             header_bytes.append(MessageStatus.NOT_ACKNOWLEDGE.value << 5)
         header_bytes.append(message_id)                         # Message ID
         header_bytes.append(0)                                  # Payload Length
+        append_crc(header_bytes)                                # CRC LSB, MSB
 
-        header_crc = CRCCCITT(version="FFFF").calculate(bytes(header_bytes))
-        header_crc_bytes = header_crc.to_bytes(2, byteorder="little")
-        header_bytes.append(header_crc_bytes[0])  # CRC LSB
-        header_bytes.append(header_crc_bytes[1])  # CRC MSB
-
-        log.debug("Tx Ack: {}".format(" ".join(format(x, '02x') for x in header_bytes)))
+        log.debug("Tx Ack: %s", HexDump(header_bytes))
 
         self.send_to_tx_queue(header_bytes)
 
@@ -229,10 +648,7 @@ class MessageHandler:
         header_bytes.append((status << 5) & 0xE0)  # Status and Protocol
         header_bytes.append(msg_id)  # Message ID
         header_bytes.append(pl_len)  # Payload Length
-        header_crc = CRCCCITT(version="FFFF").calculate(bytes(header_bytes))
-        header_crc_bytes = header_crc.to_bytes(2, byteorder="little")
-        header_bytes.append(header_crc_bytes[0])  # CRC LSB
-        header_bytes.append(header_crc_bytes[1])  # CRC MSB
+        append_crc(header_bytes)  # CRC LSB, MSB
         return header_bytes
 
     @staticmethod
@@ -258,10 +674,79 @@ class MessageHandler:
 
         return msg_header
 
+    def _process_rx_message(self, msg, crc_ok):
+        """
+        Handle a frame extracted by the rx parser, sending the Ack/Nack and
+        adding valid messages to the rx queue
+        :param msg: complete frame, header plus payload :type bytearray
+        :param crc_ok: False if the payload CRC check failed :type Boolean
+        :return: NA
+        """
+        message_sequence_number = msg[HeaderOffset.MESSAGE_SEQUENCE_NO.value]
+        message_id = msg[HeaderOffset.MESSAGE_ID.value]
+        message_status = msg[HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] >> 5
+        acknowledge_number = msg[HeaderOffset.ACKNOWLEDGEMENT_NO.value]
+
+        if self._trace is not None:
+            self._trace.record(DIRECTION_RX, msg, time.time())
+
+        with self._stats_lock:
+            self._rx_frames += 1
+
+            # Every frame sent by the far end uses the next sequence number,
+            # so a gap means frames have been lost
+            if message_status != MessageStatus.RETRANSMIT.value:
+                if self._next_rx_sequence_number is not None and \
+                        message_sequence_number != self._next_rx_sequence_number:
+                    self._sequence_errors += 1
+                    log.debug("Rx Sequence Number Error: Expected %d, Received %d",
+                              self._next_rx_sequence_number, message_sequence_number)
+                self._next_rx_sequence_number = (message_sequence_number + 1) % 256
+
+            if not crc_ok:
+                self._nacks_sent += 1
+            elif message_status == MessageStatus.ACKNOWLEDGE.value or \
+                    message_status == MessageStatus.NOT_ACKNOWLEDGE.value:
+                if message_status == MessageStatus.ACKNOWLEDGE.value:
+                    self._acks_received += 1
+                else:
+                    self._nacks_received += 1
+                sent = self._tx_times.get(acknowledge_number)
+                if sent is not None:
+                    self._ack_latency.add(time.monotonic() - sent)
+            elif message_status == MessageStatus.RESPONSE_OK.value or \
+                    message_status == MessageStatus.RESPONSE_NOT_OK.value:
+                sent = self._tx_times.pop(acknowledge_number, None)
+                if sent is not None:
+                    self._response_latency.add(time.monotonic() - sent)
+
+        if not crc_ok:
+            # Generate a not acknowledge structure and send it off
+            self.send_acknowledge(message_sequence_number, message_id, ack=False)
+            return
+
+        if message_status in self._message_statuses_to_acknowledge:
+            # Generate an acknowledge structure and send it off
+            self.send_acknowledge(message_sequence_number, message_id)
+
+        if not self.__complete_waiter(msg):
+            with self._stats_lock:
+                self._rx_unclaimed += 1
+            self._queue_rx_message(msg)
+
+    def _queue_rx_message(self, msg):
+        """
+        Add a received message which no waiter has claimed to the rx queue
+        :param msg: received message :type bytearray
+        :return: NA
+        """
+        with self._rx_thread_lock:
+            self._rx_queue.append(msg)
+
     def __rx_thread_run(self):
         """
-        Receive thread, operates as a state machine which is stepped through
-        as bytes are received on the serial interface.
+        Receive thread, reads everything the serial port has buffered in a
+        single call and passes it to the MessageParser.
 
         Once a complete message has been received (and validated) it is added
         to the rx queue ready to be collected by an application.
@@ -269,164 +754,42 @@ class MessageHandler:
         """
         log.debug("Rx Waiting...")
 
-        crc_bytes_read = 0
-        bytes_to_process = 0
-        current_state = MessageHandlerRxState.IDLE
-
-        message_buffer = bytearray()
-        read_position = -1
-
-        next_acknowledge_number = 0
-
         while not self._event.is_set():
-            # Attempt to read from the serial port
-            data = self._serial_device.read(1)
-
+            # Block for the first byte, then collect whatever else has arrived;
             # read() call will time out if nothing was read
+            data = self._serial_device.read(max(1, self._serial_device.in_waiting))
+
             if len(data) >= 1:
-                message_buffer += data
-
-                processed_all_data = False
-                while not processed_all_data:
-                    if current_state == MessageHandlerRxState.IDLE:
-                        log.debug("Rx Idle State")
-                        if message_buffer[HeaderOffset.START_OF_FRAME.value] != START_OF_FRAME:
-                            message_buffer = message_buffer[1:]
-                        else:
-                            log.debug("Rx Start of Message Detected")
-                            read_position = 1
-                            bytes_to_process = HEADER_LENGTH - 1
-                            current_state = MessageHandlerRxState.RECEIVING_HEADER
-
-                    elif current_state == MessageHandlerRxState.RECEIVING_HEADER:
-                        read_position += 1
-                        bytes_to_process -= 1
-
-                        if bytes_to_process == 0:
-                            log.debug("Rx All Non-CRC Header Bytes Received")
-                            crc_bytes_read = 0
-                            current_state = MessageHandlerRxState.AWAITING_HEADER_CRC
-
-                    elif current_state == MessageHandlerRxState.AWAITING_HEADER_CRC:
-                        read_position += 1
-                        crc_bytes_read += 1
-
-                        if crc_bytes_read == CRC_LENGTH:
-                            calculated_crc = CRCCCITT(version="FFFF").calculate(
-                                bytes(message_buffer[0:HEADER_LENGTH]))
-                            log.debug("Rx Header Calculated CRC = {}".format(hex(calculated_crc)))
-
-                            header_crc = int.from_bytes(
-                                bytes(message_buffer[HEADER_LENGTH: TOTAL_HEADER_LENGTH]), byteorder="little")
-                            log.debug("Rx Header CRC = {}".format(hex(header_crc)))
-
-                            if calculated_crc == header_crc:
-                                payload_length = int(message_buffer[HeaderOffset.PAYLOAD_LENGTH.value])
-                                log.debug("Rx Payload Length: {}".format(payload_length))
-
-                                if payload_length == 0:
-                                    current_state = MessageHandlerRxState.MESSAGE_COMPLETE
-                                else:
-                                    bytes_to_process = payload_length
-                                    current_state = MessageHandlerRxState.RECEIVING_PAYLOAD
-
-                            else:
-                                # Need to go back to idle and find the start again
-                                log.error("Header CRC: calculated {}; received {}".format(
-                                    hex(calculated_crc), hex(header_crc)))
-                                message_buffer = message_buffer[read_position:]
-                                read_position = -1
-                                current_state = MessageHandlerRxState.IDLE
-
-                    elif current_state == MessageHandlerRxState.RECEIVING_PAYLOAD:
-                        read_position += 1
-                        bytes_to_process -= 1
-
-                        if bytes_to_process == 0:
-                            log.debug('Rx All Non-CRC Payload Bytes Received')
-                            crc_bytes_read = 0
-                            current_state = MessageHandlerRxState.AWAITING_PAYLOAD_CRC
-
-                    elif current_state == MessageHandlerRxState.AWAITING_PAYLOAD_CRC:
-                        read_position += 1
-                        crc_bytes_read += 1
-
-                        if crc_bytes_read == CRC_LENGTH:
-                            log.debug("Raw Rx Msg: {}".format(" ".join(format(x, '02x') for x in message_buffer[:read_position])))
-                            calculated_crc = CRCCCITT(version="FFFF").calculate(
-                                bytes(message_buffer[TOTAL_HEADER_LENGTH: read_position - CRC_LENGTH]))
-                            log.debug("Rx Payload Calculated CRC = {}".format(hex(calculated_crc)))
-
-                            payload_crc = int.from_bytes(
-                                bytes(message_buffer[read_position - CRC_LENGTH: read_position]), byteorder="little")
-                            log.debug("Rx Payload CRC = {}".format(hex(payload_crc)))
-
-                            if calculated_crc == payload_crc:
-                                current_state = MessageHandlerRxState.MESSAGE_COMPLETE
-                            else:
-                                # Generate a not acknowledge structure and send it off
-                                # MAGIC NUMBERS!
-                                self.send_acknowledge(message_buffer[1], message_buffer[4], ack=False)
-
-                                # Need to go back to idle and find the start again
-                                log.error("Payload CRC: calculated {}; received {}".format(
-                                    hex(calculated_crc), hex(payload_crc)))
-                                message_buffer = message_buffer[read_position:]
-                                read_position = -1
-                                current_state = MessageHandlerRxState.IDLE
-
-                    elif current_state == MessageHandlerRxState.MESSAGE_COMPLETE:
-                        start_of_frame, message_sequence_number, acknowledge_number, blah, message_id, \
-                            payload_length, header_crc = \
-                            struct.unpack('BBBBBBH', message_buffer[:TOTAL_HEADER_LENGTH])
-                        message_status = blah >> 5
-                        protocol_version = blah & 0x1F
-
-                        if message_status in self._message_statuses_to_acknowledge:
-                            # Generate an acknowledge structure and send it off
-                            self.send_acknowledge(message_sequence_number, message_id)
-
-                        elif message_status == MessageStatus.ACKNOWLEDGE or \
-                                message_status == MessageStatus.NOT_ACKNOWLEDGE:
-                            if acknowledge_number != next_acknowledge_number:
-                                log.error("Rx Sequence Number Error: Expected {}, Received {}".format(
-                                    next_acknowledge_number, acknowledge_number))
-                            next_acknowledge_number = acknowledge_number + 1
-
-                        with self._rx_thread_lock:
-                            self._rx_queue.append(message_buffer[:read_position])
-
-                        # Finished with the message; back to the start now
-                        message_buffer = message_buffer[read_position:]
-                        read_position = -1
-                        current_state = MessageHandlerRxState.IDLE
-
-                    # Only dealing with headers at the moment, payload is managed by the calling application
-                    processed_all_data = (current_state != MessageHandlerRxState.MESSAGE_COMPLETE) and \
-                                         ((len(message_buffer) == 0) or
-                                          ((read_position > 0) and
-                                           (read_position == len(message_buffer))))
+                self._record_rx(len(data))
+                for msg, crc_ok in self._parser.parse(data):
+                    self._process_rx_message(msg, crc_ok)
 
         log.debug("Rx __rx_thread exiting")
 
     def __tx_thread_run(self):
         """
-        Transmit thread, pops messages off the tx queue and sends them using the serial port
+        Transmit thread, sleeps until messages are added to the tx queue then
+        sends everything queued, in order, using a single serial port write
         :return NA
         """
         log.debug("Tx Ready...")
 
-        while not self._event.is_set():
-            try:
-                with self._tx_thread_lock:
-                    if len(self._tx_queue) > 0:
-                        message_to_send = self._tx_queue.popleft()
-                        sent = self._serial_device.write(message_to_send)
-                        log.debug("Tx msg (sent {}): {}".format(
-                            sent, " ".join(format(x, '02x') for x in message_to_send)))
-
-            except queue.Empty:
-                log.debug("Tx Queue Empty")
+        while True:
+            with self._tx_condition:
+                while not self._tx_queue and not self._event.is_set():
+                    self._tx_condition.wait()
+                if self._event.is_set():
+                    break
+                messages_to_send = list(self._tx_queue)
+                self._tx_queue.clear()
+
+            if len(messages_to_send) == 1:
+                data = messages_to_send[0]
+            else:
+                data = b"".join(messages_to_send)
+            sent = self._serial_device.write(data)
+            self._record_tx(messages_to_send, len(data))
+            log.debug("Tx %d msg(s) (sent %s): %s", len(messages_to_send), sent, HexDump(data))
 
         log.debug("Tx __tx_thread exiting")
 
@@ -446,13 +809,20 @@ class MessageHandler:
             if self._serial_device.isOpen():
                 log.debug('Serial Port Opened')
 
-                self._serial_device.rts = False # Set RTS to 0 to enable EPU RS-422 transmitter
+                try:
+                    self._serial_device.rts = False # Set RTS to 0 to enable EPU RS-422 transmitter
+                except OSError:
+                    # Pseudo-terminals, e.g. a backplane simulator, have no modem control lines
+                    log.warning("Unable to set RTS on {}".format(serial_port))
                 self._serial_device.timeout = SERIAL_TIMEOUT
                 self._event.clear()
                 self._next_sequence_number = 255
                 with self._tx_thread_lock:
                     self._tx_queue.clear()
+                self._reset_stats()
                 self.clear_rx_queue()
+                with self._waiters_lock:
+                    self._waiters.clear()
 
                 self._rx_thread = threading.Thread(target=self.__rx_thread_run)
                 self._rx_thread.start()
@@ -481,8 +851,19 @@ class MessageHandler:
         """
         if not self._event.is_set():
             self._event.set()
-            # Allow setting the event to be detected by the tx/rx threads before closing the serial port
-            time.sleep(SERIAL_TIMEOUT)
+            # Wake the tx thread if it is waiting for messages
+            with self._tx_condition:
+                self._tx_condition.notify_all()
+            # Wake the rx thread if it is blocked in read()
+            if self._serial_device is not None and self._serial_device.is_open:
+                try:
+                    self._serial_device.cancel_read()
+                except (AttributeError, NotImplementedError, OSError):
+                    pass
+            # Allow the tx/rx threads to exit before closing the serial port
+            for thread in (self._rx_thread, self._tx_thread):
+                if thread is not None and thread is not threading.current_thread():
+                    thread.join(SERIAL_TIMEOUT)
             if self._serial_device is not None:
                 self._serial_device.close()
 
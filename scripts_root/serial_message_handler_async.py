@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Module for handling serial messages using the Blackstar serial protocol
+specified in KT-957-0143-00 from an asyncio event loop.  The serial port file
+descriptor is watched using the event loop's reader so no threads are needed;
+framing, Ack/Nack handling and waiter matching are shared with MessageHandler.
+"""
+# -----------------------------------------------------------------------------
+# Copyright (c) 2020, Kirintec
+#
+# -----------------------------------------------------------------------------
+"""
+OPTIONS ------------------------------------------------------------------
+None
+
+ARGUMENTS -------------------------------------------------------------
+None
+"""
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# stdlib imports -------------------------------------------------------
+import asyncio
+import logging
+
+# Third-party imports -----------------------------------------------
+import serial
+
+# Our own imports ---------------------------------------------------
+from serial_message_handler import MessageHandler
+
+# -----------------------------------------------------------------------------
+# GLOBALS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# CONSTANTS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# LOCAL UTILITIES
+# -----------------------------------------------------------------------------
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+# -----------------------------------------------------------------------------
+# CLASSES
+# -----------------------------------------------------------------------------
+class AsyncMessageHandler(MessageHandler):
+    """
+    Class for handling serial messages using the Blackstar serial protocol
+    from an asyncio event loop.  start() and stop() must be called from a
+    coroutine running in the loop that will service the serial port.
+
+    Received bytes are read when the event loop reports the port readable and
+    passed to a MessageParser.  Messages queued for transmission are written
+    by a callback scheduled on the loop, so everything queued in one loop
+    iteration (e.g. an Ack plus the next request) is sent with one write.
+    Messages not claimed by a waiter are delivered to an asyncio.Queue which
+    may be consumed with receive() or async iteration.
+    """
+    def __init__(self, trace_size=0):
+        """
+        Class constructor
+        :param trace_size: number of frames to keep in the frame trace, 0 to disable :type Integer
+        """
+        super().__init__(trace_size)
+        self._loop = None
+        self._flush_scheduled = False
+        self._async_rx_queue = asyncio.Queue()
+
+    def start(self, serial_port, baud_rate):
+        """
+        Starts the AsyncMessageHandler running on the current event loop
+        :param serial_port:
+        :param baud_rate:
+        :return: True if started, else False :type: Boolean
+        """
+        log.debug('Starting AsyncMessageHandler...')
+
+        try:
+            self._loop = asyncio.get_running_loop()
+            self._serial_device = serial.Serial(serial_port, baud_rate, timeout=0,
+                                                xonxoff=False, rtscts=True, dsrdtr=False)
+            try:
+                self._serial_device.rts = False # Set RTS to 0 to enable EPU RS-422 transmitter
+            except OSError:
+                # Pseudo-terminals, e.g. a backplane simulator, have no modem control lines
+                log.warning("Unable to set RTS on {}".format(serial_port))
+
+            self._event.clear()
+            self._reset_stats()
+            self._loop.add_reader(self._serial_device.fileno(), self.__on_readable)
+
+        except Exception as ex:
+            self._event.set()
+            self._loop = None
+            if self._serial_device is not None:
+                self._serial_device.close()
+            log.critical("Failed to start AsyncMessageHandler: {}".format(ex))
+            return False
+
+        return True
+
+    def stop(self):
+        """
+        Stop the AsyncMessageHandler from running, returns immediately
+        :return: NA
+        """
+        if self._loop is not None and not self._event.is_set():
+            self._event.set()
+            self._loop.remove_reader(self._serial_device.fileno())
+            self._serial_device.close()
+            self._loop = None
+
+    def send_to_tx_queue(self, msg):
+        """
+        Add a message to the tx queue, the queue is flushed to the serial port
+        on the next event loop iteration.  May be called from any thread
+        :param msg: message to be sent :type ByteArray
+        :return: NA
+        """
+        with self._tx_thread_lock:
+            self._tx_queue.append(msg)
+            if self._flush_scheduled or self._loop is None:
+                return
+            self._flush_scheduled = True
+        self._loop.call_soon_threadsafe(self.__flush_tx_queue)
+
+    def _queue_rx_message(self, msg):
+        """
+        Deliver a received message which no waiter has claimed to receive()
+        :param msg: received message :type bytearray
+        :return: NA
+        """
+        self._async_rx_queue.put_nowait(msg)
+
+    @property
+    def rx_queue_depth(self):
+        """ Number of received messages waiting to be collected by receive() """
+        return self._async_rx_queue.qsize()
+
+    def get_from_rx_queue(self):
+        """
+        Pop a message from the rx queue if one is available
+        :return: received message if available, else None :type ByteArray
+        """
+        try:
+            return self._async_rx_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    def clear_rx_queue(self):
+        """
+        Utility method to ditch the contents of the rx queue
+        :return: NA
+        """
+        while self.get_from_rx_queue() is not None:
+            pass
+
+    async def receive(self):
+        """
+        Wait for a received message which no waiter has claimed
+        :return: received message :type bytearray
+        """
+        return await self._async_rx_queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.receive()
+
+    def __on_readable(self):
+        """
+        Event loop reader callback, parses everything waiting on the serial port
+        :return: NA
+        """
+        try:
+            data = self._serial_device.read(max(1, self._serial_device.in_waiting))
+        except serial.SerialException as ex:
+            log.critical("Serial port read failed: {}".format(ex))
+            self.stop()
+            return
+
+        self._record_rx(len(data))
+        for msg, crc_ok in self._parser.parse(data):
+            self._process_rx_message(msg, crc_ok)
+
+    def __flush_tx_queue(self):
+        """
+        Event loop callback, writes all queued messages with one serial write
+        :return: NA
+        """
+        with self._tx_thread_lock:
+            self._flush_scheduled = False
+            messages_to_send = list(self._tx_queue)
+            self._tx_queue.clear()
+
+        if not messages_to_send or self._event.is_set():
+            return
+
+        data = b"".join(messages_to_send)
+        self._serial_device.write(data)
+        self._record_tx(messages_to_send, len(data))
+
+
+# -----------------------------------------------------------------------------
+# FUNCTIONS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# RUNTIME PROCEDURE
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    """
+    Module is NOT intended to be executed stand-alone, print warning message
+    """
+    print("Module is NOT intended to be executed stand-alone")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the SerialMsgInterface class, run against the simulated
+Active Backplane firmware in backplane_simulator.py.  Reports messages/s,
+round-trip latency percentiles and CPU time per message for each scenario,
+and the success rate when the simulator injects line noise and corruption.
+"""
+# -----------------------------------------------------------------------------
+# Copyright (c) 2021, Kirintec
+#
+# -----------------------------------------------------------------------------
+import argparse
+import logging
+import time
+
+from backplane_simulator import BackplaneSimulator
+from serial_msg_intf import SerialMsgInterface, MsgId, MsgPayloadLen
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+NO_TESTS = 200
+NO_NOISE_TESTS = 50
+BAUD_RATE = 115200
+SCENARIOS = ["ping", "get", "get_many", "noise"]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def report(name, latencies, fail_count, elapsed, cpu):
+    count = len(latencies) + fail_count
+    log.info("{}: {} ok, {} failed".format(name, len(latencies), fail_count))
+    if count:
+        log.info("{}: {:.1f} msg/s, {:.1f} us CPU/msg".format(name, count / elapsed, cpu / count * 1e6))
+    if latencies:
+        latencies.sort()
+        log.info("{}: round trip p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms".format(
+            name, percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.99) * 1e3, latencies[-1] * 1e3))
+
+
+def run_sequential(smi, name, count, command):
+    latencies = []
+    fail_count = 0
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    for i in range(0, count):
+        t = time.perf_counter()
+        if command(smi):
+            latencies.append(time.perf_counter() - t)
+        else:
+            fail_count += 1
+    report(name, latencies, fail_count, time.perf_counter() - start, time.process_time() - start_cpu)
+
+
+def run_get_many(smi, name, count):
+    requests = [(MsgId.GET_SOFTWARE_VERSION_NUMBER, MsgPayloadLen.GET_SOFTWARE_VERSION_NUMBER)] * count
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    results = smi.get_many(requests)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+    ok_count = sum(1 for result, _ in results if result)
+    # Per-message latency is not observable in a batch, report the batch time
+    log.info("{}: {} ok, {} failed".format(name, ok_count, count - ok_count))
+    log.info("{}: {:.1f} msg/s, {:.1f} us CPU/msg".format(name, count / elapsed, cpu / count * 1e6))
+    log.info("{}: batch of {} in {:.3f} ms".format(name, count, elapsed * 1e3))
+
+
+def ping(smi):
+    return smi.send_ping()
+
+
+def get_software_version(smi):
+    result, _ = smi.get_command(MsgId.GET_SOFTWARE_VERSION_NUMBER, MsgPayloadLen.GET_SOFTWARE_VERSION_NUMBER)
+    return result
+
+
+def run_scenario(scenario, args):
+    if scenario == "noise":
+        simulator = BackplaneSimulator(args.delay, args.corrupt, args.drop, args.noise, args.seed)
+    else:
+        simulator = BackplaneSimulator(args.delay, seed=args.seed)
+    # Run the simulator in its own process so its CPU time is not counted
+    simulator.start(use_process=True)
+    try:
+        with SerialMsgInterface(simulator.port, BAUD_RATE) as smi:
+            if scenario == "ping":
+                run_sequential(smi, scenario, args.count, ping)
+            elif scenario == "get":
+                run_sequential(smi, scenario, args.count, get_software_version)
+            elif scenario == "get_many":
+                run_get_many(smi, scenario, args.count)
+            elif scenario == "noise":
+                run_sequential(smi, scenario, args.noise_count, ping)
+            stats = smi.get_retransmit_stats()
+            log.info("{}: {} retransmits ({} after Nack), {} timeouts, rto {:.1f} ms".format(
+                scenario, stats["retransmits"], stats["nack_retransmits"], stats["timeouts"], stats["rto"] * 1e3))
+            stats = smi.get_link_stats()
+            log.info("{}: {} header / {} payload CRC errors, {} resync bytes, {} sequence errors".format(
+                scenario, stats["header_crc_errors"], stats["payload_crc_errors"], stats["resync_bytes"],
+                stats["sequence_errors"]))
+            if stats["ack_latency"]["count"]:
+                log.info("{}: Ack latency p50 < {:.3f} ms, p99 < {:.3f} ms".format(
+                    scenario, stats["ack_latency"]["p50"] * 1e3, stats["ack_latency"]["p99"] * 1e3))
+    finally:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenarios", nargs="*", default=SCENARIOS,
+                        help="scenarios to run from {}, default all".format(", ".join(SCENARIOS)))
+    parser.add_argument("-n", "--count", type=int, default=NO_TESTS, help="messages per scenario")
+    parser.add_argument("--noise-count", type=int, default=NO_NOISE_TESTS, help="messages in the noise scenario")
+    parser.add_argument("-d", "--delay", type=float, default=0.0, help="simulator response delay in seconds")
+    parser.add_argument("-c", "--corrupt", type=float, default=0.02, help="noise scenario corruption probability")
+    parser.add_argument("-x", "--drop", type=float, default=0.02, help="noise scenario frame drop probability")
+    parser.add_argument("-z", "--noise", type=float, default=0.2, help="noise scenario line noise probability")
+    parser.add_argument("-s", "--seed", type=int, default=1, help="simulator random seed")
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error("unknown scenario '{}'".format(scenario))
+
+    fmt = "%(asctime)s: %(message)s"
+    logging.basicConfig(format=fmt, level=logging.INFO, datefmt="%H:%M:%S")
+
+    for scenario in args.scenarios:
+        run_scenario(scenario, args)
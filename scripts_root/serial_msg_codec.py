@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Schema-driven payload codecs for the Blackstar serial protocol specified in
+KT-957-0143-00.  A module specific command set describes each message with
+a payload as a table entry: message ID, direction, payload version and
+fields.  From this a MessageCodec pre-compiles a struct.Struct which decodes
+received frames in place with unpack_from() and encodes complete frames,
+header and CRCs included, with pack_into().
+"""
+# -----------------------------------------------------------------------------
+# Copyright (c) 2021, Kirintec
+#
+# -----------------------------------------------------------------------------
+"""
+OPTIONS ------------------------------------------------------------------
+None
+
+ARGUMENTS -------------------------------------------------------------
+None
+"""
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# stdlib imports -------------------------------------------------------
+import collections
+from enum import Enum
+import logging
+import struct
+
+# Third-party imports -----------------------------------------------
+
+
+# Our own imports ---------------------------------------------------
+from crc_ccitt import pack_crc_into
+import serial_message_handler as smh
+
+# -----------------------------------------------------------------------------
+# GLOBALS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# CONSTANTS
+# -----------------------------------------------------------------------------
+HEADER_STRUCT = struct.Struct("<6B")
+TEXT_ENCODING = "ascii"
+
+# -----------------------------------------------------------------------------
+# LOCAL UTILITIES
+# -----------------------------------------------------------------------------
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+# -----------------------------------------------------------------------------
+# CLASSES
+# -----------------------------------------------------------------------------
+class Direction(Enum):
+    """ Enumeration for message directions """
+    COMMAND = 0     # Host to module
+    RESPONSE = 1    # Module to host
+
+
+class Field:
+    """
+    Definition of a payload field
+    """
+    def __init__(self, name, fmt, text=False):
+        """
+        Class constructor
+        :param name: field name, must be a valid identifier :type String
+        :param fmt: little-endian struct format of the field, e.g. 'H' or '16s' :type String
+        :param text: True for a NUL padded string field, decoded to and encoded from str :type Boolean
+        """
+        self.name = name
+        self.fmt = fmt
+        self.text = text
+
+
+class MessageCodec:
+    """
+    Encoder/decoder for the payload of one message.  Every payload starts
+    with the payload version byte followed by the fields in table order.
+    Decoded payloads are named tuples whose first element is payload_version.
+    """
+    def __init__(self, name, msg_id, direction, payload_version, fields):
+        """
+        Class constructor
+        :param name: message name, used to name the decoded payload type :type String
+        :param msg_id: message ID :type Integer
+        :param direction: message direction :type Direction
+        :param payload_version: payload version transmitted/expected :type Integer
+        :param fields: payload fields following the payload version :type List of Field
+        """
+        self.name = name
+        self.msg_id = msg_id
+        self.direction = direction
+        self.payload_version = payload_version
+        self.fields = tuple(fields)
+        self.struct = struct.Struct("<B" + "".join(field.fmt for field in self.fields))
+        self.payload_length = self.struct.size
+        self.frame_length = smh.TOTAL_HEADER_LENGTH + self.payload_length + smh.CRC_LENGTH
+        self.payload_type = collections.namedtuple(
+            "".join(word.capitalize() for word in name.split("_")) + "Payload",
+            ["payload_version"] + [field.name for field in self.fields])
+        # Positions in the decoded tuple of fields needing conversion
+        self._text_fields = tuple(i + 1 for i, field in enumerate(self.fields) if field.text)
+
+    def decode(self, frame):
+        """
+        Decode the payload of a received frame without copying it
+        :param frame: complete frame, header plus payload :type bytes-like
+        :return: decoded payload :type payload_type named tuple
+        """
+        if len(frame) != self.frame_length:
+            raise ValueError("{} expects a {}-byte frame, received {} bytes".format(
+                self.name, self.frame_length, len(frame)))
+
+        values = self.struct.unpack_from(frame, smh.TOTAL_HEADER_LENGTH)
+        if self._text_fields:
+            values = list(values)
+            for i in self._text_fields:
+                values[i] = values[i].rstrip(b"\x00").decode(TEXT_ENCODING, errors="replace")
+        return self.payload_type._make(values)
+
+    def encode_into(self, buffer, offset, seq_no, values, status=smh.MessageStatus.NEW_MESSAGE.value, ack_no=0):
+        """
+        Encode a complete frame into a pre-allocated buffer
+        :param buffer: buffer with at least frame_length bytes after offset :type bytearray
+        :param offset: position in buffer of the start of frame :type Integer
+        :param seq_no: tx sequence number :type Integer
+        :param values: field values in table order, excluding the payload version :type Sequence
+        :param status: message status :type Integer
+        :param ack_no: acknowledge no :type Integer
+        :return: number of bytes written :type Integer
+        """
+        if self._text_fields:
+            values = list(values)
+            for i in self._text_fields:
+                if isinstance(values[i - 1], str):
+                    values[i - 1] = values[i - 1].encode(TEXT_ENCODING)
+
+        HEADER_STRUCT.pack_into(buffer, offset, smh.START_OF_FRAME, seq_no, ack_no,
+                                (status << 5) & 0xE0, self.msg_id, self.payload_length)
+        pack_crc_into(buffer, offset, offset + smh.HEADER_LENGTH)
+        payload_start = offset + smh.TOTAL_HEADER_LENGTH
+        self.struct.pack_into(buffer, payload_start, self.payload_version, *values)
+        pack_crc_into(buffer, payload_start, payload_start + self.payload_length)
+        return self.frame_length
+
+    def encode(self, seq_no, values, status=smh.MessageStatus.NEW_MESSAGE.value, ack_no=0):
+        """
+        Encode a complete frame
+        :param seq_no: tx sequence number :type Integer
+        :param values: field values in table order, excluding the payload version :type Sequence
+        :param status: message status :type Integer
+        :param ack_no: acknowledge no :type Integer
+        :return: frame :type bytearray
+        """
+        buffer = bytearray(self.frame_length)
+        self.encode_into(buffer, 0, seq_no, values, status, ack_no)
+        return buffer
+
+
+class CodecRegistry:
+    """
+    Table of MessageCodecs keyed by message ID and direction
+    """
+    def __init__(self):
+        """ Class constructor """
+        self._codecs = {}
+
+    def add(self, msg_id, direction, payload_version, fields):
+        """
+        Add a message to the table
+        :param msg_id: message ID :type Enum
+        :param direction: message direction :type Direction
+        :param payload_version: payload version :type Integer
+        :param fields: payload fields following the payload version :type List of Field
+        :return: the new codec :type MessageCodec
+        """
+        key = (msg_id.value, direction)
+        if key in self._codecs:
+            raise ValueError("{} {} already has a codec".format(msg_id.name, direction.name))
+        codec = MessageCodec(msg_id.name, msg_id.value, direction, payload_version, fields)
+        self._codecs[key] = codec
+        return codec
+
+    def get(self, msg_id, direction):
+        """
+        Get the codec for a message
+        :param msg_id: message ID :type Enum or Integer
+        :param direction: message direction :type Direction
+        :return: codec, None if the message has no payload codec :type MessageCodec
+        """
+        return self._codecs.get((getattr(msg_id, "value", msg_id), direction))
+
+    def decode(self, frame, direction=Direction.RESPONSE):
+        """
+        Decode the payload of a received frame using the codec for its message ID
+        :param frame: complete frame, header plus payload :type bytes-like
+        :param direction: message direction :type Direction
+        :return: decoded payload :type named tuple
+        """
+        codec = self.get(frame[smh.HeaderOffset.MESSAGE_ID.value], direction)
+        if codec is None:
+            raise KeyError("No {} codec for message ID 0x{:02x}".format(
+                direction.name, frame[smh.HeaderOffset.MESSAGE_ID.value]))
+        return codec.decode(frame)
+
+    def __iter__(self):
+        return iter(self._codecs.values())
+
+    def __len__(self):
+        return len(self._codecs)
+
+
+# -----------------------------------------------------------------------------
+# FUNCTIONS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# RUNTIME PROCEDURE
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    """
+    Module is NOT intended to be executed stand-alone, print warning message
+    """
+    print("Module is NOT intended to be executed stand-alone")
@@ -23,15 +23,17 @@ None
 # stdlib imports -------------------------------------------------------
 from enum import Enum
 import logging
-import struct
+import threading
 import time
 
 
 # Third-party imports -----------------------------------------------
-from PyCRC.CRCCCITT import CRCCCITT
+
 
 # Our own imports ---------------------------------------------------
+from frame_trace import HexDump
 import serial_message_handler as smh
+from serial_msg_codec import CodecRegistry, Direction, Field
 
 # -----------------------------------------------------------------------------
 # GLOBALS
@@ -42,6 +44,18 @@ import serial_message_handler as smh
 # CONSTANTS
 # -----------------------------------------------------------------------------
 SERIAL_TIMEOUT = 2.0
+ACK_STATUSES = (smh.MessageStatus.ACKNOWLEDGE.value,)
+ACK_NACK_STATUSES = (smh.MessageStatus.ACKNOWLEDGE.value, smh.MessageStatus.NOT_ACKNOWLEDGE.value)
+RESPONSE_STATUSES = (smh.MessageStatus.RESPONSE_OK.value, smh.MessageStatus.NEW_MESSAGE.value)
+PIPELINE_WINDOW = 4
+MAX_RETRANSMITS = 3
+# Retransmission timeout limits, seconds
+INITIAL_RTO = 0.25
+MIN_RTO = 0.05
+MAX_RTO = SERIAL_TIMEOUT
+# Time allowed for the response once a command is Acked, seconds; the command
+# is not resent once Acked, as that would repeat it on the firmware
+RESPONSE_TIMEOUT = SERIAL_TIMEOUT
 
 # -----------------------------------------------------------------------------
 # LOCAL UTILITIES
@@ -84,6 +98,134 @@ class MsgPayloadLen(Enum):
     GET_KEY = 33
 
 
+# -----------------------------------------------------------------------------
+# MESSAGE PAYLOADS
+# -----------------------------------------------------------------------------
+# Payload layouts from the ICD, KT-957-0413-00.  Each entry gives the message
+# ID, direction, payload version and the fields following the payload version
+# byte; the payload lengths must agree with MsgPayloadLen.  Unit/hardware info
+# strings follow the assembly EEPROM layout (hw_config_format_*.json).
+UNIT_INFO_FIELDS = [Field("assembly_part_no", "16s", text=True),
+                    Field("assembly_revision_no", "16s", text=True),
+                    Field("assembly_serial_no", "16s", text=True),
+                    Field("assembly_build_date_batch_no", "16s", text=True)]
+
+CODECS = CodecRegistry()
+CODECS.add(MsgId.GET_SOFTWARE_VERSION_NUMBER, Direction.RESPONSE, 0x01,
+           [Field("sw_major", "H"), Field("sw_minor", "H"), Field("sw_patch", "H"), Field("sw_build", "I")])
+CODECS.add(MsgId.GET_HARDWARE_INFO, Direction.RESPONSE, 0x01,
+           UNIT_INFO_FIELDS + [Field("bootblocker_version", "8s", text=True)])
+CODECS.add(MsgId.GET_BIT_INFO, Direction.RESPONSE, 0x01,
+           [Field("bit_data", "9s")])
+CODECS.add(MsgId.GET_UNIT_INFO, Direction.RESPONSE, 0x01,
+           UNIT_INFO_FIELDS + [Field("hw_config_version", "B")])
+CODECS.add(MsgId.SET_UNIT_INFO, Direction.COMMAND, 0x01, UNIT_INFO_FIELDS)
+CODECS.add(MsgId.SET_KEY, Direction.COMMAND, 0x01, [Field("key", "32s")])
+CODECS.add(MsgId.GET_KEY, Direction.RESPONSE, 0x01, [Field("key", "32s")])
+
+
+class RttEstimator:
+    """
+    Smoothed round trip time estimator for a serial link, using the
+    Jacobson/Karels algorithm from RFC 6298.  The retransmission timeout is
+    the smoothed round trip time plus four times its mean deviation, clamped
+    to [MIN_RTO, MAX_RTO], and is doubled for each retransmission of a frame.
+    """
+    ALPHA = 0.125
+    BETA = 0.25
+
+    def __init__(self, initial_rto=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        """
+        Class constructor
+        :param initial_rto: retransmission timeout before any round trip has been measured :type Float
+        :param min_rto: lower limit of the retransmission timeout :type Float
+        :param max_rto: upper limit of the retransmission timeout :type Float
+        """
+        self._initial_rto = initial_rto
+        self._min_rto = min_rto
+        self._max_rto = max_rto
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all round trip time measurements
+        :return: NA
+        """
+        with self._lock:
+            self.srtt = None
+            self.rttvar = None
+            self.samples = 0
+            self._rto = self._initial_rto
+
+    @property
+    def rto(self):
+        """ Current retransmission timeout, seconds """
+        return self._rto
+
+    def update(self, rtt):
+        """
+        Add a round trip time measurement, must not be taken from a frame
+        which was retransmitted as the Ack may be for either transmission
+        :param rtt: measured round trip time, seconds :type Float
+        :return: NA
+        """
+        with self._lock:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+                self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+            self.samples += 1
+            self._rto = min(self._max_rto, max(self._min_rto, self.srtt + 4 * self.rttvar))
+
+    def timeout(self, retransmits=0):
+        """
+        Get the retransmission timeout for a frame, with exponential backoff
+        :param retransmits: number of times the frame has been retransmitted :type Integer
+        :return: timeout, seconds :type Float
+        """
+        return min(self._max_rto, self._rto * (2 ** retransmits))
+
+
+class PendingRequest:
+    """
+    State of a command in flight in a SerialMsgInterface request pipeline
+    """
+    def __init__(self, index, msg_id, resp_payload_len=None, values=None):
+        """
+        Class constructor
+        :param index: position of the request in the request list :type Integer
+        :param msg_id: command to send :type MsgId
+        :param resp_payload_len: expected response payload length, None if the
+                                 command is only Acked :type MsgPayloadLen
+        :param values: command payload field values, encoded with the command's
+                       entry in CODECS; None for no payload :type Sequence
+        """
+        self.index = index
+        self.msg_id = msg_id
+        self.resp_payload_len = resp_payload_len
+        self.values = values
+        self.seq_no = -1
+        self.ack_waiter = None
+        self.resp_waiter = None
+        self.acked = False
+        self.sent_at = 0.0
+        self.deadline = 0.0
+        self.retransmits = 0
+
+    def build(self, status):
+        """
+        Build the command message
+        :param status: message status, NEW_MESSAGE or RETRANSMIT :type Integer
+        :return: message :type bytearray
+        """
+        if self.values is None:
+            return SerialMsgInterface.build_command(self.seq_no, self.msg_id, status)
+        return CODECS.get(self.msg_id, Direction.COMMAND).encode(self.seq_no, self.values, status)
+
+
 class SerialMsgInterface:
     """
     Class for handling serial messages to the Active Backplane board firmware
@@ -91,111 +233,233 @@ class SerialMsgInterface:
     KT-957-0413-00
     """
 
-    def __init__(self, serial_port, baud_rate=115200):
+    def __init__(self, serial_port, baud_rate=115200, trace_size=0):
         """
         Class constructor
-        :param None
+        :param serial_port: serial port device name :type String
+        :param baud_rate: baud rate :type Integer
+        :param trace_size: number of frames to keep in the frame trace, 0 to disable :type Integer
         :return: NA
         """
         self._serial_port = serial_port
         self._baud_rate = baud_rate
+        self._trace_size = trace_size
         self._smh = None
+        self._rtt = RttEstimator()
+        self._stats_lock = threading.Lock()
+        self._transmits = 0
+        self._retransmits = 0
+        self._nack_retransmits = 0
+        self._timeouts = 0
 
     def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def serial_port(self):
+        """ Serial port device name """
+        return self._serial_port
+
+    @property
+    def baud_rate(self):
+        """ Serial port baud rate """
+        return self._baud_rate
+
+    @property
+    def is_open(self):
+        """ True if the serial message handler is running """
+        return self._smh is not None
+
+    @property
+    def rtt(self):
+        """ Round trip time estimator for the link :type RttEstimator """
+        return self._rtt
+
+    def get_retransmit_stats(self):
+        """
+        Get the reliability layer counters
+        :return: dictionary of commands transmitted, retransmissions (of which
+                 provoked by a Nack), commands which timed out and the current
+                 round trip time estimate in seconds :type Dict
+        """
+        with self._stats_lock:
+            return {"transmits": self._transmits,
+                    "retransmits": self._retransmits,
+                    "nack_retransmits": self._nack_retransmits,
+                    "timeouts": self._timeouts,
+                    "srtt": self._rtt.srtt,
+                    "rttvar": self._rtt.rttvar,
+                    "rto": self._rtt.rto}
+
+    def get_link_stats(self):
+        """
+        Get the serial message handler link statistics, see
+        MessageHandler.get_link_stats()
+        :return: link statistics :type Dict
+        """
+        return self._smh.get_link_stats()
+
+    def dump_trace(self, path):
+        """
+        Write the serial message handler frame trace to a file, the
+        interface must have been created with a non-zero trace_size
+        :param path: file to write :type String
+        :return: number of frames written :type Integer
+        """
+        return self._smh.dump_trace(path)
+
+    def reset_retransmit_stats(self):
+        """
+        Zero the reliability layer counters, the round trip time estimate is kept
+        :return: NA
+        """
+        with self._stats_lock:
+            self._transmits = 0
+            self._retransmits = 0
+            self._nack_retransmits = 0
+            self._timeouts = 0
+
+    def open(self):
+        """
+        Open the serial port and start the serial message handler
+        :return: NA
+        """
         if self._smh is not None:
             raise RuntimeError("Already started SMH!")
-        self._smh = smh.MessageHandler()
+        self._smh = smh.MessageHandler(self._trace_size)
         if not self._smh.start(self._serial_port, self._baud_rate):
+            self._smh = None
             raise RuntimeError("Failed to start SMH!")
-        return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self._smh.stop()
+    def close(self):
+        """
+        Stop the serial message handler and close the serial port
+        :return: NA
+        """
+        if self._smh is not None:
+            self._smh.stop()
+            self._smh = None
 
-    def wait_for_ack(self, ack_no, msg_id):
+    @staticmethod
+    def build_command(seq_no, msg_id, status=smh.MessageStatus.NEW_MESSAGE.value):
         """
-        Wait for an ack to be received in response to a transmitted message
+        Utility method to build a command message which has no payload
+        :param seq_no: tx sequence number :type Integer
+        :param msg_id: command to build :type MsgId
+        :param status: message status, NEW_MESSAGE or RETRANSMIT :type Integer
+        :return: message :type bytearray
+        """
+        return smh.MessageHandler.build_message_header(
+            seq_no=seq_no,
+            ack_no=0,  # '0' for new message
+            status=status,  # Protocol = '0'
+            msg_id=msg_id.value,
+            pl_len=0)  # No payload
+
+    @staticmethod
+    def build_set_key(seq_no, key):
+        """
+        Utility method to build a SetKey command message
+        :param seq_no: tx sequence number :type Integer
+        :param key: 32-byte key :type bytearray
+        :return: message :type bytearray
+        """
+        return CODECS.get(MsgId.SET_KEY, Direction.COMMAND).encode(seq_no, (key,))
+
+    def add_ack_waiter(self, ack_no, msg_id):
+        """
+        Register a waiter for the ack to a message, must be called before the
+        message is added to the tx queue
         :param ack_no: sequence no of message that is being acked
         :param msg_id: ID of message that is being acked
+        :return: MessageWaiter to pass to wait_for_ack
+        """
+        return self._smh.add_waiter(ack_no, msg_id, ACK_STATUSES, smh.TOTAL_HEADER_LENGTH)
+
+    def wait_for_ack(self, waiter):
+        """
+        Wait for an ack to be received in response to a transmitted message,
+        returns as soon as the rx thread has matched the ack
+        :param waiter: waiter returned by add_ack_waiter
         :return: True if the ack received before SERIAL_TIMEOUT, else False
         """
-        ret_val = False
-        rx_timeout = time.time() + SERIAL_TIMEOUT
-        while True:
-            time.sleep(0.1)
-            rx_msg = self._smh.get_from_rx_queue()
-            if rx_msg:
-                log.debug("Wait for Ack Rx Msg: {}".format(" ".join(format(x, '02x') for x in rx_msg)))
-
-                if len(rx_msg) == smh.TOTAL_HEADER_LENGTH:
-                    if rx_msg[smh.HeaderOffset.ACKNOWLEDGEMENT_NO.value] == ack_no and \
-                            rx_msg[smh.HeaderOffset.MESSAGE_ID.value] == msg_id and \
-                            ((rx_msg[smh.HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] & 0xE0) == 0x40):
-                        ret_val = True
-                        break
-                    else:
-                        log.debug("Wait for Ack Rx Msg Failed Consistency Check! {} - {}; {} - {}; {}".format(
-                            rx_msg[smh.HeaderOffset.ACKNOWLEDGEMENT_NO.value], ack_no,
-                            rx_msg[smh.HeaderOffset.MESSAGE_ID.value], msg_id,
-                            rx_msg[smh.HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] & 0xE0))
-                else:
-                    log.debug("Wait for Ack Rx Msg Failed Length Check!")
-
-            if time.time() > rx_timeout:
-                log.debug("Wait for Ack Rx Msg Timed Out! - {:02x}".format(msg_id))
-                break
-
-        return ret_val
+        if waiter.wait(SERIAL_TIMEOUT) is None:
+            self._smh.remove_waiter(waiter)
+            log.debug("Wait for Ack Rx Msg Timed Out! - {:02x}".format(waiter.msg_id))
+            return False
+        return True
 
     def send_ping(self):
         """
         Sends a Ping message, waits for the response and processes it
         :return: True if Ping is successfully acked, else False :type Boolean
         """
-        seq_no = self._smh.get_next_sequence_number()
-        header_bytes = self._smh.build_message_header(
-            seq_no=seq_no,
-            ack_no=0,  # '0' for new message
-            status=0,  # Status = '0' for new message and Protocol = '0'
-            msg_id=MsgId.PING.value,
-            pl_len=0)  # No payload
-
-        log.debug("Tx Ping: {}".format(" ".join(format(x, '02x') for x in header_bytes)))
-        self._smh.send_to_tx_queue(header_bytes)
-
-        return self.wait_for_ack(seq_no, MsgId.PING.value)
+        result, _ = self.__run_requests([PendingRequest(0, MsgId.PING)], 1, MAX_RETRANSMITS)[0]
+        return result
 
     def send_set_key(self, key):
         """
         Utility method to pack the payload of a SetKey command and send it
         :param key: :type bytearray
-        :return: True if message added to serial message handler tx queue, else False
+        :return: True if SetKey is successfully acked, else False
         """
         if type(key) is not bytearray:
             log.critical("The key is not of type bytearray!")
             return False
 
-        seq_no = self._smh.get_next_sequence_number()
-        header_bytes = self._smh.build_message_header(seq_no,
-                                                      0,
-                                                      smh.MessageStatus.NEW_MESSAGE.value,
-                                                      MsgId.SET_KEY.value,
-                                                      MsgPayloadLen.SET_KEY.value)
+        return self.send_command(MsgId.SET_KEY, key)
 
-        payload_bytes = bytearray(b"\x01") # Payload version
-        payload_bytes.extend(key)
+    def send_set_unit_info(self, assembly_part_no, assembly_revision_no, assembly_serial_no,
+                           assembly_build_date_batch_no):
+        """
+        Sends a SetUnitInfo command and waits for the Ack, strings longer than
+        16 characters are truncated
+        :param assembly_part_no: :type String
+        :param assembly_revision_no: :type String
+        :param assembly_serial_no: :type String
+        :param assembly_build_date_batch_no: :type String
+        :return: True if SetUnitInfo is successfully acked, else False :type Boolean
+        """
+        return self.send_command(MsgId.SET_UNIT_INFO, assembly_part_no, assembly_revision_no,
+                                 assembly_serial_no, assembly_build_date_batch_no)
 
-        # Add the payload CRC
-        payload_crc = CRCCCITT(version="FFFF").calculate(bytes(payload_bytes))
-        payload_crc_bytes = payload_crc.to_bytes(2, byteorder="little")
-        payload_bytes.append(payload_crc_bytes[0])  # CRC LSB
-        payload_bytes.append(payload_crc_bytes[1])  # CRC MSB
+    def send_command(self, cmd, *values):
+        """
+        Sends a command with a payload and waits for the Ack, the payload is
+        encoded using the command's entry in CODECS
+        :param cmd: command to send :type MsgId
+        :param values: payload field values in table order :type Any
+        :return: True if the command is successfully acked, else False :type Boolean
+        """
+        codec = CODECS.get(cmd, Direction.COMMAND)
+        if codec is None:
+            raise ValueError("{} has no command payload codec".format(cmd))
+        if len(values) != len(codec.fields):
+            raise ValueError("{} expects {} payload values".format(cmd.name, len(codec.fields)))
 
-        # Build and send the message
-        msg_bytes = header_bytes + payload_bytes
-        self._smh.send_to_tx_queue(msg_bytes)
+        result, _ = self.__run_requests([PendingRequest(0, cmd, values=values)], 1, MAX_RETRANSMITS)[0]
+        return result
 
-        return self.wait_for_ack(seq_no, MsgId.SET_KEY.value)
+    def get_payload(self, get_cmd):
+        """
+        Sends a command that expects a response and decodes the response
+        payload using the command's entry in CODECS
+        :param get_cmd: command to send :type MsgId
+        :return: [0] True if response received, else False; [1] decoded payload
+                 named tuple, or None :type Tuple
+        """
+        codec = CODECS.get(get_cmd, Direction.RESPONSE)
+        if codec is None:
+            raise ValueError("{} has no response payload codec".format(get_cmd))
+
+        result, rx_msg = self.get_command(get_cmd, MsgPayloadLen(codec.payload_length))
+        if not result:
+            return False, None
+        return True, codec.decode(rx_msg)
 
     def get_command(self, get_cmd, resp_payload_len):
         """
@@ -207,50 +471,172 @@ class SerialMsgInterface:
         if resp_payload_len not in MsgPayloadLen:
             raise ValueError("get_cmd must be one of MsgPayloadLen enumerated values")
 
-        seq_no = self._smh.get_next_sequence_number()
-        header_bytes = self._smh.build_message_header(
-            seq_no=seq_no,
-            ack_no=0,  # '0' for new message
-            status=0,  # Status = '0' for new message and Protocol = '0'
-            msg_id=get_cmd.value,
-            pl_len=0)  # No payload
+        return self.__run_requests([PendingRequest(0, get_cmd, resp_payload_len)], 1, MAX_RETRANSMITS)[0]
 
-        log.debug("Tx Get Cmd: {}".format(" ".join(format(x, '02x') for x in header_bytes)))
-        self._smh.send_to_tx_queue(header_bytes)
+    def __send_pending_request(self, request, event, retransmit=False):
+        """
+        Send (or resend) the command for a pipelined request, registering its
+        Ack and response waiters first
+        :param request: the request to send :type PendingRequest
+        :param event: event shared by all waiters in the pipeline :type threading.Event
+        :param retransmit: True to resend with the RETRANSMIT status :type Boolean
+        :return: NA
+        """
+        if retransmit:
+            status = smh.MessageStatus.RETRANSMIT.value
+            request.retransmits += 1
+        else:
+            status = smh.MessageStatus.NEW_MESSAGE.value
+            request.seq_no = self._smh.get_next_sequence_number()
+
+        msg_bytes = request.build(status)
+
+        # A retransmitted command is acked again, so always wait for a fresh Ack (or Nack)
+        if request.ack_waiter is not None:
+            self._smh.remove_waiter(request.ack_waiter)
+        request.ack_waiter = self._smh.add_waiter(
+            request.seq_no, request.msg_id.value, ACK_NACK_STATUSES, smh.TOTAL_HEADER_LENGTH, event)
+        if request.resp_waiter is None and request.resp_payload_len is not None:
+            request.resp_waiter = self._smh.add_waiter(
+                request.seq_no, request.msg_id.value, RESPONSE_STATUSES,
+                smh.TOTAL_HEADER_LENGTH + request.resp_payload_len.value + smh.CRC_LENGTH, event)
+
+        request.acked = False
+        request.sent_at = time.monotonic()
+        request.deadline = request.sent_at + self._rtt.timeout(request.retransmits)
+        with self._stats_lock:
+            self._transmits += 1
+            if retransmit:
+                self._retransmits += 1
+        log.debug("Tx Cmd: %s", HexDump(msg_bytes))
+        self._smh.send_to_tx_queue(msg_bytes)
 
-        # Wait for Ack, if it's successful wait for response
-        if not self.wait_for_ack(seq_no, get_cmd.value):
-            log.debug("No Ack")
-            return False, None
+    def __check_pending_request(self, request, event, now, max_retransmits):
+        """
+        Advance a request in flight: take an RTT sample from its Ack, resend
+        it straight away if it was Nacked or once its retransmission timeout
+        expires without an Ack.  An Acked request is never resent; it fails
+        if its response has not arrived within RESPONSE_TIMEOUT
+        :param request: the request to check :type PendingRequest
+        :param event: event shared by all waiters in the pipeline :type threading.Event
+        :param now: current time.monotonic() :type Float
+        :param max_retransmits: maximum number of times to resend a command :type Integer
+        :return: None while the request is in flight, else its (result, message) tuple
+        """
+        if not request.acked and request.ack_waiter.done:
+            ack = request.ack_waiter.msg
+            if (ack[smh.HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] >> 5) == \
+                    smh.MessageStatus.NOT_ACKNOWLEDGE.value:
+                if request.retransmits < max_retransmits:
+                    log.debug("Cmd Nacked, Retransmit - {:02x}".format(request.msg_id.value))
+                    with self._stats_lock:
+                        self._nack_retransmits += 1
+                    self.__send_pending_request(request, event, retransmit=True)
+                    return None
+                log.debug("Cmd Nacked - {:02x}".format(request.msg_id.value))
+                return False, None
+
+            request.acked = True
+            # Karn's algorithm: an Ack to a retransmitted frame may be for any transmission
+            if request.retransmits == 0:
+                self._rtt.update(request.ack_waiter.completed_at - request.sent_at)
+            # Allow the response RESPONSE_TIMEOUT after the Ack
+            request.deadline = now + RESPONSE_TIMEOUT
+
+        if request.acked and (request.resp_waiter is None or request.resp_waiter.done):
+            return True, request.resp_waiter.msg if request.resp_waiter is not None else None
+        if now < request.deadline:
+            return None
+        if not request.acked and request.retransmits < max_retransmits:
+            log.debug("Cmd Retransmit - {:02x}".format(request.msg_id.value))
+            self.__send_pending_request(request, event, retransmit=True)
+            return None
 
-        ret_val = False
-        rx_timeout = time.time() + SERIAL_TIMEOUT
-        while True:
-            time.sleep(0.1)
-            rx_msg = self._smh.get_from_rx_queue()
-            if rx_msg:
-                log.debug("Get Cmd Rx Msg: {}".format(" ".join(format(x, '02x') for x in rx_msg)))
-
-                if len(rx_msg) == smh.TOTAL_HEADER_LENGTH + resp_payload_len.value + smh.CRC_LENGTH:
-                    if rx_msg[smh.HeaderOffset.ACKNOWLEDGEMENT_NO.value] == seq_no and \
-                            rx_msg[smh.HeaderOffset.MESSAGE_ID.value] == get_cmd.value and \
-                            (((rx_msg[smh.HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] & 0xE0) == 0x80) or
-                                ((rx_msg[smh.HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] & 0xE0) == 0x00)):
-                        ret_val = True
-                        break
-                    else:
-                        log.debug("Get Cmd Rx Msg Failed Consistency Check! {} - {}; {} - {}; {}".format(
-                            rx_msg[smh.HeaderOffset.ACKNOWLEDGEMENT_NO.value], seq_no,
-                            rx_msg[smh.HeaderOffset.MESSAGE_ID.value], get_cmd.value,
-                            rx_msg[smh.HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] & 0xE0))
-                else:
-                    log.debug("Get Cmd Rx Msg Failed Length Check!")
-
-            if time.time() > rx_timeout:
-                log.debug("Get Cmd Rx Msg Timed Out! - {:02x}".format(get_cmd.value))
-                break
-
-        return ret_val, rx_msg
+        log.debug("Cmd Rx Msg Timed Out! - {:02x}".format(request.msg_id.value))
+        with self._stats_lock:
+            self._timeouts += 1
+        return False, None
+
+    def __run_requests(self, requests, window, max_retransmits):
+        """
+        Send a list of requests, keeping up to window of them in flight
+        :param requests: requests to send :type List of PendingRequest
+        :param window: maximum number of commands in flight :type Integer
+        :param max_retransmits: maximum number of times to resend a command :type Integer
+        :return: list of (result, message) tuples in the same order as requests
+        """
+        queued = list(reversed(requests))
+        results = [(False, None)] * len(requests)
+        in_flight = []
+        event = threading.Event()
+
+        while queued or in_flight:
+            # Top up the window
+            while queued and len(in_flight) < window:
+                request = queued.pop()
+                self.__send_pending_request(request, event)
+                in_flight.append(request)
+
+            # Clear before scanning so that a completion during the scan is not missed
+            event.clear()
+            now = time.monotonic()
+            for request in list(in_flight):
+                result = self.__check_pending_request(request, event, now, max_retransmits)
+                if result is None:
+                    continue
+                results[request.index] = result
+                self._smh.remove_waiter(request.ack_waiter)
+                if request.resp_waiter is not None:
+                    self._smh.remove_waiter(request.resp_waiter)
+                in_flight.remove(request)
+
+            # Sleep until something completes or the next deadline, unless
+            # there is room in the window to send more
+            if in_flight and (not queued or len(in_flight) >= window):
+                event.wait(max(0.0, min(request.deadline for request in in_flight) - time.monotonic()))
+
+        return results
+
+    def get_many(self, requests, window=PIPELINE_WINDOW, max_retransmits=MAX_RETRANSMITS):
+        """
+        Sends several commands that expect a response, keeping up to window of
+        them outstanding at once.  Responses are matched to their command by
+        sequence number; a command which is Nacked, or whose Ack has not
+        arrived within the retransmission timeout, is resent with the
+        RETRANSMIT status.  An Acked command whose response has not arrived
+        within RESPONSE_TIMEOUT fails
+        :param requests: list of (MsgId, MsgPayloadLen) tuples :type List
+        :param window: maximum number of commands in flight :type Integer
+        :param max_retransmits: maximum number of times to resend a command :type Integer
+        :return: list of (result, message) tuples in the same order as requests,
+                 as returned by get_command :type List
+        """
+        if not 0 < window < 256:
+            raise ValueError("window must be between 1 and 255")
+
+        pending = []
+        for index, (get_cmd, resp_payload_len) in enumerate(requests):
+            if get_cmd not in MsgId:
+                raise ValueError("get_cmd must be one of MsgId enumerated values")
+            if resp_payload_len not in MsgPayloadLen:
+                raise ValueError("resp_payload_len must be one of MsgPayloadLen enumerated values")
+            pending.append(PendingRequest(index, get_cmd, resp_payload_len))
+
+        return self.__run_requests(pending, window, max_retransmits)
+
+    @staticmethod
+    def unpack_response(ba):
+        """
+        Utility method to unpack the payload of any response in CODECS
+        :param ba: response message to unpack :type bytearray
+        :return: None if ba is not a known response of the right length, else
+                 the decoded payload named tuple
+        """
+        try:
+            return CODECS.decode(ba, Direction.RESPONSE)
+        except (KeyError, ValueError, IndexError) as ex:
+            log.critical("Unpack Response failed: {}".format(ex))
+            return None
 
     @staticmethod
     def unpack_get_software_version_number_response(ba):
@@ -259,15 +645,11 @@ class SerialMsgInterface:
         :param ba: ByteArray payload of response message to unpack
         :return: None if ba is wrong type or length, else 5x unpacked values
         """
-        if type(ba) != bytearray or len(ba) != \
-                smh.TOTAL_HEADER_LENGTH + MsgPayloadLen.GET_SOFTWARE_VERSION_NUMBER.value + smh.CRC_LENGTH:
-            log.critical("Unpack GetSoftwareVersionNumber Response expecting {}-byte array".format(
-                smh.TOTAL_HEADER_LENGTH + MsgPayloadLen.GET_SOFTWARE_VERSION_NUMBER.value + smh.CRC_LENGTH))
+        try:
+            return CODECS.get(MsgId.GET_SOFTWARE_VERSION_NUMBER, Direction.RESPONSE).decode(ba)
+        except ValueError as ex:
+            log.critical("Unpack GetSoftwareVersionNumber Response failed: {}".format(ex))
             return None
-        else:
-            payload_version, sw_major, sw_minor, sw_patch, sw_build = \
-                struct.unpack("<BHHHI", ba[smh.TOTAL_HEADER_LENGTH:len(ba) - smh.CRC_LENGTH])
-            return payload_version, sw_major, sw_minor, sw_patch, sw_build
 
     @staticmethod
     def unpack_get_key_response(ba):
@@ -276,38 +658,11 @@ class SerialMsgInterface:
         :param ba: ByteArray payload of response message to unpack
         :return: None if ba is wrong type or length, else key payload version, key
         """
-        if type(ba) != bytearray or len(ba) != \
-                smh.TOTAL_HEADER_LENGTH + MsgPayloadLen.GET_KEY.value + smh.CRC_LENGTH:
-            log.critical("Unpack GetKey Response expecting {}}-byte array".format(
-                smh.TOTAL_HEADER_LENGTH + MsgPayloadLen.GET_KEY.value + smh.CRC_LENGTH
-            ))
+        try:
+            return CODECS.get(MsgId.GET_KEY, Direction.RESPONSE).decode(ba)
+        except ValueError as ex:
+            log.critical("Unpack GetKey Response failed: {}".format(ex))
             return None
-        else:
-            read_position = smh.TOTAL_HEADER_LENGTH
-
-            payload_version = ba[read_position: read_position + 1]
-            read_position += 1
-
-            key = ba[read_position: read_position + 32]
-            read_position += 32
-
-            return payload_version, key
-
-    # def start(self, serial_port, baud_rate):
-    #     """
-    #     Starts the MessageHandler running
-    #     :param serial_port:
-    #     :param baud_rate:
-    #     :return: True if started, else False :type: Boolean
-    #     """
-    #     return self._smh.start(serial_port, baud_rate)
-
-    # def stop(self):
-    #     """
-    #     Stop the MessageHandler from running
-    #     :return:
-    #     """
-    #     self._smh.stop()
 
 
 # -----------------------------------------------------------------------------
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Module for handling serial messages using the Blackstar serial protocol
+specified in KT-957-0143-00 from asyncio coroutines. Implements the Active
+Backplane command set for communicating with the Active Backplane Firmware,
+KT-956-0194-00.
+"""
+# -----------------------------------------------------------------------------
+# Copyright (c) 2020, Kirintec
+#
+# -----------------------------------------------------------------------------
+"""
+OPTIONS ------------------------------------------------------------------
+None
+
+ARGUMENTS -------------------------------------------------------------
+None
+"""
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# stdlib imports -------------------------------------------------------
+import asyncio
+import logging
+import time
+
+# Third-party imports -----------------------------------------------
+
+
+# Our own imports ---------------------------------------------------
+import serial_message_handler as smh
+from serial_message_handler_async import AsyncMessageHandler
+from serial_msg_intf import SerialMsgInterface, PendingRequest, RttEstimator, MsgId, MsgPayloadLen, \
+    SERIAL_TIMEOUT, ACK_NACK_STATUSES, RESPONSE_STATUSES, PIPELINE_WINDOW, MAX_RETRANSMITS, RESPONSE_TIMEOUT
+
+# -----------------------------------------------------------------------------
+# GLOBALS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# CONSTANTS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# LOCAL UTILITIES
+# -----------------------------------------------------------------------------
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+# -----------------------------------------------------------------------------
+# CLASSES
+# -----------------------------------------------------------------------------
+class AsyncSerialMsgInterface:
+    """
+    asyncio equivalent of SerialMsgInterface.  Any number of coroutines may
+    issue commands concurrently over the one serial port, each response is
+    matched to its command by sequence number and is retransmitted as by
+    SerialMsgInterface.  Messages that are not a response to a command may
+    be consumed with async iteration:
+
+        async with AsyncSerialMsgInterface(port) as smi:
+            async for msg in smi:
+                ...
+    """
+    unpack_get_software_version_number_response = \
+        staticmethod(SerialMsgInterface.unpack_get_software_version_number_response)
+    unpack_get_key_response = staticmethod(SerialMsgInterface.unpack_get_key_response)
+
+    def __init__(self, serial_port, baud_rate=115200, trace_size=0):
+        """
+        Class constructor
+        :param serial_port: serial port device name :type String
+        :param baud_rate: baud rate :type Integer
+        :param trace_size: number of frames to keep in the frame trace, 0 to disable :type Integer
+        """
+        self._serial_port = serial_port
+        self._baud_rate = baud_rate
+        self._trace_size = trace_size
+        self._smh = None
+        self._rtt = RttEstimator()
+        self._transmits = 0
+        self._retransmits = 0
+        self._nack_retransmits = 0
+        self._timeouts = 0
+
+    async def __aenter__(self):
+        if self._smh is not None:
+            raise RuntimeError("Already started SMH!")
+        self._smh = AsyncMessageHandler(self._trace_size)
+        if not self._smh.start(self._serial_port, self._baud_rate):
+            self._smh = None
+            raise RuntimeError("Failed to start SMH!")
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._smh.stop()
+        self._smh = None
+
+    def __aiter__(self):
+        return self._smh.__aiter__()
+
+    @property
+    def rtt(self):
+        """ Round trip time estimator for the link :type RttEstimator """
+        return self._rtt
+
+    def get_retransmit_stats(self):
+        """
+        Get the reliability layer counters, see SerialMsgInterface.get_retransmit_stats()
+        :return: reliability layer counters :type Dict
+        """
+        return {"transmits": self._transmits,
+                "retransmits": self._retransmits,
+                "nack_retransmits": self._nack_retransmits,
+                "timeouts": self._timeouts,
+                "srtt": self._rtt.srtt,
+                "rttvar": self._rtt.rttvar,
+                "rto": self._rtt.rto}
+
+    def reset_retransmit_stats(self):
+        """
+        Zero the reliability layer counters, the round trip time estimate is kept
+        :return: NA
+        """
+        self._transmits = 0
+        self._retransmits = 0
+        self._nack_retransmits = 0
+        self._timeouts = 0
+
+    def get_link_stats(self):
+        """
+        Get the message handler link statistics, see MessageHandler.get_link_stats()
+        :return: link statistics :type Dict
+        """
+        return self._smh.get_link_stats()
+
+    def dump_trace(self, path):
+        """
+        Write the message handler frame trace to a file
+        :param path: file to write :type String
+        :return: number of frames written :type Integer
+        """
+        return self._smh.dump_trace(path)
+
+    async def __wait(self, waiter, event, timeout=SERIAL_TIMEOUT):
+        """
+        Wait for a waiter to be completed by the message handler
+        :param waiter: waiter returned by add_waiter :type MessageWaiter
+        :param event: the asyncio.Event passed to add_waiter :type asyncio.Event
+        :param timeout: timeout in seconds :type Float
+        :return: the matching message, or None if the timeout expired :type bytearray
+        """
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            self._smh.remove_waiter(waiter)
+            return None
+        return waiter.msg
+
+    async def __send_command(self, request, max_retransmits=MAX_RETRANSMITS):
+        """
+        Send a command and wait for its Ack and, optionally, its response.  A
+        command which is Nacked, or whose Ack has not arrived within the
+        retransmission timeout, is resent with the RETRANSMIT status.  An
+        Acked command is never resent; it fails if its response has not
+        arrived within RESPONSE_TIMEOUT
+        :param request: the command to send :type PendingRequest
+        :param max_retransmits: maximum number of times to resend the command :type Integer
+        :return: [0] True if Acked (and response received); [1] response or None
+        """
+        msg_id = request.msg_id.value
+        request.seq_no = self._smh.get_next_sequence_number()
+        if request.resp_payload_len is not None:
+            resp_event = asyncio.Event()
+            request.resp_waiter = self._smh.add_waiter(
+                request.seq_no, msg_id, RESPONSE_STATUSES,
+                smh.TOTAL_HEADER_LENGTH + request.resp_payload_len.value + smh.CRC_LENGTH, resp_event)
+        status = smh.MessageStatus.NEW_MESSAGE.value
+
+        try:
+            while True:
+                # A retransmitted command is acked again, so always wait for a fresh Ack (or Nack)
+                ack_event = asyncio.Event()
+                request.ack_waiter = self._smh.add_waiter(
+                    request.seq_no, msg_id, ACK_NACK_STATUSES, smh.TOTAL_HEADER_LENGTH, ack_event)
+                request.sent_at = time.monotonic()
+                self._transmits += 1
+                self._smh.send_to_tx_queue(request.build(status))
+
+                ack = await self.__wait(request.ack_waiter, ack_event, self._rtt.timeout(request.retransmits))
+                nacked = ack is not None and (ack[smh.HeaderOffset.MESSAGE_STATUS_PROTOCOL_VERSION.value] >> 5) == \
+                    smh.MessageStatus.NOT_ACKNOWLEDGE.value
+                if ack is not None and not nacked:
+                    break
+                if request.retransmits >= max_retransmits:
+                    if nacked:
+                        log.debug("Cmd Nacked - {:02x}".format(msg_id))
+                    else:
+                        log.debug("Wait for Ack Rx Msg Timed Out! - {:02x}".format(msg_id))
+                        self._timeouts += 1
+                    return False, None
+
+                if nacked:
+                    log.debug("Cmd Nacked, Retransmit - {:02x}".format(msg_id))
+                    self._nack_retransmits += 1
+                else:
+                    log.debug("Cmd Retransmit - {:02x}".format(msg_id))
+                status = smh.MessageStatus.RETRANSMIT.value
+                request.retransmits += 1
+                self._retransmits += 1
+
+            # Karn's algorithm: an Ack to a retransmitted frame may be for any transmission
+            if request.retransmits == 0:
+                self._rtt.update(request.ack_waiter.completed_at - request.sent_at)
+
+            if request.resp_waiter is None:
+                return True, None
+
+            rx_msg = await self.__wait(request.resp_waiter, resp_event, RESPONSE_TIMEOUT)
+            if rx_msg is None:
+                log.debug("Get Cmd Rx Msg Timed Out! - {:02x}".format(msg_id))
+                self._timeouts += 1
+                return False, None
+            return True, rx_msg
+        finally:
+            # Also removes the waiters if the coroutine is cancelled
+            self._smh.remove_waiter(request.ack_waiter)
+            if request.resp_waiter is not None:
+                self._smh.remove_waiter(request.resp_waiter)
+
+    async def send_ping(self):
+        """
+        Sends a Ping message and waits for the Ack
+        :return: True if Ping is successfully acked, else False :type Boolean
+        """
+        result, _ = await self.__send_command(PendingRequest(0, MsgId.PING))
+        return result
+
+    async def send_set_key(self, key):
+        """
+        Sends a SetKey command and waits for the Ack
+        :param key: :type bytearray
+        :return: True if SetKey is successfully acked, else False :type Boolean
+        """
+        if type(key) is not bytearray:
+            log.critical("The key is not of type bytearray!")
+            return False
+
+        result, _ = await self.__send_command(PendingRequest(0, MsgId.SET_KEY, values=(key,)))
+        return result
+
+    async def get_command(self, get_cmd, resp_payload_len):
+        """
+        Sends a command that expects a response, waits for the Ack and response
+        :return: [0] True if response received, else False; [1] the received message
+        """
+        if get_cmd not in MsgId:
+            raise ValueError("get_cmd must be one of MsgId enumerated values")
+        if resp_payload_len not in MsgPayloadLen:
+            raise ValueError("resp_payload_len must be one of MsgPayloadLen enumerated values")
+
+        return await self.__send_command(PendingRequest(0, get_cmd, resp_payload_len))
+
+    async def get_many(self, requests, window=PIPELINE_WINDOW):
+        """
+        Sends several commands that expect a response concurrently, keeping
+        up to window of them outstanding at once.  Sequence numbers are 8 bit,
+        so more than 255 in flight would be confused with each other
+        :param requests: list of (MsgId, MsgPayloadLen) tuples :type List
+        :param window: maximum number of commands in flight :type Integer
+        :return: list of (result, message) tuples in the same order as requests
+        """
+        if not 0 < window < 256:
+            raise ValueError("window must be between 1 and 255")
+
+        semaphore = asyncio.Semaphore(window)
+
+        async def get_one(get_cmd, resp_payload_len):
+            async with semaphore:
+                return await self.get_command(get_cmd, resp_payload_len)
+
+        return await asyncio.gather(*(get_one(get_cmd, resp_payload_len)
+                                      for get_cmd, resp_payload_len in requests))
+
+
+# -----------------------------------------------------------------------------
+# FUNCTIONS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# RUNTIME PROCEDURE
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    """
+    Module is NOT intended to be executed stand-alone, print warning message
+    """
+    print("Module is NOT intended to be executed stand-alone")
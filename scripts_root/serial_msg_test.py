@@ -6,7 +6,8 @@ Simple script file to test the functionality of th SerialMsgInterface class
 # Copyright (c) 2021, Kirintec
 #
 # -----------------------------------------------------------------------------
-from serial_msg_intf import SerialMsgInterface, MsgId, MsgPayloadLen
+from serial_msg_intf import MsgId, MsgPayloadLen
+from serial_session import sessions
 import logging
 
 log = logging.getLogger(__name__)
@@ -25,7 +26,7 @@ if __name__ == "__main__":
     fail_count = 0
 
     for i in range(0, NO_TESTS):
-        with SerialMsgInterface(COM_PORT, BAUD_RATE) as smi:
+        with sessions.session(COM_PORT, BAUD_RATE) as smi:
             result = smi.send_ping()
             log.info("{} Ping {}".format(result, i))
             if result:
@@ -70,4 +71,4 @@ if __name__ == "__main__":
 
     log.info("Pass Count: {}".format(pass_count))
     log.info("Fail Count: {}".format(fail_count))
-    # smi.stop()
+    sessions.close_all()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Module providing long-lived, reference-counted SerialMsgInterface sessions
+so that callers which talk to the Active Backplane repeatedly share one open
+serial port instead of opening and closing it for every command.
+"""
+# -----------------------------------------------------------------------------
+# Copyright (c) 2021, Kirintec
+#
+# -----------------------------------------------------------------------------
+"""
+OPTIONS ------------------------------------------------------------------
+None
+
+ARGUMENTS -------------------------------------------------------------
+None
+"""
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# stdlib imports -------------------------------------------------------
+import atexit
+import contextlib
+import logging
+from threading import Lock
+
+# Third-party imports -----------------------------------------------
+
+
+# Our own imports ---------------------------------------------------
+from serial_msg_intf import SerialMsgInterface
+
+# -----------------------------------------------------------------------------
+# GLOBALS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# CONSTANTS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# LOCAL UTILITIES
+# -----------------------------------------------------------------------------
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+# -----------------------------------------------------------------------------
+# CLASSES
+# -----------------------------------------------------------------------------
+class SerialSessionManager:
+    """
+    Keeps one SerialMsgInterface open per serial port.  acquire() opens the
+    port on first use and otherwise just increments a reference count;
+    release() decrements it.  Sessions stay open when their reference count
+    drops to zero so that the next caller does not pay for re-opening the
+    port, close_idle() or close_all() must be called to release the port,
+    e.g. before handing it over to another process.
+    """
+    def __init__(self):
+        """ Class constructor """
+        self._sessions = {}
+        self._lock = Lock()
+
+    def acquire(self, serial_port, baud_rate=115200):
+        """
+        Get the shared session for a serial port, opening it if necessary
+        :param serial_port: serial port device name :type String
+        :param baud_rate: baud rate :type Integer
+        :return: open SerialMsgInterface, must be passed to release() when done
+        """
+        with self._lock:
+            entry = self._sessions.get(serial_port)
+            if entry is None:
+                smi = SerialMsgInterface(serial_port, baud_rate)
+                smi.open()
+                entry = [smi, 0]
+                self._sessions[serial_port] = entry
+                log.debug("Opened session on {}".format(serial_port))
+            elif entry[0].baud_rate != baud_rate:
+                raise ValueError("Session on {} already open at {} baud".format(serial_port, entry[0].baud_rate))
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, smi):
+        """
+        Release a session obtained from acquire()
+        :param smi: session to release :type SerialMsgInterface
+        :return: NA
+        """
+        with self._lock:
+            entry = self._sessions.get(smi.serial_port)
+            if entry is None or entry[0] is not smi or entry[1] == 0:
+                raise RuntimeError("Session on {} was not acquired".format(smi.serial_port))
+            entry[1] -= 1
+
+    @contextlib.contextmanager
+    def session(self, serial_port, baud_rate=115200):
+        """
+        Context manager wrapping acquire() and release()
+        :param serial_port: serial port device name :type String
+        :param baud_rate: baud rate :type Integer
+        :return: open SerialMsgInterface
+        """
+        smi = self.acquire(serial_port, baud_rate)
+        try:
+            yield smi
+        finally:
+            self.release(smi)
+
+    def close_idle(self):
+        """
+        Close every session which is not currently acquired
+        :return: NA
+        """
+        with self._lock:
+            idle = [port for port, entry in self._sessions.items() if entry[1] == 0]
+            entries = [self._sessions.pop(port) for port in idle]
+        for smi, _ in entries:
+            smi.close()
+            log.debug("Closed session on {}".format(smi.serial_port))
+
+    def close_all(self):
+        """
+        Close every session, whether or not it is acquired
+        :return: NA
+        """
+        with self._lock:
+            entries = list(self._sessions.values())
+            self._sessions.clear()
+        for smi, ref_count in entries:
+            if ref_count:
+                log.warning("Closing session on {} with {} users".format(smi.serial_port, ref_count))
+            smi.close()
+
+
+# Default, process-wide session manager
+sessions = SerialSessionManager()
+atexit.register(sessions.close_all)
+
+
+# -----------------------------------------------------------------------------
+# FUNCTIONS
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# RUNTIME PROCEDURE
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    """
+    Module is NOT intended to be executed stand-alone, print warning message
+    """
+    print("Module is NOT intended to be executed stand-alone")
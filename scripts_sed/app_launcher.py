@@ -7,8 +7,11 @@ import operator
 import os
 import re
 
-import generate_ephemerides as ephem
+import ephemeris_cache
+import orbit
+import user_motion
 from get_pa_calibration import GetPACalibration
+from gnss_spoof_config import EPHEM_DIR, GPS_SIM_STATIC_DURATION_MAX
 
 APP_FULL_PATH = {
     "iq_transmit": "/lib/uhd/examples/tx_samples_from_file",
@@ -16,7 +19,6 @@ APP_FULL_PATH = {
 }
 CMD_FILE = "/opt/blackstar/command"
 DATA_DIR = "/opt/blackstar/data"
-EPHEM_DIR = "/mnt/sed/admin-data/ephem"
 VALID_FILE_PATTERN = r"[^\.\/_\-A-Za-z0-9]"
 
 FREQ_MIN_HZ = 400e6
@@ -28,7 +30,43 @@ ATT_MIN_DB = 0
 ATT_MAX_DB = 89
 FORMAT_VALUES = ["double", "float", "short"]
 GAIN_MAX = 89.75
-GPS_SIM_STATIC_DURATION_MAX = 86400
+# gps-gen-realtime steps through a motion file at 10 Hz, one position per line
+GPS_SIM_MOTION_RATE_HZ = user_motion.SAMPLE_RATE_HZ
+# Motion file positions used to select the visible satellites
+GPS_SIM_MOTION_MAX_POSITIONS = 64
+
+
+def get_motion_duration_s(motion_file):
+    """
+    Get the duration of a motion file run
+    :param motion_file: motion file :type String
+    :return: duration in seconds, None if the file cannot be read :type Float
+    """
+    try:
+        with open(motion_file) as f:
+            return sum(1 for line in f if line.strip()) / GPS_SIM_MOTION_RATE_HZ
+    except OSError:
+        return None
+
+
+def get_motion_positions(motion_file, max_positions=GPS_SIM_MOTION_MAX_POSITIONS):
+    """
+    Get ECEF positions evenly spread along a motion file run
+    :param motion_file: motion file, lines of time,latitude,longitude,height as given to -x :type String
+    :param max_positions: maximum number of positions to return :type Integer
+    :return: array of [x, y, z] in metres, None if the file cannot be read :type numpy.ndarray
+    """
+    try:
+        with open(motion_file) as f:
+            positions = [[float(value) for value in line.split(",")[1:4]] for line in f if line.strip()]
+    except (OSError, ValueError):
+        return None
+    if not positions:
+        return None
+    step = max(1, -(-len(positions) // max_positions))
+    positions = positions[::step] + [positions[-1]]
+    return orbit.geodeticToEcef(*zip(*positions))
+
 
 if __name__ == "__main__":
     ok = False
@@ -113,19 +151,6 @@ if __name__ == "__main__":
                         except:
                             pass
 
-                    # Find the ephemeris file
-                    # try:
-                    #    ephem_file = max(glob.glob(EPHEM_DIR + "/*"), key=os.path.getctime)
-                    # except Exception:
-                    #    ephem_file = None
-
-                    # Generate a new ephemeris file using nearest (earlier) 2-hour block to spoof time
-                    ephem_hour = spoof_hour
-                    if ephem_hour % 2:
-                        ephem_hour -= 1
-                    ephem_datetime = datetime.datetime(spoof_year, spoof_month, spoof_day, ephem_hour)
-                    ephem_file = ephem.generateEphemerides(EPHEM_DIR, ephem_datetime)
-
                     gain_switch = "-G"
                     # Set the frequency
                     freq_Hz = GPS_L1_HZ
@@ -134,41 +159,81 @@ if __name__ == "__main__":
                     except:
                         extra_gain_dB = 36
 
-                    if ephem_file:
-                        # Validate the parameters
-                        if "location" in data.keys():
-                            location = data["location"]
-                            latitude = float(location["latitude"])
-                            longitude = float(location["longitude"])
-                            height = float(location["height"])
-                            if -90.0 <= latitude <= 90.0:
-                                if -180.0 <= longitude <= 180.0:
-                                    if -1000.0 <= height <= 20000.0:
-                                        command = APP_FULL_PATH[app_name]
-                                        command += " -l {},{},{}".format(latitude, longitude, height)
-                                    else:
-                                        print("ERROR: 'latitude' value failed validation")
+                    # Validate the parameters before any file they name is read, the ephemerides
+                    # only cover the run, from the start of its block, for the satellites visible
+                    # from the location or along the motion file
+                    if "location" in data.keys():
+                        location = data["location"]
+                        latitude = float(location["latitude"])
+                        longitude = float(location["longitude"])
+                        height = float(location["height"])
+                        if -90.0 <= latitude <= 90.0:
+                            if -180.0 <= longitude <= 180.0:
+                                if -1000.0 <= height <= 20000.0:
+                                    command = APP_FULL_PATH[app_name]
+                                    command += " -l {},{},{}".format(latitude, longitude, height)
+                                    # For static mode, set duration to maximum
+                                    command += " -d {}".format(GPS_SIM_STATIC_DURATION_MAX)
+                                    run_duration_s = GPS_SIM_STATIC_DURATION_MAX
+                                    ephem_receivers = orbit.geodeticToEcef(latitude, longitude, height)
                                 else:
-                                    print("ERROR: 'longitude' value failed validation")
+                                    print("ERROR: 'latitude' value failed validation")
                             else:
-                                print("ERROR: 'height' value failed validation")
-                            # For static mode, set duration to maximum
-                            command += " -d {}".format(GPS_SIM_STATIC_DURATION_MAX)
-                        elif "motion_file" in data.keys():
-                            motion_file = data["motion_file"]
-                            if not re.search(VALID_FILE_PATTERN, motion_file):
+                                print("ERROR: 'longitude' value failed validation")
+                        else:
+                            print("ERROR: 'height' value failed validation")
+                    elif "motion_file" in data.keys():
+                        motion_file = data["motion_file"]
+                        if not re.search(VALID_FILE_PATTERN, motion_file):
+                            # Check the sample rate, continuity and dynamics of the motion
+                            motion_problems = user_motion.validateMotionFile(motion_file,
+                                                                             GPS_SIM_MOTION_RATE_HZ)
+                            if not motion_problems:
                                 command = APP_FULL_PATH[app_name]
                                 command += " -x {}".format(motion_file)
+                                run_duration_s = get_motion_duration_s(motion_file)
+                                ephem_receivers = get_motion_positions(motion_file)
                             else:
-                                print("ERROR: 'motion_file' value failed validation")
-                        # Add the ephemeris file option
-                        command += " -e {}".format(ephem_file)
-                        # Add the date/time option
-                        command += " -t {}/{}/{},{}:{}:{}".format(spoof_year, spoof_month, spoof_day,
-                                                                  spoof_hour, spoof_minute, spoof_second)
-                    else:
-                        print("ERROR: could not find an ephemeris file in {}".format(EPHEM_DIR))
-                        command = ""
+                                for problem in motion_problems:
+                                    print("ERROR: 'motion_file' {}".format(problem))
+                        else:
+                            print("ERROR: 'motion_file' value failed validation")
+
+                    if command:
+                        # Find the ephemeris file
+                        # try:
+                        #    ephem_file = max(glob.glob(EPHEM_DIR + "/*"), key=os.path.getctime)
+                        # except Exception:
+                        #    ephem_file = None
+
+                        # Get an ephemeris file using nearest (earlier) 2-hour block to spoof time, it
+                        # is only generated if these nav files and block have not been used before or
+                        # pre-generated by ephemeris_daemon.py. The satellites visible from the run
+                        # are filtered from the file for all satellites, so a pre-generated file is
+                        # used wherever the run is
+                        ephem_hour = spoof_hour
+                        if ephem_hour % 2:
+                            ephem_hour -= 1
+                        ephem_datetime = datetime.datetime(spoof_year, spoof_month, spoof_day, ephem_hour)
+                        if run_duration_s is not None:
+                            ephem_duration = datetime.timedelta(hours=spoof_hour - ephem_hour,
+                                                                minutes=spoof_minute,
+                                                                seconds=spoof_second + run_duration_s)
+                        else:
+                            ephem_duration = None
+                        ephem_file = ephemeris_cache.getEphemerisFile(EPHEM_DIR, ephem_datetime,
+                                                                      duration=ephem_duration,
+                                                                      receivers=ephem_receivers)
+
+                        if ephem_file:
+                            # Add the ephemeris file option
+                            command += " -e {}".format(ephem_file)
+                            # Add the date/time option
+                            command += " -t {}/{}/{},{}:{}:{}".format(spoof_year, spoof_month, spoof_day,
+                                                                      spoof_hour, spoof_minute, spoof_second)
+                        else:
+                            print("ERROR: could not find an ephemeris file in {}".format(EPHEM_DIR))
+                            command = ""
                 # If we have a command then add the PA calibration correction factor
                 if command:
                     att_dB, slope_mv_per_dB, offset_dBm = GetPACalibration.get_cal(freq_Hz)
@@ -181,6 +246,8 @@ if __name__ == "__main__":
                 print("ERROR: app_name '{}' not recognised".format("app_name"))
         except Exception as e:
             print(e)
+            # Never run a partly built command
+            command = ""
     else:
         print("ERROR: no filename provided")
 
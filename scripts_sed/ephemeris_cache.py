@@ -0,0 +1,191 @@
+import datetime
+import grp
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import generate_ephemerides
+
+# Directory holding the generated nav files. It is shared by
+# ephemeris_daemon, run as root by sed_handler, and app_launcher, run as
+# blackstar, so it belongs to CACHE_GROUP, which both are in, and is setgid
+# so that the files in it do too, and the files are group writable so that
+# either can replace them and mark them used
+CACHE_DIR = "/tmp/ephem-cache"
+CACHE_GROUP = "sed"
+CACHE_DIR_MODE = 0o2775
+
+# Eviction limits. Files not used for CACHE_MAX_AGE_S are removed, then the
+# least recently used files until the cache is no larger than CACHE_MAX_BYTES
+# (a generated file is ~6 MB)
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+CACHE_MAX_AGE_S = 7 * 24 * 60 * 60
+
+# Files being written are given this prefix and removed if left behind for
+# longer than STALE_TEMP_AGE_S, e.g. by a launch that was killed
+TEMP_PREFIX = ".tmp-"
+STALE_TEMP_AGE_S = 10 * 60
+
+# Change to invalidate every cached file when the generated content changes
+CACHE_VERSION = "1"
+
+CACHE_SUFFIX = ".nav"
+# Receiver positions are rounded to this many metres in the key, so nearby
+# positions with the same visible satellites share a file
+RECEIVER_KEY_RESOLUTION_M = 1000.0
+CACHE_FILE_MODE = 0o664
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def cacheKey(dir, ephemDateTime, hashContents=False, blocks=None, receivers=None,
+             elevationMask=generate_ephemerides.ELEVATION_MASK_DEG):
+    """ return a digest of the nav files in dir, ephemDateTime, the number
+    of blocks generated and the receiver positions and elevation mask used
+    to select visible satellites. The nav files are identified by name, size
+    and modification time, or by name and contents if hashContents is True
+    (for when the clock cannot be trusted)"""
+    if blocks is None:
+        blocks = generate_ephemerides.blockCount()
+    digest = hashlib.sha256()
+    digest.update(CACHE_VERSION.encode())
+    digest.update("{}\0{}".format(ephemDateTime.isoformat(), blocks).encode())
+    if receivers is not None:
+        digest.update("\0{}\0".format(elevationMask).encode())
+        rounded = np.round(np.asarray(receivers, dtype=np.float64).reshape(-1, 3) / RECEIVER_KEY_RESOLUTION_M)
+        digest.update(rounded.astype(np.int64).tobytes())
+    for entry in sorted(os.scandir(dir), key=lambda entry: entry.name):
+        if not generate_ephemerides.isNavFile(entry.name):
+            continue
+        try:
+            if hashContents:
+                with open(entry.path, "rb") as navFile:
+                    digest.update("\0{}\0".format(entry.name).encode())
+                    for block in iter(lambda: navFile.read(HASH_BLOCK_SIZE), b""):
+                        digest.update(block)
+            else:
+                stat = entry.stat()
+                digest.update("\0{}\0{}\0{}".format(entry.name, stat.st_size, stat.st_mtime_ns).encode())
+        except FileNotFoundError:
+            # Merged into the store and removed by a concurrent compaction
+            continue
+    return digest.hexdigest()
+
+
+def makeCacheDir(cacheDir=CACHE_DIR, group=CACHE_GROUP):
+    """ create cacheDir if it does not exist and, if this process owns it,
+    give it to group with CACHE_DIR_MODE. Without the group, e.g. off
+    target, the cache is only shared by processes of the same user"""
+    os.makedirs(cacheDir, exist_ok=True)
+    try:
+        gid = grp.getgrnam(group).gr_gid
+        stat = os.stat(cacheDir)
+        if stat.st_uid != os.geteuid():
+            return
+        if stat.st_gid != gid:
+            os.chown(cacheDir, -1, gid)
+            # Changing the group can clear the setgid bit
+            os.chmod(cacheDir, CACHE_DIR_MODE)
+        elif stat.st_mode & 0o7777 != CACHE_DIR_MODE:
+            os.chmod(cacheDir, CACHE_DIR_MODE)
+    except (KeyError, OSError):
+        pass
+
+
+def removeFile(path):
+    """ remove path, return 1 if it was removed, 0 if it no longer exists"""
+    try:
+        os.remove(path)
+        return 1
+    except FileNotFoundError:
+        return 0
+
+
+def evict(cacheDir=CACHE_DIR, maxBytes=CACHE_MAX_BYTES, maxAge=CACHE_MAX_AGE_S, keep=None):
+    """ remove cached files not used for maxAge seconds, then the least
+    recently used files until the cache is no larger than maxBytes. The
+    file keep is never removed. Return the number of files removed"""
+    now = time.time()
+    entries = []
+    totalBytes = 0
+    removed = 0
+    for entry in os.scandir(cacheDir):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            # Removed by a concurrent launch
+            continue
+        if entry.name.startswith(TEMP_PREFIX):
+            # Only remove partial files that are no longer being written
+            if now - stat.st_mtime > STALE_TEMP_AGE_S:
+                removed += removeFile(entry.path)
+        elif entry.name.endswith(CACHE_SUFFIX):
+            totalBytes += stat.st_size
+            if entry.path != keep:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    # Least recently used first
+    entries.sort()
+    for mtime, size, path in entries:
+        if now - mtime <= maxAge and totalBytes <= maxBytes:
+            break
+        removed += removeFile(path)
+        totalBytes -= size
+    return removed
+
+
+def getEphemerisFile(dir, ephemDateTime, cacheDir=CACHE_DIR, maxBytes=CACHE_MAX_BYTES,
+                     maxAge=CACHE_MAX_AGE_S, hashContents=False, duration=None, receivers=None,
+                     elevationMask=generate_ephemerides.ELEVATION_MASK_DEG):
+    """ return the path of the nav file generated by generateEphemerides
+    for the nav files in dir, ephemDateTime, duration and receivers, only
+    generating it if the same inputs have not already been generated.
+    Durations needing the same number of blocks share a file. A file for
+    receivers is made by filtering the file for all satellites, so only
+    that file, e.g. pre-generated by ephemeris_daemon, needs to be
+    generated from the nav files in dir. Files are
+    written under a temporary name and renamed into place, so a concurrent
+    launch never sees a partly written file"""
+    makeCacheDir(cacheDir)
+    blocks = generate_ephemerides.blockCount(duration)
+    key = cacheKey(dir, ephemDateTime, hashContents, blocks, receivers, elevationMask)
+    path = os.path.join(cacheDir, key + CACHE_SUFFIX)
+
+    try:
+        # Cache hit, mark the file as recently used
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+    except OSError:
+        # Not allowed to mark it, e.g. written by another user, the hit is
+        # still good if the file can be read
+        if os.access(path, os.R_OK):
+            return path
+
+    # mkstemp creates the file readable by the owner only, make it readable
+    # by all as the files generated directly in /tmp were, and writable by
+    # CACHE_GROUP
+    fd, tempPath = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=CACHE_SUFFIX, dir=cacheDir)
+    os.fchmod(fd, CACHE_FILE_MODE)
+    os.close(fd)
+    try:
+        if receivers is None:
+            generate_ephemerides.generateEphemerides(dir, ephemDateTime, tempPath, duration)
+        else:
+            source = getEphemerisFile(dir, ephemDateTime, cacheDir, maxBytes, maxAge, hashContents, duration)
+            generate_ephemerides.filterEphemerides(source, tempPath, receivers, elevationMask)
+        os.replace(tempPath, path)
+    except BaseException:
+        removeFile(tempPath)
+        raise
+
+    evict(cacheDir, maxBytes, maxAge, keep=path)
+    return path
+
+
+if __name__ == "__main__":
+    now = datetime.datetime.now()
+    print(getEphemerisFile("tests", datetime.datetime(now.year, now.month, now.day, now.hour - now.hour % 2)))
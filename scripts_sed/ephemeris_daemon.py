@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import logging
+import time
+
+import ephemeris_cache
+import ephemeris_store
+import generate_ephemerides
+from gnss_spoof_config import EPHEM_DIR, GPS_SIM_STATIC_DURATION_MAX
+import orbit
+
+# Number of blocks, starting with the current one, kept generated
+PREGENERATE_BLOCKS = 3
+
+# Interval between checks of EPHEM_DIR for new nav files
+POLL_INTERVAL_S = 10
+
+# Interval between retries after generation fails, e.g. while EPHEM_DIR is
+# empty or a nav file is partly written
+RETRY_INTERVAL_S = 60
+
+# Nav files written by ubx-ephemerides are merged into the ephemeris store
+# once there are more than this many, so EPHEM_DIR stays small
+COMPACT_FILE_COUNT = 8
+
+# Windows generated for each block, app_launcher asks for a static run
+# lasting GPS_SIM_STATIC_DURATION_MAX from anywhere within the block and
+# this always needs the same number of blocks
+PREGENERATE_DURATIONS = [datetime.timedelta(seconds=GPS_SIM_STATIC_DURATION_MAX)]
+
+
+def blockStart(now):
+    """ return the start of the block containing now"""
+    return datetime.datetime(now.year, now.month, now.day, now.hour - now.hour % generate_ephemerides.BLOCK_HOURS)
+
+
+def utcNow():
+    """ return the current UTC time as a naive datetime, as app_launcher
+    uses for the spoof time"""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def pregenerate(dir=EPHEM_DIR, now=None, blocks=PREGENERATE_BLOCKS, durations=PREGENERATE_DURATIONS,
+                cacheDir=ephemeris_cache.CACHE_DIR, locations=(None,)):
+    """ make sure the ephemeris cache holds files for blocks blocks from
+    the one containing now, for each duration and location. A location is
+    a (latitude, longitude, height) tuple, as app_launcher is given for a
+    static run, or None for all satellites. app_launcher filters the file
+    for all satellites for any other location, so locations other than
+    None only save that filtering. Only files missing from the
+    cache, because the block is new or the nav files have changed, are
+    generated. Return the number of files checked"""
+    if now is None:
+        now = utcNow()
+    first = blockStart(now)
+    count = 0
+    for block in range(blocks):
+        ephemDateTime = first + block * generate_ephemerides.BLOCK_DURATION
+        for duration in durations:
+            for location in locations:
+                receivers = None if location is None else orbit.geodeticToEcef(*location)
+                ephemeris_cache.getEphemerisFile(dir, ephemDateTime, cacheDir, duration=duration,
+                                                 receivers=receivers)
+                count += 1
+    return count
+
+
+def run(dir=EPHEM_DIR, blocks=PREGENERATE_BLOCKS, durations=PREGENERATE_DURATIONS,
+        cacheDir=ephemeris_cache.CACHE_DIR, pollInterval=POLL_INTERVAL_S, locations=(None,)):
+    """ keep the ephemeris cache up to date, checking every pollInterval
+    seconds and at the start of every block, forever"""
+    lastKeys = None
+    while True:
+        try:
+            if len(ephemeris_store.settledNavFiles(dir)) > COMPACT_FILE_COUNT:
+                logging.info("Compacted EPHEM_DIR: %s", ephemeris_store.compact(dir))
+        except Exception as e:
+            logging.error("Ephemeris compaction failed: %s", e)
+
+        now = utcNow()
+        delay = pollInterval
+        try:
+            # Checking the keys of the nav files is cheap, only call
+            # pregenerate when they or the block have changed
+            keys = (blockStart(now), ephemeris_cache.cacheKey(dir, blockStart(now)))
+            if keys != lastKeys:
+                start = time.perf_counter()
+                pregenerate(dir, now, blocks, durations, cacheDir, locations)
+                lastKeys = keys
+                logging.info("Ephemerides ready from %s in %.3f s", keys[0], time.perf_counter() - start)
+        except Exception as e:
+            # e.g. EPHEM_DIR missing or a nav file partly written
+            logging.error("Ephemeris generation failed: %s", e)
+            delay = RETRY_INTERVAL_S
+
+        # Wake up at the start of the next block if that is sooner
+        nextBlock = blockStart(now) + generate_ephemerides.BLOCK_DURATION
+        time.sleep(max(0.0, min(delay, (nextBlock - utcNow()).total_seconds())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate ephemeris files for gnss_spoof")
+    parser.add_argument("-d", "--dir", default=EPHEM_DIR, help="directory holding the nav files")
+    parser.add_argument("-b", "--blocks", type=int, default=PREGENERATE_BLOCKS,
+                        help="number of blocks to keep generated")
+    parser.add_argument("-l", "--location", action="append", default=[],
+                        help="also generate files of the satellites visible from latitude,longitude,height, "
+                             "may be repeated")
+    parser.add_argument("-o", "--once", action="store_true", help="generate once and exit")
+    args = parser.parse_args()
+
+    locations = [None]
+    for location in args.location:
+        try:
+            locations.append(tuple(float(value) for value in location.split(",")))
+        except ValueError:
+            parser.error("invalid location '{}'".format(location))
+        if len(locations[-1]) != 3:
+            parser.error("invalid location '{}'".format(location))
+
+    logging.basicConfig(format="%(asctime)s: %(message)s", level=logging.INFO, datefmt="%H:%M:%S")
+    if args.once:
+        pregenerate(args.dir, blocks=args.blocks, locations=locations)
+    else:
+        run(args.dir, args.blocks, locations=locations)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import fcntl
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from ephemeris_table import EphemerisTable
+from gnss_spoof_config import EPHEM_DIR
+from nav_file_cache import isNavFile, loadNavFile, removeOrphans
+from rinex_python import RinexPython
+
+# The nav files in EPHEM_DIR are merged into this file, which is itself a
+# nav file so that generate_ephemerides reads it with any newer files
+STORE_FILE = "ephemeris-store.nav"
+
+# Ephemerides with an epoch more than STORE_MAX_AGE before the newest one
+# in the store are evicted. The age is measured from the newest ephemeris
+# rather than the clock, which may not be set when the unit starts
+STORE_MAX_AGE = datetime.timedelta(days=7)
+
+# Nav files still open in any process, e.g. ubx-ephemerides which may
+# append to a file long after it was last modified, or modified in the last
+# SETTLE_TIME_S seconds are left for the next compaction. Open files are
+# found from the fd links in PROC_DIR
+SETTLE_TIME_S = 60
+PROC_DIR = "/proc"
+
+# Held while compacting so that only one compaction runs at a time, the
+# names do not match isNavFile()
+LOCK_FILE = ".ephemeris-store.lock"
+TEMP_PREFIX = ".tmp-"
+TEMP_SUFFIX = ".tmp"
+STORE_FILE_MODE = 0o644
+
+
+def openFiles(dir):
+    """ return the names of the files in dir held open by any process, or
+    None if the open files of some process cannot be read, e.g. when not
+    run as root"""
+    dir = os.path.realpath(dir)
+    names = set()
+    for pid in os.listdir(PROC_DIR):
+        if not pid.isdigit():
+            continue
+        fdDir = os.path.join(PROC_DIR, pid, "fd")
+        try:
+            fds = os.listdir(fdDir)
+        except FileNotFoundError:
+            # The process has exited
+            continue
+        except PermissionError:
+            return None
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fdDir, fd))
+            except OSError:
+                continue
+            if os.path.dirname(target) == dir:
+                names.add(os.path.basename(target))
+    return names
+
+
+def settledNavFiles(dir, settleTime=SETTLE_TIME_S):
+    """ return the names of the nav files in dir, other than the store,
+    that no process has open and have not been modified for settleTime
+    seconds. None are returned if the open files cannot be found, as a
+    file still being written must never be merged and removed"""
+    held = openFiles(dir)
+    if held is None:
+        logging.warning("Cannot find the files open in %s, nav files are not compacted", dir)
+        return []
+    now = time.time()
+    names = []
+    for entry in os.scandir(dir):
+        if not isNavFile(entry.name) or entry.name == STORE_FILE or entry.name in held:
+            continue
+        try:
+            if now - entry.stat().st_mtime >= settleTime:
+                names.append(entry.name)
+        except FileNotFoundError:
+            pass
+    return names
+
+
+def mergeEphemerides(navFiles, maxAge=STORE_MAX_AGE):
+    """ merge (file name, header, EphemerisTable) tuples, oldest first, into
+    a header and an EphemerisTable holding the newest record for each PRN
+    and epoch, evicting those more than maxAge before the newest epoch.
+    Return the header, table and number of records evicted"""
+    header = {}
+    for filename, fileHeader, table in navFiles:
+        header.update(fileHeader)
+    merged = EphemerisTable.concatenate([table for filename, fileHeader, table in navFiles]).lastPerEpoch()
+
+    evicted = 0
+    if maxAge is not None and len(merged):
+        epochs = merged.getEphemerisDateTimes()
+        keep = epochs >= epochs.max() - np.timedelta64(int(maxAge.total_seconds()), 's')
+        evicted = len(merged) - int(np.count_nonzero(keep))
+        merged = merged[keep]
+    return header, merged, evicted
+
+
+def writeStore(path, header, table):
+    """ write the store to path, under a temporary name renamed into place
+    so that a reader never sees it partly written"""
+    output = RinexPython()
+    output.contents['Header'] = header
+    output.contents['Ephemerides'] = table
+    fd, tempPath = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=TEMP_SUFFIX, dir=os.path.dirname(path))
+    os.fchmod(fd, STORE_FILE_MODE)
+    os.close(fd)
+    try:
+        output.writeToFile(tempPath)
+        os.replace(tempPath, path)
+    except BaseException:
+        os.remove(tempPath)
+        raise
+
+
+def compact(dir=EPHEM_DIR, maxAge=STORE_MAX_AGE, settleTime=SETTLE_TIME_S):
+    """ merge the settled nav files in dir into the store, keeping the
+    newest record for each PRN and epoch and evicting those older than
+    maxAge, then remove the merged files. The store is replaced before any
+    file is removed, so a concurrent reader sees every ephemeris, and a
+    file is only removed if it is not open and has not changed since it
+    was read, so a writer never writes to a removed file. Return
+    the number of files merged and records kept and evicted, or None if
+    another compaction is running"""
+    with open(os.path.join(dir, LOCK_FILE), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        # Read the store then the settled files, oldest first so that the
+        # newest copy of a record is kept
+        storePath = os.path.join(dir, STORE_FILE)
+        navFiles = []
+        stored = None
+        if os.path.exists(storePath):
+            navFiles.append((STORE_FILE,) + loadNavFile(storePath))
+            stored = len(navFiles[0][2])
+        sources = []
+        for name in settledNavFiles(dir, settleTime):
+            try:
+                sources.append((os.stat(os.path.join(dir, name)), name))
+            except FileNotFoundError:
+                pass
+        sources.sort(key=lambda source: source[0].st_mtime_ns)
+        for navStat, name in sources:
+            navFiles.append((name,) + loadNavFile(os.path.join(dir, name)))
+
+        header, merged, evicted = mergeEphemerides(navFiles, maxAge)
+        if not sources and (stored is None or evicted == 0):
+            # Nothing new to merge or evict, leave the store untouched so
+            # that cached files generated from it stay valid
+            return 0, len(merged), 0
+
+        writeStore(storePath, header, merged)
+        # Write the sidecar now rather than in the next generation
+        loadNavFile(storePath)
+
+        # Check again that the merged files are not open, in case a writer
+        # has reopened one since they were read
+        held = openFiles(dir)
+        for navStat, name in sources:
+            path = os.path.join(dir, name)
+            if held is None or name in held:
+                continue
+            try:
+                current = os.stat(path)
+                if current.st_size == navStat.st_size and current.st_mtime_ns == navStat.st_mtime_ns:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+        removeOrphans(dir)
+        return len(sources), len(merged), evicted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the nav files in EPHEM_DIR into a single store")
+    parser.add_argument("-d", "--dir", default=EPHEM_DIR, help="directory holding the nav files")
+    parser.add_argument("-a", "--max-age", type=float, default=STORE_MAX_AGE.total_seconds() / 86400,
+                        help="days of ephemerides kept before the newest")
+    parser.add_argument("-s", "--settle", type=float, default=SETTLE_TIME_S,
+                        help="seconds since a nav file was last modified before it is merged, open files are "
+                             "never merged")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s: %(message)s", level=logging.INFO, datefmt="%H:%M:%S")
+    result = compact(args.dir, datetime.timedelta(days=args.max_age), args.settle)
+    if result is None:
+        logging.info("Compaction already running")
+    else:
+        logging.info("Merged %d files, %d ephemerides kept, %d evicted", *result)
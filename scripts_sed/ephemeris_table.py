@@ -0,0 +1,303 @@
+import itertools
+import logging
+import math
+
+import numpy as np
+
+from rinex_python import RinexPython, GPS_EPOCH, KEPLER_MAX_ITERATIONS, KEPLER_TOLERANCE, \
+    SECONDS_IN_WEEK, WGS384_EARTH_GRAV_CONSTANT, WGS384_EARTH_ROTATIONAL_RATE
+
+# Record layout of an ephemeris, one column per RINEX field in file order.
+# The integer epoch fields are stored as single bytes, everything else as
+# float64, giving a fixed 238 byte record
+EPHEMERIS_DTYPE = np.dtype([
+    ('PRN',             np.uint8),
+    ('TocYear',         np.uint8),
+    ('TocMonth',        np.uint8),
+    ('TocDay',          np.uint8),
+    ('TocHr',           np.uint8),
+    ('TocMin',          np.uint8),
+    ('TocSec',          np.float64),
+    ('ClockBias',       np.float64),
+    ('ClockDrift',      np.float64),
+    ('ClockDriftRate',  np.float64),
+    ('IODE',            np.float64),
+    ('Crs',             np.float64),
+    ('DeltaN',          np.float64),
+    ('M0',              np.float64),
+    ('Cuc',             np.float64),
+    ('e',               np.float64),
+    ('Cus',             np.float64),
+    ('SqrtA',           np.float64),
+    ('Toe',             np.float64),
+    ('Cic',             np.float64),
+    ('OMEGA_uc',        np.float64),
+    ('Cis',             np.float64),
+    ('i0',              np.float64),
+    ('Crc',             np.float64),
+    ('omega_lc',        np.float64),
+    ('OMEGA_DOT',       np.float64),
+    ('IDOT',            np.float64),
+    ('L2_Codes',        np.float64),
+    ('GpsWeek',         np.float64),
+    ('L2_P',            np.float64),
+    ('SV_Accuracy',     np.float64),
+    ('SV_Health',       np.float64),
+    ('TGD',             np.float64),
+    ('IODC',            np.float64),
+    ('TxTime',          np.float64),
+], align=False)
+
+EPHEMERIS_FIELDS = EPHEMERIS_DTYPE.names
+
+# Number of ephemerides converted at a time when streaming a file
+CHUNK_LENGTH = 256
+
+MICROSECONDS_IN_DAY = 24 * 60 * 60 * 1000000
+
+
+# Vectorised equivalent of RinexPython._unwrapAngle, steps each element by
+# 2*pi at a time so the results are identical to the scalar method
+def unwrapAngles(angles):
+    angles = np.array(angles, dtype=np.float64)
+    while True:
+        wrap = np.abs(angles) > math.pi
+        if not wrap.any():
+            return angles
+        angles[wrap] -= np.copysign(1, angles[wrap]) * 2 * math.pi
+
+
+# Solve Kepler's equation Mk = Ek - e.sin(Ek) for the eccentric anomaly by
+# Newton's method, as RinexPython.changeEphemerisTime does, for arrays of
+# mean anomaly and eccentricity. Elements stop being updated once converged
+def solveKepler(mk, e):
+    mk, e = np.broadcast_arrays(np.asarray(mk, dtype=np.float64), np.asarray(e, dtype=np.float64))
+    Ek = mk.copy()
+    active = np.ones(Ek.shape, dtype=bool)
+    for _ in range(KEPLER_MAX_ITERATIONS):
+        EkOld = Ek[active]
+        EkNew = EkOld + (mk[active] - EkOld + e[active] * np.sin(EkOld)) / (1.0 - e[active] * np.cos(EkOld))
+        Ek[active] = EkNew
+        active[active] = np.abs(EkNew - EkOld) > KEPLER_TOLERANCE
+        if not active.any():
+            break
+    return Ek
+
+
+# Class holding a set of ephemerides as a NumPy structured array, as a
+# compact alternative to RinexPython's list of dicts. Selection methods
+# return new tables and leave this one unchanged
+class EphemerisTable:
+
+    # Constructor, records is an array of EPHEMERIS_DTYPE, None for an
+    # empty table
+    def __init__(self, records=None):
+        if records is None:
+            records = np.empty(0, dtype=EPHEMERIS_DTYPE)
+        elif records.dtype != EPHEMERIS_DTYPE:
+            raise TypeError("records must have dtype EPHEMERIS_DTYPE")
+        self.records = records
+
+    # Construct a table from a list of ephemeris dicts as used by RinexPython
+    @classmethod
+    def fromEphemerides(cls, ephemerides):
+        records = np.empty(len(ephemerides), dtype=EPHEMERIS_DTYPE)
+        for name in EPHEMERIS_FIELDS:
+            records[name] = [ephemeris[name] for ephemeris in ephemerides]
+        return cls(records)
+
+    # Construct a table holding the ephemerides of several tables in order
+    @classmethod
+    def concatenate(cls, tables):
+        if not tables:
+            return cls()
+        return cls(np.concatenate([table.records for table in tables]))
+
+    # Construct a table from the ephemerides held by a RinexPython object
+    @classmethod
+    def fromRinex(cls, rinex):
+        return cls.fromEphemerides(rinex.getEphemerides())
+
+    # Construct a table by streaming a RINEX file, converting CHUNK_LENGTH
+    # ephemerides at a time so that the whole file is never held as dicts.
+    # The header is parsed into rinex if one is given
+    @classmethod
+    def fromFile(cls, fileName, rinex=None):
+        logging.debug("fromFile called")
+        if rinex is None:
+            rinex = RinexPython()
+        ephemerides = rinex.iterEphemerides(fileName)
+        chunks = []
+        while True:
+            chunk = list(itertools.islice(ephemerides, CHUNK_LENGTH))
+            if not chunk:
+                break
+            chunks.append(cls.fromEphemerides(chunk).records)
+        if not chunks:
+            return cls()
+        return cls(np.concatenate(chunks))
+
+    # Convert to a list of ephemeris dicts with Python int/float values, as
+    # returned by RinexPython.getEphemerides()
+    def toEphemerides(self):
+        return [dict(zip(EPHEMERIS_FIELDS, row)) for row in self.records.tolist()]
+
+    # Create a RinexPython object holding these ephemerides, ready to be
+    # written out, with a copy of the given header
+    def toRinex(self, header):
+        rinex = RinexPython()
+        rinex.contents['Header'] = dict(header)
+        rinex.contents['Ephemerides'] = self.toEphemerides()
+        return rinex
+
+    # Iterate over the ephemerides as tuples of Python values in file
+    # order, converting chunkLength records at a time
+    def iterRows(self, chunkLength=CHUNK_LENGTH):
+        for start in range(0, len(self.records), chunkLength):
+            yield from self.records[start:start + chunkLength].tolist()
+
+    def __len__(self):
+        return len(self.records)
+
+    # A field name returns that column, anything else (index array, boolean
+    # mask or slice) returns a new table
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.records[key]
+        return EphemerisTable(np.atleast_1d(self.records[key]))
+
+    def __iter__(self):
+        return iter(self.toEphemerides())
+
+    def __eq__(self, other):
+        if isinstance(other, EphemerisTable):
+            return np.array_equal(self.records, other.records)
+        else:
+            return False
+
+    # Vectorised equivalent of RinexPython._sortFunction, evaluated in the
+    # same order so the keys are identical
+    def sortKeys(self):
+        r = self.records
+        return r['PRN'].astype(np.int64) + \
+            r['TocSec']                         * 33 + \
+            r['TocMin'].astype(np.int64)        * 33 * 60 + \
+            r['TocHr'].astype(np.int64)         * 33 * 60 * 60 + \
+            r['TocDay'].astype(np.int64)        * 33 * 60 * 60 * 24 + \
+            r['TocMonth'].astype(np.int64)      * 33 * 60 * 60 * 24 * 31 + \
+            r['TocYear'].astype(np.int64)       * 33 * 60 * 60 * 24 * 31 * 12
+
+    # Return a table sorted into the order used when writing a RINEX file,
+    # the sort is stable as list.sort() is
+    def sort(self):
+        return EphemerisTable(self.records[np.argsort(self.sortKeys(), kind='stable')])
+
+    # Vectorised equivalent of RinexPython.getEphemerisDateTime, returning
+    # the epochs as an array of numpy.datetime64 in seconds
+    def getEphemerisDateTimes(self):
+        r = self.records
+        year = r['TocYear'].astype(np.int64)
+        year += np.where(year >= 80, 1900, 2000)
+        months = (year - 1970) * 12 + r['TocMonth'] - 1
+        days = months.astype('datetime64[M]').astype('datetime64[D]') + (r['TocDay'].astype(np.int64) - 1)
+        seconds = r['TocHr'].astype(np.int64) * 3600 + r['TocMin'].astype(np.int64) * 60 + \
+            r['TocSec'].astype(np.int64)
+        return days.astype('datetime64[s]') + seconds
+
+    # Return the epochs as integer seconds since the GPS epoch, an index key
+    # that orders ephemerides in time
+    def getGpsEpochs(self):
+        return (self.getEphemerisDateTimes() - np.datetime64(GPS_EPOCH, 's')).astype(np.int64)
+
+    # Return a table holding the newest ephemeris of each PRN, ordered by
+    # PRN. Where a PRN has more than one ephemeris at its newest epoch the
+    # first in the table is used
+    def newestPerPrn(self):
+        r = self.records
+        # Sort by PRN, then newest first, then position in the table, the
+        # first ephemeris of each PRN is then the one to keep
+        order = np.lexsort((np.arange(len(r)), -self.getGpsEpochs(), r['PRN']))
+        prns = r['PRN'][order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = prns[1:] != prns[:-1]
+        return EphemerisTable(r[order[first]])
+
+    # Return a table holding one ephemeris for each PRN and epoch, in the
+    # order used when writing a RINEX file. Where there are several the last
+    # in the table is kept, so tables concatenated oldest first keep the
+    # most recently received
+    def lastPerEpoch(self):
+        keys = self.sortKeys()[::-1]
+        _, index = np.unique(keys, return_index=True)
+        return EphemerisTable(self.records[::-1][index])
+
+    # Return a table of the ephemerides for the given PRN or PRNs
+    def selectPrn(self, prns):
+        return EphemerisTable(self.records[np.isin(self.records['PRN'], prns)])
+
+    # Return a table of the ephemerides with an epoch in the window
+    # start <= epoch < end, either limit may be None for an open window
+    def selectTimeWindow(self, start=None, end=None):
+        epochs = self.getEphemerisDateTimes()
+        mask = np.ones(len(epochs), dtype=bool)
+        if start is not None:
+            mask &= epochs >= np.datetime64(start, 's')
+        if end is not None:
+            mask &= epochs < np.datetime64(end, 's')
+        return EphemerisTable(self.records[mask])
+
+    # Batch equivalent of RinexPython.changeEphemerisTime. Re-times every
+    # ephemeris in the table to every one of the given epochs, returning a
+    # table of len(newDateTimes) * len(self) ephemerides ordered by epoch
+    # then by position in this table
+    def changeEphemerisTimes(self, newDateTimes):
+        r = self.records
+        updated = np.repeat(r[np.newaxis, :], len(newDateTimes), axis=0)
+
+        # Update the epoch time, epoch fields are per row
+        updated['TocYear']  = np.array([d.year % 100 for d in newDateTimes])[:, np.newaxis]
+        updated['TocMonth'] = np.array([d.month for d in newDateTimes])[:, np.newaxis]
+        updated['TocDay']   = np.array([d.day for d in newDateTimes])[:, np.newaxis]
+        updated['TocHr']    = np.array([d.hour for d in newDateTimes])[:, np.newaxis]
+        updated['TocMin']   = np.array([d.minute for d in newDateTimes])[:, np.newaxis]
+        updated['TocSec']   = np.array([d.second for d in newDateTimes])[:, np.newaxis]
+
+        # Calculate the updated GPS time
+        newEpochs = np.array(newDateTimes, dtype='datetime64[us]')
+        timeSinceEpoch = (newEpochs - np.datetime64(GPS_EPOCH, 'us')).astype(np.int64)
+        gpsWeek = timeSinceEpoch // MICROSECONDS_IN_DAY // 7
+        gpsWeekSeconds = (timeSinceEpoch - gpsWeek * 7 * MICROSECONDS_IN_DAY) / 1e6
+        updated['GpsWeek'] = gpsWeek[:, np.newaxis]
+        updated['Toe'] = gpsWeekSeconds[:, np.newaxis]
+
+        # Update the IODC and IODE values
+        iodcIode = np.floor((gpsWeekSeconds / 600) % 144)[:, np.newaxis]
+        updated['IODE'] = iodcIode
+        updated['IODC'] = iodcIode
+
+        # Update the orbital paramaters, the working paramaters are per
+        # column (original ephemeris), the time difference per element.
+        # The mean motion is only needed once per original ephemeris and
+        # is calculated with math.pow, numpy.power can differ in the last bit
+        n = np.array([math.sqrt(WGS384_EARTH_GRAV_CONSTANT / math.pow(sqrtA * sqrtA, 3)) + deltaN
+                      for sqrtA, deltaN in zip(r['SqrtA'].tolist(), r['DeltaN'].tolist())])
+
+        originalEpochs = self.getEphemerisDateTimes().astype('datetime64[us]')
+        timeDiff = (newEpochs[:, np.newaxis] - originalEpochs[np.newaxis, :]).astype(np.int64) / 1e6
+
+        mk = unwrapAngles(r['M0'] + (timeDiff * n))
+        Ek = solveKepler(mk, r['e'])
+
+        vk = 2.0 * np.arctan(np.sqrt((1 + r['e']) / (1 - r['e'])) * np.tan(Ek / 2))
+        pk = vk + r['omega_lc']
+        deltaik = r['Cis'] * np.sin(2 * pk) + r['Cic'] * np.cos(2 * pk)
+        ik = r['i0'] + deltaik + (r['IDOT'] * timeDiff)
+
+        weekDiff = gpsWeek[:, np.newaxis] - r['GpsWeek']
+        O0 = unwrapAngles(r['OMEGA_uc'] +
+                          (r['OMEGA_DOT'] - WGS384_EARTH_ROTATIONAL_RATE) * (weekDiff * SECONDS_IN_WEEK))
+
+        updated['M0'] = mk
+        updated['i0'] = ik
+        updated['OMEGA_uc'] = O0
+        return EphemerisTable(updated.reshape(-1))
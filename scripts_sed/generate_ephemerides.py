@@ -1,13 +1,26 @@
 from rinex_python import RinexPython
-import copy
+from ephemeris_table import EphemerisTable
+from nav_file_cache import loadNavFiles
+import orbit
 import datetime
 import os
 
-# Create a RinexPython object
-inst = RinexPython()
+# Ephemerides are generated for every BLOCK_HOURS hour block, for
+# GENERATION_DAYS days unless a duration is given
+BLOCK_HOURS = 2
+BLOCK_DURATION = datetime.timedelta(hours=BLOCK_HOURS)
+GENERATION_DAYS = 24
 
-# Declare blank array of ephemerides
-ephems = []
+# Extra time covered beyond a requested duration
+WINDOW_MARGIN = datetime.timedelta(hours=4)
+
+# When receiver positions are given, only ephemerides of satellites at or
+# above ELEVATION_MASK_DEG (below the horizon, as a margin) from one of them
+# at some time from one block before to two blocks after their epoch are
+# generated. Elevations are checked every VISIBILITY_STEP_S seconds
+ELEVATION_MASK_DEG = -5.0
+VISIBILITY_WINDOW_S = (-BLOCK_HOURS * 3600, 2 * BLOCK_HOURS * 3600)
+VISIBILITY_STEP_S = 600
 
 
 def ephemIsNewer(ephem1, ephem2):
@@ -22,11 +35,6 @@ def ephemIsNewer(ephem1, ephem2):
     elif ephem1['TocMonth'] < ephem2['TocMonth']:
         return False
 
-    if ephem1['TocYear'] > ephem2['TocYear']:
-        return True
-    elif ephem1['TocYear'] < ephem2['TocYear']:
-        return False
-
     if ephem1['TocDay'] > ephem2['TocDay']:
         return True
     elif ephem1['TocDay'] < ephem2['TocDay']:
@@ -47,59 +55,85 @@ def ephemIsNewer(ephem1, ephem2):
 
     return False
 
-def generateEphemerides(dir, ephemDateTime):
-    for file in os.listdir(os.fsencode(dir)):
-        filename = os.fsdecode(file)
-        if filename.endswith("n") or filename.endswith(".nav"):
-            # Parse ephemeride file
-            inst.parseFromFile(os.path.join(dir, filename))
-
-            # Get the ephemerides
-            origEphems = inst.getEphemerides()
-
-            # Loop over all PRNs
-            for prn in range(1, 33):
-
-                # Loop over all ephemerides
-                for ephem in origEphems:
-                    # See if this ephemeris is newer than the one we currently have
-                    if ephem['PRN'] == prn:
-                        found = False
-                        for idx in range(len(ephems)):
-                            if ephems[idx]['PRN'] == prn:
-                                found = True
-                                # Is this a newer ephemeride?
-                                if ephemIsNewer(ephem, ephems[idx]):
-                                    ephems[idx] = ephem
-                        # If an ephemeride was not found then append a new one
-                        if not found:
-                            ephems.append(ephem)
-
-    # Declare blank array of new ephemerides
-    newEphems = []
-
-    # We now need to loop over days
-    for day in range(0, 24):
-        # Loop over all hours
-        for hour in range(0, 24, 2):
-            # Loop over all PRNs
-            for ephem in ephems:
-                # Generate the new ephemeris
-                #newDateTime = inst.getEphemerisDateTime(ephem) + datetime.timedelta(days=day, hours=hour)
-                newDateTime = ephemDateTime + datetime.timedelta(days=day, hours=hour)
-                newEphem = inst.changeEphemerisTime(ephem, newDateTime)
-                # Add the new ephemeris to the array
-                newEphems.append(newEphem)
-
-    # Now update the ephemerides in the instance
-    inst.contents['Ephemerides'] = newEphems
-
-    # Write the contents to a file
-    newfilename = "{}.nav".format(ephemDateTime.strftime("%Y%m%dT%H-%M-%S"))
-    fileandpath = os.path.join("/tmp", newfilename)
-    inst.writeToFile(fileandpath)
+def blockCount(duration=None, margin=WINDOW_MARGIN):
+    """ return the number of blocks needed to cover duration plus margin
+    from the start of the first block, GENERATION_DAYS of blocks if
+    duration is None"""
+    if duration is None:
+        return GENERATION_DAYS * 24 // BLOCK_HOURS
+    return (duration + margin) // BLOCK_DURATION + 1
+
+
+def loadNewestEphemerides(dir):
+    """ return the header of the nav files in dir and an EphemerisTable of
+    the newest ephemeris for each of PRNs 1-32 in them"""
+    # Load the nav files, only parsing those that have changed since they
+    # were last loaded, the header of the last file is used for the output
+    header = {}
+    tables = []
+    for filename, fileHeader, table in loadNavFiles(dir):
+        header.update(fileHeader)
+        tables.append(table)
+
+    # Select the newest ephemeris for each of PRNs 1-32
+    return header, EphemerisTable.concatenate(tables).selectPrn(range(1, 33)).newestPerPrn()
+
+
+def selectVisible(ephems, receivers, elevationMask=ELEVATION_MASK_DEG):
+    """ return the ephemerides in an EphemerisTable whose satellite is
+    visible from any of the receiver ECEF positions (shape (R, 3)) around
+    its epoch"""
+    if len(ephems) == 0:
+        return ephems
+    return ephems[orbit.visibleMask(ephems, receivers, VISIBILITY_WINDOW_S[0], VISIBILITY_WINDOW_S[1],
+                                    VISIBILITY_STEP_S, elevationMask)]
+
+
+def generateEphemerides(dir, ephemDateTime, outputFile=None, duration=None, margin=WINDOW_MARGIN,
+                        receivers=None, elevationMask=ELEVATION_MASK_DEG):
+    """ Generate a nav file from the newest ephemeris for each PRN in the
+    nav files in dir with an ephemeris for every block from ephemDateTime,
+    which should be the start of a block, covering duration (a timedelta)
+    plus margin, or GENERATION_DAYS if duration is None. If receivers, ECEF
+    positions, are given only satellites visible from them are included.
+    Write it to outputFile, by default a file in /tmp named from
+    ephemDateTime, and return the path"""
+    header, ephems = loadNewestEphemerides(dir)
+
+    # Re-time all PRNs to every block in a single batch
+    newDateTimes = [ephemDateTime + block * BLOCK_DURATION for block in range(blockCount(duration, margin))]
+    newEphems = ephems.changeEphemerisTimes(newDateTimes)
+    if receivers is not None:
+        newEphems = selectVisible(newEphems, receivers, elevationMask)
+
+    # Write the new ephemerides to a file, streaming them straight from the
+    # table with the header of the parsed files
+    output = RinexPython()
+    output.contents['Header'] = header
+    output.contents['Ephemerides'] = newEphems
+    if outputFile is None:
+        newfilename = "{}.nav".format(ephemDateTime.strftime("%Y%m%dT%H-%M-%S"))
+        fileandpath = os.path.join("/tmp", newfilename)
+    else:
+        fileandpath = outputFile
+    output.writeToFile(fileandpath)
     return os.path.abspath(fileandpath)
 
 
+def filterEphemerides(ephemFile, outputFile, receivers, elevationMask=ELEVATION_MASK_DEG):
+    """ Write the ephemerides in a file written by generateEphemerides
+    without receivers whose satellite is visible from receivers to
+    outputFile, the same file generateEphemerides writes given receivers,
+    and return the path. Only the file is read, not the nav files"""
+    inst = RinexPython()
+    ephems = EphemerisTable.fromFile(ephemFile, inst)
+
+    output = RinexPython()
+    output.contents['Header'] = inst.getHeader()
+    output.contents['Ephemerides'] = selectVisible(ephems, receivers, elevationMask)
+    output.writeToFile(outputFile)
+    return os.path.abspath(outputFile)
+
+
 if __name__ == "__main__":
     print(generateEphemerides("tests", datetime.datetime.now()))
@@ -0,0 +1,8 @@
+# Settings shared by app_launcher and the ephemeris scripts, kept apart from
+# app_launcher so that importing them does not load the launcher
+
+# Directory holding the nav files written by ubx-ephemerides
+EPHEM_DIR = "/mnt/sed/admin-data/ephem"
+
+# Duration of a static gnss_spoof run, seconds
+GPS_SIM_STATIC_DURATION_MAX = 86400
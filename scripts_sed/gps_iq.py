@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import datetime
+import functools
+import math
+import os
+
+import numpy as np
+
+import orbit
+import user_motion
+from ephemeris_table import EphemerisTable
+from rinex_python import GPS_EPOCH, SECONDS_IN_WEEK, WGS384_EARTH_ROTATIONAL_RATE
+
+SPEED_OF_LIGHT = 2.99792458e8
+GPS_L1_HZ = 1575.42e6
+
+# C/A code, G2 delays (chips) of PRNs 1-32 from IS-GPS-200 table 3-Ia
+CA_CHIP_RATE = 1.023e6
+CA_CODE_LENGTH = 1023
+CA_G2_DELAYS = (5, 6, 7, 8, 17, 18, 139, 140, 141, 251, 252, 254, 255, 256, 257, 258,
+                469, 470, 471, 472, 473, 474, 509, 512, 513, 514, 515, 516, 859, 860, 861, 862)
+
+# LNAV message, 50 bit/s in 30 bit words, 10 words to a 6 s subframe and 5
+# subframes to a 30 s frame. Words hold 24 data bits above 6 parity bits
+NAV_BIT_S = 0.02
+WORD_BITS = 30
+SUBFRAME_WORDS = 10
+SUBFRAME_S = 6
+FRAME_SUBFRAMES = 5
+FRAME_S = SUBFRAME_S * FRAME_SUBFRAMES
+FRAME_BITS = int(round(FRAME_S / NAV_BIT_S))
+CHIPS_PER_BIT = int(round(NAV_BIT_S * CA_CHIP_RATE))
+TLM_PREAMBLE = 0x8B
+DATA_MASK = 0x3FFFFFC0
+# Data bits included in each of the parity bits D25-D30, IS-GPS-200 table 20-XIV
+PARITY_MASKS = (0x3B1F3480, 0x1D8F9A40, 0x2EC7CD00, 0x1763E680, 0x2BB1F340, 0x0B7A89C0)
+# Subframes 4 and 5 are sent as pages of the dummy SV (ID 0) with data ID 1
+# and alternating ones and zeros
+DUMMY_PAGE_DATA = 0xAAAAAA
+
+# Default output, interleaved 16 bit I and Q as played by
+# tx_samples_from_file --type short
+SAMPLE_RATE_SPS = 2.6e6
+DURATION_S = 60.0
+
+# IQ is generated CHUNK_S seconds at a time. Satellite geometry is calculated
+# every GEOMETRY_STEP_S seconds and the code and carrier phases interpolated
+# linearly between
+CHUNK_S = 1.0
+GEOMETRY_STEP_S = 0.1
+LIGHT_TIME_ITERATIONS = 3
+
+# Carrier phase is looked up in a table of CARRIER_TABLE_SIZE entries
+CARRIER_TABLE_SIZE = 512
+
+# Channels, the highest satellites at or above ELEVATION_MASK_DEG, each with
+# an amplitude of CHANNEL_AMPLITUDE at REFERENCE_RANGE_M falling off with
+# range
+MAX_CHANNELS = 12
+ELEVATION_MASK_DEG = 0.0
+CHANNEL_AMPLITUDE = 2000.0
+REFERENCE_RANGE_M = 20200e3
+IQ_FULL_SCALE = 32767
+
+
+# Return the C/A codes of PRNs 1-32 as an array of shape (32, 1023) of +1
+# and -1 (chip values 0 and 1), generated once per process
+@functools.lru_cache(maxsize=None)
+def caCodeTable():
+    g1 = np.empty(CA_CODE_LENGTH, dtype=np.int8)
+    g2 = np.empty(CA_CODE_LENGTH, dtype=np.int8)
+    r1 = [1] * 10
+    r2 = [1] * 10
+    for i in range(CA_CODE_LENGTH):
+        g1[i] = r1[9]
+        g2[i] = r2[9]
+        # G1 = 1 + x^3 + x^10, G2 = 1 + x^2 + x^3 + x^6 + x^8 + x^9 + x^10
+        r1 = [r1[2] ^ r1[9]] + r1[:9]
+        r2 = [r2[1] ^ r2[2] ^ r2[5] ^ r2[7] ^ r2[8] ^ r2[9]] + r2[:9]
+    table = np.empty((len(CA_G2_DELAYS), CA_CODE_LENGTH), dtype=np.int8)
+    for prn, delay in enumerate(CA_G2_DELAYS):
+        table[prn] = 1 - 2 * (g1 ^ np.roll(g2, delay))
+    return table
+
+
+# Return the complex carrier table, exp(j 2 pi i / CARRIER_TABLE_SIZE)
+@functools.lru_cache(maxsize=None)
+def carrierTable():
+    return np.exp(2j * np.pi * np.arange(CARRIER_TABLE_SIZE) / CARRIER_TABLE_SIZE).astype(np.complex64)
+
+
+def _bitCount(value):
+    return bin(value).count("1")
+
+
+# Add the parity bits to a word of data bits, given the previous word. For
+# words 2 and 10 (solve is True) data bits 23 and 24 are chosen so that the
+# last two parity bits are zero
+def _encodeWord(data, previous, solve=False):
+    d29 = (previous >> 1) & 1
+    d30 = previous & 1
+    d = data & DATA_MASK
+    if solve:
+        if (d30 + _bitCount(PARITY_MASKS[4] & d)) % 2:
+            d ^= 1 << 6
+        if (d29 + _bitCount(PARITY_MASKS[5] & d)) % 2:
+            d ^= 1 << 7
+    word = d ^ DATA_MASK if d30 else d
+    for bit, (mask, previousBit) in enumerate(zip(PARITY_MASKS, (d29, d30, d29, d30, d30, d29))):
+        word |= ((previousBit + _bitCount(mask & d)) % 2) << (5 - bit)
+    return word
+
+
+# Return the data words (data bits only) of the five subframes for an
+# ephemeris record, scaled as IS-GPS-200 table 20-III, subframes 4 and 5
+# being dummy pages
+def _ephemerisSubframes(ephemeris, tocSeconds):
+    def scaled(name, scale, semiCircles=False):
+        value = float(ephemeris[name])
+        if semiCircles:
+            value /= math.pi
+        return int(round(value / scale))
+
+    iodc = int(ephemeris['IODC'])
+    iode = int(ephemeris['IODE'])
+    toe = int(round(float(ephemeris['Toe']) / 16))
+    toc = int(round(tocSeconds / 16))
+    codeL2 = int(ephemeris['L2_Codes'])
+    health = int(ephemeris['SV_Health'])
+    tgd = scaled('TGD', 2 ** -31)
+    af0 = scaled('ClockBias', 2 ** -31)
+    af1 = scaled('ClockDrift', 2 ** -43)
+    af2 = scaled('ClockDriftRate', 2 ** -55)
+    crs = scaled('Crs', 2 ** -5)
+    crc = scaled('Crc', 2 ** -5)
+    cuc = scaled('Cuc', 2 ** -29)
+    cus = scaled('Cus', 2 ** -29)
+    cic = scaled('Cic', 2 ** -29)
+    cis = scaled('Cis', 2 ** -29)
+    deltaN = scaled('DeltaN', 2 ** -43, True)
+    m0 = scaled('M0', 2 ** -31, True)
+    e = scaled('e', 2 ** -33)
+    sqrtA = scaled('SqrtA', 2 ** -19)
+    omega0 = scaled('OMEGA_uc', 2 ** -31, True)
+    i0 = scaled('i0', 2 ** -31, True)
+    omega = scaled('omega_lc', 2 ** -31, True)
+    omegaDot = scaled('OMEGA_DOT', 2 ** -43, True)
+    idot = scaled('IDOT', 2 ** -43, True)
+
+    # Word 3 of subframe 1 also holds the week number, added per frame
+    subframe1 = [0, 0,
+                 ((codeL2 & 0x3) << 18) | ((health & 0x3F) << 8) | (((iodc >> 8) & 0x3) << 6),
+                 0, 0, 0,
+                 (tgd & 0xFF) << 6,
+                 ((iodc & 0xFF) << 22) | ((toc & 0xFFFF) << 6),
+                 ((af2 & 0xFF) << 22) | ((af1 & 0xFFFF) << 6),
+                 (af0 & 0x3FFFFF) << 8]
+    subframe2 = [0, 0,
+                 ((iode & 0xFF) << 22) | ((crs & 0xFFFF) << 6),
+                 ((deltaN & 0xFFFF) << 14) | (((m0 >> 24) & 0xFF) << 6),
+                 (m0 & 0xFFFFFF) << 6,
+                 ((cuc & 0xFFFF) << 14) | (((e >> 24) & 0xFF) << 6),
+                 (e & 0xFFFFFF) << 6,
+                 ((cus & 0xFFFF) << 14) | (((sqrtA >> 24) & 0xFF) << 6),
+                 (sqrtA & 0xFFFFFF) << 6,
+                 (toe & 0xFFFF) << 14]
+    subframe3 = [0, 0,
+                 ((cic & 0xFFFF) << 14) | (((omega0 >> 24) & 0xFF) << 6),
+                 (omega0 & 0xFFFFFF) << 6,
+                 ((cis & 0xFFFF) << 14) | (((i0 >> 24) & 0xFF) << 6),
+                 (i0 & 0xFFFFFF) << 6,
+                 ((crc & 0xFFFF) << 14) | (((omega >> 24) & 0xFF) << 6),
+                 (omega & 0xFFFFFF) << 6,
+                 (omegaDot & 0xFFFFFF) << 6,
+                 ((iode & 0xFF) << 22) | ((idot & 0x3FFF) << 8)]
+    dummy = [0, 0, (1 << 28) | ((DUMMY_PAGE_DATA & 0xFFFF) << 6)] + [DUMMY_PAGE_DATA << 6] * 7
+    return [subframe1, subframe2, subframe3, dummy, list(dummy)]
+
+
+# Return the navigation bits, +1 and -1 for 0 and 1, of the frame starting
+# at frameStart (seconds since the GPS epoch, a multiple of FRAME_S) for an
+# ephemeris record
+def navigationBits(ephemeris, tocSeconds, frameStart):
+    week, seconds = divmod(int(frameStart), SECONDS_IN_WEEK)
+    subframes = _ephemerisSubframes(ephemeris, tocSeconds)
+    subframes[0][2] |= (week % 1024) << 20
+
+    words = []
+    previous = 0
+    for index, subframe in enumerate(subframes):
+        # The HOW holds the time of week count of the next subframe
+        tow = (seconds // SUBFRAME_S + index + 1) % (SECONDS_IN_WEEK // SUBFRAME_S)
+        subframe[0] = TLM_PREAMBLE << 22
+        subframe[1] = ((tow & 0x1FFFF) << 13) | ((index + 1) << 8)
+        for wordIndex, data in enumerate(subframe):
+            previous = _encodeWord(data, previous, wordIndex in (1, SUBFRAME_WORDS - 1))
+            words.append(previous)
+
+    shifts = np.arange(WORD_BITS - 1, -1, -1)
+    bits = (np.array(words, dtype=np.int64)[:, np.newaxis] >> shifts) & 1
+    return (1 - 2 * bits).astype(np.int8).ravel()
+
+
+# Return a table of the ephemeris of each PRN with Toe nearest gpsSeconds
+def selectEphemerides(table, gpsSeconds):
+    order = np.lexsort((np.abs(orbit.toeGpsSeconds(table) - gpsSeconds), table['PRN']))
+    prns = table['PRN'][order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = prns[1:] != prns[:-1]
+    return table[order[first]]
+
+
+# Calculate the delay (seconds) of the signal of each ephemeris in a table
+# received at gpsSeconds (shape (T,)) by receivers at receiverEcef (shape
+# (T, 3)): the light time, with the Earth's rotation during it, less the
+# satellite clock offset. Returns the delays and ranges (metres), each of
+# shape (len(table), T), and the satellite positions
+def signalDelays(table, gpsSeconds, receiverEcef):
+    tau = np.full((len(table), len(gpsSeconds)), 0.075)
+    for _ in range(LIGHT_TIME_ITERATIONS):
+        positions = orbit.satellitePositions(table, gpsSeconds - tau)
+        theta = WGS384_EARTH_ROTATIONAL_RATE * tau
+        x = positions[..., 0] * np.cos(theta) + positions[..., 1] * np.sin(theta)
+        y = positions[..., 1] * np.cos(theta) - positions[..., 0] * np.sin(theta)
+        positions = np.stack([x, y, positions[..., 2]], axis=-1)
+        ranges = np.linalg.norm(positions - receiverEcef, axis=-1)
+        tau = ranges / SPEED_OF_LIGHT
+    return tau - orbit.satelliteClockOffsets(table, gpsSeconds - tau), ranges, positions
+
+
+# Linearly interpolate values at the integer sample indices epochSamples
+# into out, one segment at a time, which is several times faster than
+# np.interp. samples is np.arange(len(out))
+def _interpolate(samples, epochSamples, values, out):
+    for start, end, first, last in zip(epochSamples[:-1], epochSamples[1:], values[:-1], values[1:]):
+        segment = out[start:end]
+        np.multiply(samples[:end - start], (last - first) / (end - start), out=segment)
+        segment += first
+
+
+# Return the sum of the baseband signals of channels for count samples.
+# Each channel is (prn, amplitude, epochSamples, codeChips, carrierPhases,
+# bits, firstBit): the code phase (chips since the start of frame
+# firstBit / FRAME_BITS) and carrier phase (cycles, not negative) at the
+# integer sample indices epochSamples and the navigation bits from bit
+# firstBit. Run in the worker processes
+def channelSamples(count, channels):
+    codes = caCodeTable()
+    carrier = carrierTable()
+    samples = np.arange(count, dtype=np.float64)
+    chip = np.empty(count)
+    phase = np.empty(count)
+    total = np.zeros(count, dtype=np.complex64)
+    for prn, amplitude, epochSamples, codeChips, carrierPhases, bits, firstBit in channels:
+        # The code and navigation bit modulation, as a half cycle carrier
+        # phase offset, for each chip of the chunk
+        firstChip = int(codeChips[0])
+        chips = np.arange(firstChip, int(codeChips[-1]) + 1)
+        sign = codes[prn - 1][chips % CA_CODE_LENGTH] * bits[chips // CHIPS_PER_BIT - firstBit]
+        offset = (1 - sign.astype(np.int64)) * (CARRIER_TABLE_SIZE // 4)
+
+        _interpolate(samples, epochSamples, codeChips - firstChip, chip)
+        _interpolate(samples, epochSamples, carrierPhases * CARRIER_TABLE_SIZE, phase)
+        index = phase.astype(np.int64)
+        index += offset[chip.astype(np.int64)]
+        index &= CARRIER_TABLE_SIZE - 1
+        total += (carrier * np.float32(amplitude))[index]
+    return total
+
+
+# Generate L1 C/A baseband IQ of the satellites in ephemFile, a file written
+# by generateEphemerides, seen from a static location (latitude, longitude,
+# height) or along a motion file, from startTime (a datetime, by default the
+# first ephemeris epoch) for duration seconds (by default the length of the
+# motion file or DURATION_S). Channels are generated in parallel in a pool
+# of worker processes, by default one per CPU. The IQ is written to
+# outputFile as interleaved 16 bit samples. Returns the number of samples
+def generateIq(ephemFile, outputFile, location=None, motionFile=None, startTime=None, duration=None,
+               sampleRate=SAMPLE_RATE_SPS, workers=None):
+    table = EphemerisTable.fromFile(ephemFile)
+    if len(table) == 0:
+        raise ValueError("no ephemerides in {}".format(ephemFile))
+    if startTime is None:
+        startGps = float(table.getGpsEpochs().min())
+    else:
+        startGps = (startTime - GPS_EPOCH).total_seconds()
+    table = selectEphemerides(table, startGps)
+    tocSeconds = table.getGpsEpochs() % SECONDS_IN_WEEK
+
+    # Receiver positions, interpolated from the motion file at the geometry
+    # epochs
+    if motionFile is not None:
+        motion = user_motion.readMotionFile(motionFile)
+        motionTimes = motion[:, 0] - motion[0, 0]
+        motionEcef = orbit.geodeticToEcef(motion[:, 1], motion[:, 2], motion[:, 3])
+        if duration is None:
+            duration = motionTimes[-1]
+
+        def receiverAt(times):
+            return np.stack([np.interp(times, motionTimes, motionEcef[:, axis]) for axis in range(3)], axis=-1)
+    else:
+        if location is None:
+            raise ValueError("a location or motion file is needed")
+        locationEcef = orbit.geodeticToEcef(*location)
+
+        def receiverAt(times):
+            return np.broadcast_to(locationEcef, (len(times), 3))
+    if duration is None:
+        duration = DURATION_S
+
+    # Code times are measured from the start of the frame before the first
+    # signal is transmitted
+    frameStart = math.floor((startGps - 1) / FRAME_S) * FRAME_S
+    navFrames = {}
+
+    def frameBits(row, frame):
+        key = (row, frame)
+        if key not in navFrames:
+            navFrames[key] = navigationBits(table.records[row], tocSeconds[row], frameStart + frame * FRAME_S)
+        return navFrames[key]
+
+    totalSamples = int(round(duration * sampleRate))
+    chunkSamples = int(round(CHUNK_S * sampleRate))
+    stepSamples = int(round(GEOMETRY_STEP_S * sampleRate))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        with open(outputFile, "wb") as output:
+            for first in range(0, totalSamples, chunkSamples):
+                count = min(chunkSamples, totalSamples - first)
+                epochSamples = np.append(np.arange(0, count, stepSamples), count)
+                times = (first + epochSamples) / sampleRate
+                receivers = receiverAt(times)
+                delays, ranges, positions = signalDelays(table, startGps + times, receivers)
+
+                # The highest satellites at the start of the chunk
+                _, elevation = orbit.azimuthElevation(positions[:, 0], receivers[0])
+                rows = [row for row in np.argsort(-elevation) if elevation[row] >= ELEVATION_MASK_DEG]
+                channels = []
+                for row in rows[:MAX_CHANNELS]:
+                    codeTimes = startGps - frameStart + times - delays[row]
+                    carrierPhases = -GPS_L1_HZ * delays[row]
+                    carrierPhases -= math.floor(carrierPhases.min())
+                    frames = range(int(codeTimes[0] // FRAME_S), int(codeTimes[-1] // FRAME_S) + 1)
+                    bits = np.concatenate([frameBits(row, frame) for frame in frames])
+                    amplitude = CHANNEL_AMPLITUDE * REFERENCE_RANGE_M / ranges[row, 0]
+                    channels.append((int(table['PRN'][row]), amplitude, epochSamples, codeTimes * CA_CHIP_RATE,
+                                     carrierPhases, bits, frames[0] * FRAME_BITS))
+                # Forget the frames that have been sent
+                sentFrame = int((startGps - frameStart + times[0]) // FRAME_S) - 1
+                for key in [key for key in navFrames if key[1] < sentFrame]:
+                    del navFrames[key]
+
+                # Split the channels between the workers and sum their signals
+                if executor is None:
+                    signal = channelSamples(count, channels)
+                else:
+                    groups = [channels[i::workers] for i in range(workers) if channels[i::workers]]
+                    signal = np.zeros(count, dtype=np.complex64)
+                    for partial in executor.map(channelSamples, [count] * len(groups), groups):
+                        signal += partial
+                iq = np.empty((count, 2), dtype=np.int16)
+                iq[:, 0] = np.clip(np.rint(signal.real), -IQ_FULL_SCALE, IQ_FULL_SCALE)
+                iq[:, 1] = np.clip(np.rint(signal.imag), -IQ_FULL_SCALE, IQ_FULL_SCALE)
+                iq.tofile(output)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return totalSamples
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate GPS L1 C/A baseband IQ for iq_transmit")
+    parser.add_argument("-e", "--ephemerides", required=True, help="nav file from generate_ephemerides")
+    parser.add_argument("-l", "--location", help="static location latitude,longitude,height")
+    parser.add_argument("-x", "--motion", help="motion file of time,latitude,longitude,height lines")
+    parser.add_argument("-t", "--time", help="start time yyyy/mm/dd,hh:mm:ss, by default the first ephemeris")
+    parser.add_argument("-d", "--duration", type=float, help="duration in seconds")
+    parser.add_argument("-s", "--rate", type=float, default=SAMPLE_RATE_SPS, help="sample rate")
+    parser.add_argument("-w", "--workers", type=int, help="worker processes, by default one per CPU")
+    parser.add_argument("-o", "--output", default="gps_iq.bin", help="IQ file to write")
+    args = parser.parse_args()
+    if (args.location is None) == (args.motion is None):
+        parser.error("one of --location or --motion is needed")
+
+    location = None
+    if args.location is not None:
+        location = tuple(float(value) for value in args.location.split(","))
+    startTime = None
+    if args.time is not None:
+        startTime = datetime.datetime.strptime(args.time, "%Y/%m/%d,%H:%M:%S")
+    samples = generateIq(args.ephemerides, args.output, location, args.motion, startTime, args.duration,
+                         args.rate, args.workers)
+    print("Wrote {} samples at {:g} sps to {}".format(samples, args.rate, args.output))
@@ -0,0 +1,196 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from ephemeris_table import EphemerisTable, EPHEMERIS_DTYPE
+from rinex_python import RinexPython
+
+# Sidecar files are kept in this directory alongside the nav files, the
+# name does not match isNavFile()
+CACHE_SUBDIR = ".parsed"
+CACHE_SUFFIX = ".eph"
+TEMP_PREFIX = ".tmp-"
+# Sidecar files are readable by all, nav files may be loaded by users other
+# than the one that parsed them, e.g. app_launcher after a compaction at
+# boot
+SIDECAR_FILE_MODE = 0o644
+
+# Sidecar file layout: FILE_HEADER, the RINEX header as JSON, padding to a
+# RECORD_ALIGNMENT boundary then the EPHEMERIS_DTYPE records. FILE_HEADER
+# holds the magic, file version, record size, record count, header length
+# and the size and modification time of the nav file the sidecar was made
+# from. Change FILE_VERSION if EPHEMERIS_DTYPE changes
+FILE_MAGIC = b"BSEP"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<4sHHIIqq")
+RECORD_ALIGNMENT = 8
+
+
+# Return True if filename is named as a RINEX navigation file
+def isNavFile(filename):
+    return filename.endswith("n") or filename.endswith(".nav")
+
+
+# Return the path of the sidecar file for a nav file, by default in
+# CACHE_SUBDIR of the nav file's directory
+def sidecarPath(navFile, cacheDir=None):
+    if cacheDir is None:
+        cacheDir = os.path.join(os.path.dirname(navFile), CACHE_SUBDIR)
+    return os.path.join(cacheDir, os.path.basename(navFile) + CACHE_SUFFIX)
+
+
+# Return the offset of the records in a sidecar file
+def _recordOffset(headerLength):
+    offset = FILE_HEADER.size + headerLength
+    return offset + (-offset % RECORD_ALIGNMENT)
+
+
+# Write a sidecar file for a parsed nav file. The file is written under a
+# temporary name and renamed into place so that it is never seen partly
+# written
+def writeSidecar(path, header, table, navStat):
+    headerJson = json.dumps(header).encode()
+    offset = _recordOffset(len(headerJson))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tempPath = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as sidecar:
+            os.fchmod(sidecar.fileno(), SIDECAR_FILE_MODE)
+            sidecar.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, EPHEMERIS_DTYPE.itemsize, len(table),
+                                           len(headerJson), navStat.st_size, navStat.st_mtime_ns))
+            sidecar.write(headerJson)
+            sidecar.write(bytes(offset - FILE_HEADER.size - len(headerJson)))
+            sidecar.write(np.ascontiguousarray(table.records).tobytes())
+        os.replace(tempPath, path)
+    except BaseException:
+        os.remove(tempPath)
+        raise
+
+
+# Read a sidecar file, memory mapping the records. Returns None if there is
+# no sidecar or it was not made from a nav file with the given size and
+# modification time
+def readSidecar(path, navStat):
+    # Any sidecar that cannot be read, e.g. written by another user before its
+    # mode was fixed, is a cache miss and the nav file is parsed again
+    try:
+        with open(path, "rb") as sidecar:
+            fileHeader = sidecar.read(FILE_HEADER.size)
+            if len(fileHeader) != FILE_HEADER.size:
+                return None
+            magic, version, recordSize, count, headerLength, navSize, navMtime = FILE_HEADER.unpack(fileHeader)
+            if magic != FILE_MAGIC or version != FILE_VERSION or recordSize != EPHEMERIS_DTYPE.itemsize or \
+                    navSize != navStat.st_size or navMtime != navStat.st_mtime_ns:
+                return None
+            header = json.loads(sidecar.read(headerLength))
+
+        offset = _recordOffset(headerLength)
+        if os.path.getsize(path) != offset + count * recordSize:
+            return None
+        if count == 0:
+            return header, EphemerisTable()
+        return header, EphemerisTable(np.memmap(path, dtype=EPHEMERIS_DTYPE, mode='r', offset=offset, shape=(count,)))
+    except (OSError, ValueError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logging.warning("Could not read %s: %s", path, e)
+        return None
+
+
+# Load a nav file, returning its header and an EphemerisTable. The text is
+# only parsed if the sidecar file is missing or out of date, in which case
+# a new sidecar file is written
+def loadNavFile(navFile, cacheDir=None):
+    path = sidecarPath(navFile, cacheDir)
+    navStat = os.stat(navFile)
+    cached = readSidecar(path, navStat)
+    if cached is not None:
+        return cached
+
+    logging.debug("Parsing %s", navFile)
+    rinex = RinexPython()
+    table = EphemerisTable.fromFile(navFile, rinex)
+    header = rinex.getHeader()
+    try:
+        writeSidecar(path, header, table, navStat)
+    except OSError as e:
+        # The nav files can still be used without a cache
+        logging.warning("Could not write %s: %s", path, e)
+    return header, table
+
+
+# As loadNavFile, returning None if the nav file has been removed
+def _loadNavFileIfExists(navFile, cacheDir=None):
+    try:
+        return loadNavFile(navFile, cacheDir)
+    except FileNotFoundError:
+        return None
+
+
+# Load every nav file in dir, in directory order, returning a list of
+# (file name, header, EphemerisTable) tuples. Files without an up to date
+# sidecar are parsed in parallel in a pool of worker processes, by
+# default one per CPU, when there is more than one. Nav files removed while
+# loading, e.g. by ephemeris_store compaction, are skipped. Sidecar files of
+# nav files that have been removed are deleted when the default cacheDir is
+# used
+def loadNavFiles(dir, cacheDir=None, workers=None):
+    navFiles = []
+    toParse = []
+    for file in os.listdir(os.fsencode(dir)):
+        filename = os.fsdecode(file)
+        if isNavFile(filename):
+            navFile = os.path.join(dir, filename)
+            try:
+                navStat = os.stat(navFile)
+            except FileNotFoundError:
+                # Merged into the store and removed by a concurrent compaction
+                continue
+            cached = readSidecar(sidecarPath(navFile, cacheDir), navStat)
+            if cached is None:
+                toParse.append(len(navFiles))
+                cached = (None, None)
+            navFiles.append((filename,) + cached)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(toParse))
+    paths = [os.path.join(dir, navFiles[i][0]) for i in toParse]
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            parsed = list(executor.map(_loadNavFileIfExists, paths, [cacheDir] * len(paths)))
+    else:
+        parsed = [_loadNavFileIfExists(path, cacheDir) for path in paths]
+    for i, loaded in zip(toParse, parsed):
+        navFiles[i] = None if loaded is None else (navFiles[i][0],) + loaded
+    navFiles = [navFile for navFile in navFiles if navFile is not None]
+
+    if cacheDir is None:
+        removeOrphans(dir)
+    return navFiles
+
+
+# Remove sidecar files whose nav file no longer exists, returning the
+# number removed
+def removeOrphans(dir, cacheDir=None):
+    if cacheDir is None:
+        cacheDir = os.path.join(dir, CACHE_SUBDIR)
+    try:
+        names = os.listdir(cacheDir)
+    except FileNotFoundError:
+        return 0
+
+    removed = 0
+    for name in names:
+        if name.endswith(CACHE_SUFFIX) and not os.path.exists(os.path.join(dir, name[:-len(CACHE_SUFFIX)])):
+            try:
+                os.remove(os.path.join(cacheDir, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
@@ -0,0 +1,196 @@
+import math
+
+import numpy as np
+
+from ephemeris_table import solveKepler
+from rinex_python import SECONDS_IN_WEEK, WGS384_EARTH_GRAV_CONSTANT, WGS384_EARTH_ROTATIONAL_RATE
+
+# WGS 84 ellipsoid
+WGS84_SEMI_MAJOR_AXIS = 6378137.0
+WGS84_FLATTENING = 1 / 298.257223563
+WGS84_ECCENTRICITY_SQUARED = WGS84_FLATTENING * (2 - WGS84_FLATTENING)
+WGS84_SEMI_MINOR_AXIS = WGS84_SEMI_MAJOR_AXIS * (1 - WGS84_FLATTENING)
+
+# Relativistic clock correction constant, -2 * sqrt(mu) / c^2 (seconds per
+# square root metre)
+RELATIVISTIC_F = -4.442807633e-10
+
+
+# Return the ephemeris reference times (Toe) as seconds since the GPS epoch
+def toeGpsSeconds(table):
+    return table['GpsWeek'] * SECONDS_IN_WEEK + table['Toe']
+
+
+# Calculate satellite ECEF positions (metres) from the ephemerides in a
+# table using the user algorithm of IS-GPS-200 table 20-IV. gpsSeconds are
+# the times, as seconds since the GPS epoch, of the positions and must
+# broadcast against an array of shape (len(table), 1), e.g. an array of
+# shape (T,) gives every satellite at T times. Returns an array with a
+# trailing dimension of 3 (X, Y, Z)
+def satellitePositions(table, gpsSeconds):
+    def field(name):
+        return table[name][:, np.newaxis]
+
+    # Time from ephemeris reference epoch
+    tk = np.asarray(gpsSeconds, dtype=np.float64) - toeGpsSeconds(table)[:, np.newaxis]
+
+    A = field('SqrtA') ** 2
+    n = np.sqrt(WGS384_EARTH_GRAV_CONSTANT / A ** 3) + field('DeltaN')
+    e = field('e')
+    Mk = field('M0') + n * tk
+    Ek = solveKepler(Mk, e)
+
+    # True anomaly and argument of latitude
+    vk = np.arctan2(np.sqrt(1 - e * e) * np.sin(Ek), np.cos(Ek) - e)
+    phik = vk + field('omega_lc')
+    sin2phik = np.sin(2 * phik)
+    cos2phik = np.cos(2 * phik)
+
+    # Second harmonic perturbations
+    uk = phik + field('Cus') * sin2phik + field('Cuc') * cos2phik
+    rk = A * (1 - e * np.cos(Ek)) + field('Crs') * sin2phik + field('Crc') * cos2phik
+    ik = field('i0') + field('Cis') * sin2phik + field('Cic') * cos2phik + field('IDOT') * tk
+
+    # Position in the orbital plane
+    xk = rk * np.cos(uk)
+    yk = rk * np.sin(uk)
+
+    # Corrected longitude of ascending node
+    omegak = field('OMEGA_uc') + (field('OMEGA_DOT') - WGS384_EARTH_ROTATIONAL_RATE) * tk - \
+        WGS384_EARTH_ROTATIONAL_RATE * field('Toe')
+
+    cosOmegak = np.cos(omegak)
+    sinOmegak = np.sin(omegak)
+    cosik = np.cos(ik)
+    return np.stack([xk * cosOmegak - yk * cosik * sinOmegak,
+                     xk * sinOmegak + yk * cosik * cosOmegak,
+                     yk * np.sin(ik)], axis=-1)
+
+
+# Calculate the L1 satellite clock offsets (seconds) of the ephemerides in a
+# table at gpsSeconds, broadcast as for satellitePositions: the polynomial
+# from Toc, the relativistic correction and the group delay (IS-GPS-200
+# 20.3.3.3.3)
+def satelliteClockOffsets(table, gpsSeconds):
+    def field(name):
+        return table[name][:, np.newaxis]
+
+    gpsSeconds = np.asarray(gpsSeconds, dtype=np.float64)
+    tk = gpsSeconds - toeGpsSeconds(table)[:, np.newaxis]
+    A = field('SqrtA') ** 2
+    n = np.sqrt(WGS384_EARTH_GRAV_CONSTANT / A ** 3) + field('DeltaN')
+    Ek = solveKepler(field('M0') + n * tk, field('e'))
+
+    dt = gpsSeconds - table.getGpsEpochs()[:, np.newaxis]
+    return field('ClockBias') + field('ClockDrift') * dt + field('ClockDriftRate') * dt * dt + \
+        RELATIVISTIC_F * field('e') * field('SqrtA') * np.sin(Ek) - field('TGD')
+
+
+# Convert geodetic latitude, longitude (degrees) and height above the
+# ellipsoid (metres) to ECEF (metres), the arguments may be arrays
+def geodeticToEcef(latitude, longitude, height):
+    lat = np.radians(latitude)
+    lon = np.radians(longitude)
+    N = WGS84_SEMI_MAJOR_AXIS / np.sqrt(1 - WGS84_ECCENTRICITY_SQUARED * np.sin(lat) ** 2)
+    return np.stack([(N + height) * np.cos(lat) * np.cos(lon),
+                     (N + height) * np.cos(lat) * np.sin(lon),
+                     (N * (1 - WGS84_ECCENTRICITY_SQUARED) + height) * np.sin(lat)], axis=-1)
+
+
+# Convert ECEF positions (metres, trailing dimension of 3) to geodetic
+# latitude, longitude (degrees) and height (metres) using Bowring's method,
+# accurate to well under a millimetre near the Earth's surface
+def ecefToGeodetic(ecef):
+    ecef = np.asarray(ecef, dtype=np.float64)
+    x, y, z = ecef[..., 0], ecef[..., 1], ecef[..., 2]
+    a = WGS84_SEMI_MAJOR_AXIS
+    b = WGS84_SEMI_MINOR_AXIS
+    e2 = WGS84_ECCENTRICITY_SQUARED
+    ep2 = (a * a - b * b) / (b * b)
+    p = np.hypot(x, y)
+    theta = np.arctan2(z * a, p * b)
+    lat = np.arctan2(z + ep2 * b * np.sin(theta) ** 3, p - e2 * a * np.cos(theta) ** 3)
+    N = a / np.sqrt(1 - e2 * np.sin(lat) ** 2)
+    # Height from the larger of the horizontal and vertical components to
+    # stay well conditioned at the poles
+    height = np.where(np.abs(np.cos(lat)) > 1e-6,
+                      p / np.where(np.cos(lat) == 0, 1, np.cos(lat)) - N,
+                      np.abs(z) - b)
+    return np.degrees(lat), np.degrees(np.arctan2(y, x)), height
+
+
+# Return the east, north, up unit vectors (each with a trailing dimension
+# of 3) at the given ECEF positions
+def enuBasis(receiverEcef):
+    lat, lon, _ = ecefToGeodetic(receiverEcef)
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    east = np.stack([-np.sin(lon), np.cos(lon), np.zeros_like(lon)], axis=-1)
+    north = np.stack([-np.sin(lat) * np.cos(lon), -np.sin(lat) * np.sin(lon), np.cos(lat)], axis=-1)
+    up = np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+    return east, north, up
+
+
+# Calculate the azimuth and elevation (degrees) of satellites from a
+# receiver. satelliteEcef and receiverEcef must broadcast against each
+# other, each with a trailing dimension of 3
+def azimuthElevation(satelliteEcef, receiverEcef):
+    receiverEcef = np.asarray(receiverEcef, dtype=np.float64)
+    east, north, up = enuBasis(receiverEcef)
+    los = satelliteEcef - receiverEcef
+    e = np.sum(los * east, axis=-1)
+    n = np.sum(los * north, axis=-1)
+    u = np.sum(los * up, axis=-1)
+    azimuth = np.degrees(np.arctan2(e, n)) % 360
+    elevation = np.degrees(np.arctan2(u, np.hypot(e, n)))
+    return azimuth, elevation
+
+
+# Return the azimuth and elevation (degrees) of every satellite in a table
+# from a receiver at the given times (seconds since the GPS epoch), each of
+# shape (len(table), len(gpsSeconds)), for sky plots
+def skyPlot(table, receiverEcef, gpsSeconds):
+    return azimuthElevation(satellitePositions(table, np.asarray(gpsSeconds)), receiverEcef)
+
+
+# Calculate dilution of precision from a receiver for sets of satellites.
+# satelliteEcef has shape (..., N, 3), one set of N satellites per leading
+# index, satellites below elevationMask degrees are not used. Returns a
+# dict of GDOP, PDOP, HDOP, VDOP and TDOP arrays of the leading shape, inf
+# where fewer than 4 satellites are visible
+def dilutionOfPrecision(satelliteEcef, receiverEcef, elevationMask=0.0):
+    receiverEcef = np.asarray(receiverEcef, dtype=np.float64)
+    east, north, up = enuBasis(receiverEcef)
+    los = satelliteEcef - receiverEcef
+    los = los / np.linalg.norm(los, axis=-1, keepdims=True)
+    enu = np.stack([np.sum(los * east, axis=-1), np.sum(los * north, axis=-1), np.sum(los * up, axis=-1)], axis=-1)
+    visible = np.degrees(np.arcsin(np.clip(enu[..., 2], -1, 1))) >= elevationMask
+
+    # Geometry matrix rows of satellites not visible are zeroed
+    G = np.concatenate([-enu, np.ones(enu.shape[:-1] + (1,))], axis=-1) * visible[..., np.newaxis]
+    GtG = np.swapaxes(G, -1, -2) @ G
+    enough = np.sum(visible, axis=-1) >= 4
+    GtG[~enough] = np.eye(4)
+    Q = np.linalg.inv(GtG)
+    d = np.diagonal(Q, axis1=-2, axis2=-1)
+    dops = {'GDOP': np.sqrt(np.sum(d, axis=-1)),
+            'PDOP': np.sqrt(d[..., 0] + d[..., 1] + d[..., 2]),
+            'HDOP': np.sqrt(d[..., 0] + d[..., 1]),
+            'VDOP': np.sqrt(d[..., 2]),
+            'TDOP': np.sqrt(d[..., 3])}
+    for name in dops:
+        dops[name] = np.where(enough, dops[name], math.inf)
+    return dops
+
+
+# Return a mask of the ephemerides in a table whose satellite is at or above
+# elevationMask degrees from any of the receiver positions (an array of
+# shape (R, 3)) at any time from Toe + windowStart to Toe + windowEnd
+# seconds, sampled every step seconds
+def visibleMask(table, receiverEcef, windowStart, windowEnd, step, elevationMask):
+    offsets = np.arange(windowStart, windowEnd + step, step, dtype=np.float64)
+    times = toeGpsSeconds(table)[:, np.newaxis] + offsets
+    positions = satellitePositions(table, times)
+    receiverEcef = np.asarray(receiverEcef, dtype=np.float64).reshape(-1, 3)
+    _, elevation = azimuthElevation(positions[:, :, np.newaxis, :], receiverEcef)
+    return np.max(elevation, axis=(1, 2)) >= elevationMask
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the RINEX navigation file handling in
+rinex_python.py, run on a synthetic multi-day, 32-PRN navigation file.
+"""
+# -----------------------------------------------------------------------------
+# Copyright (c) 2021, Kirintec
+#
+# -----------------------------------------------------------------------------
+import argparse
+import datetime
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from rinex_python import RinexPython
+from ephemeris_table import EphemerisTable, EPHEMERIS_FIELDS
+import nav_file_cache
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+NO_DAYS = 7
+NO_PRNS = 32
+EPOCH_INTERVAL_HOURS = 2
+SCENARIOS = ["parse", "table", "retime", "write", "sidecar"]
+
+
+def make_ephemeris(rng, prn, toc):
+    """
+    Build an ephemeris with plausible random orbital parameters
+    :param rng: random number generator :type random.Random
+    :param prn: satellite PRN :type Integer
+    :param toc: time of clock :type datetime.datetime
+    :return: ephemeris :type Dict
+    """
+    inst = RinexPython()
+    gps_week, gps_week_seconds = inst._caluculateGPSTime(toc)
+    return {'PRN': prn, 'TocYear': toc.year % 100, 'TocMonth': toc.month, 'TocDay': toc.day,
+            'TocHr': toc.hour, 'TocMin': toc.minute, 'TocSec': float(toc.second),
+            'ClockBias': rng.uniform(-1e-3, 1e-3), 'ClockDrift': rng.uniform(-1e-11, 1e-11),
+            'ClockDriftRate': 0.0,
+            'IODE': float(rng.randrange(256)), 'Crs': rng.uniform(-200, 200),
+            'DeltaN': rng.uniform(3e-9, 6e-9), 'M0': rng.uniform(-3.14, 3.14),
+            'Cuc': rng.uniform(-1e-5, 1e-5), 'e': rng.uniform(1e-3, 2e-2),
+            'Cus': rng.uniform(-1e-5, 1e-5), 'SqrtA': rng.uniform(5153.5, 5153.8),
+            'Toe': gps_week_seconds, 'Cic': rng.uniform(-1e-7, 1e-7),
+            'OMEGA_uc': rng.uniform(-3.14, 3.14), 'Cis': rng.uniform(-1e-7, 1e-7),
+            'i0': rng.uniform(0.93, 0.99), 'Crc': rng.uniform(150, 350),
+            'omega_lc': rng.uniform(-3.14, 3.14), 'OMEGA_DOT': rng.uniform(-8.5e-9, -7.5e-9),
+            'IDOT': rng.uniform(-5e-10, 5e-10), 'L2_Codes': 1.0, 'GpsWeek': float(gps_week),
+            'L2_P': 0.0, 'SV_Accuracy': 2.0, 'SV_Health': 0.0, 'TGD': rng.uniform(-1e-8, 1e-8),
+            'IODC': float(rng.randrange(1024)), 'TxTime': gps_week_seconds - 30.0}
+
+
+def write_synthetic_nav_file(filename, days=NO_DAYS, prns=NO_PRNS, seed=1):
+    """
+    Write a synthetic RINEX v2 navigation file with an ephemeris for every
+    PRN every EPOCH_INTERVAL_HOURS, using 'D' exponent designators as real
+    broadcast files do
+    :param filename: file to write :type String
+    :param days: number of days :type Integer
+    :param prns: number of PRNs :type Integer
+    :param seed: random seed :type Integer
+    :return: number of ephemerides written :type Integer
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime(2021, 3, 1)
+    inst = RinexPython()
+    inst.contents['Header']['Version'] = 2.0
+    for epoch in range(0, days * 24, EPOCH_INTERVAL_HOURS):
+        toc = start + datetime.timedelta(hours=epoch)
+        for prn in range(1, prns + 1):
+            inst.contents['Ephemerides'].append(make_ephemeris(rng, prn, toc))
+
+    lines = inst.writeToBuffer()
+    header_length = len(inst._generateHeader())
+    with open(filename, 'w') as outputFile:
+        for i, line in enumerate(lines):
+            outputFile.write((line if i < header_length else line.replace("E", "D")) + "\n")
+    return inst.getNumEphemerides()
+
+
+def measure(function):
+    """
+    Run a function measuring wall time and CPU time, then run it again
+    measuring peak traced memory (tracing slows allocation down)
+    :param function: function to run :type Callable
+    :return: (result, wall seconds, CPU seconds, peak bytes) :type Tuple
+    """
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, cpu, peak
+
+
+def report(name, count, size, elapsed, cpu, peak):
+    log.info("{}: {} ephemerides in {:.3f} s, {:.0f} ephemerides/s, {:.1f} MB/s, "
+             "{:.1f} us CPU/ephemeris, peak memory {:.1f} MB".format(
+                 name, count, elapsed, count / elapsed, size / elapsed / 1e6,
+                 cpu / count * 1e6, peak / 1e6))
+
+
+def run_parse(filename):
+    size = os.path.getsize(filename)
+
+    def parse_buffer():
+        inst = RinexPython()
+        with open(filename) as inputFile:
+            inst.parseFromBuffer(inputFile.read())
+        return inst.getEphemerides()
+
+    def iterate():
+        inst = RinexPython()
+        count = 0
+        for _ in inst.iterEphemerides(filename):
+            count += 1
+        return count
+
+    def parse_file():
+        inst = RinexPython()
+        inst.parseFromFile(filename)
+        return inst.getEphemerides()
+
+    reference, elapsed, cpu, peak = measure(parse_buffer)
+    report("parseFromBuffer", len(reference), size, elapsed, cpu, peak)
+    count, elapsed, cpu, peak = measure(iterate)
+    report("iterEphemerides", count, size, elapsed, cpu, peak)
+    parsed, elapsed, cpu, peak = measure(parse_file)
+    report("parseFromFile", len(parsed), size, elapsed, cpu, peak)
+    log.info("parseFromFile results {} parseFromBuffer".format("match" if parsed == reference else "DO NOT match"))
+
+
+def run_table(filename):
+    def parse_dicts():
+        inst = RinexPython()
+        inst.parseFromFile(filename)
+        return inst.getEphemerides()
+
+    def parse_table():
+        return EphemerisTable.fromFile(filename)
+
+    size = os.path.getsize(filename)
+    ephemerides, elapsed, cpu, dict_peak = measure(parse_dicts)
+    report("parseFromFile", len(ephemerides), size, elapsed, cpu, dict_peak)
+    table, elapsed, cpu, peak = measure(parse_table)
+    report("EphemerisTable.fromFile", len(table), size, elapsed, cpu, peak)
+    log.info("Memory per ephemeris: {:.0f} bytes as dicts, {} bytes in the table".format(
+        dict_peak / len(ephemerides), table.records.dtype.itemsize))
+    log.info("Table results {} parseFromFile".format(
+        "match" if table.toEphemerides() == ephemerides else "DO NOT match"))
+
+    inst = RinexPython()
+    start = time.perf_counter()
+    ephemerides.sort(key=inst._sortFunction)
+    dict_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    table = table.sort()
+    elapsed = time.perf_counter() - start
+    log.info("sort: {:.3f} ms dicts, {:.3f} ms table".format(dict_elapsed * 1e3, elapsed * 1e3))
+
+    prns = [1, 7, 13, 22]
+    start = time.perf_counter()
+    selected = [eph for eph in ephemerides if eph['PRN'] in prns]
+    dict_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    table_selected = table.selectPrn(prns)
+    elapsed = time.perf_counter() - start
+    log.info("PRN filter: {:.3f} ms dicts, {:.3f} ms table, {} selected".format(
+        dict_elapsed * 1e3, elapsed * 1e3, len(table_selected)))
+
+    epochs = table.getEphemerisDateTimes()
+    window_start = epochs[0].astype(datetime.datetime) + datetime.timedelta(days=1)
+    window_end = window_start + datetime.timedelta(hours=12)
+    start = time.perf_counter()
+    selected = [eph for eph in ephemerides
+                if window_start <= inst.getEphemerisDateTime(eph) < window_end]
+    dict_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    table_selected = table.selectTimeWindow(window_start, window_end)
+    elapsed = time.perf_counter() - start
+    log.info("Time window: {:.3f} ms dicts, {:.3f} ms table, {} selected, results {}".format(
+        dict_elapsed * 1e3, elapsed * 1e3, len(table_selected),
+        "match" if table_selected.toEphemerides() == selected else "DO NOT match"))
+
+
+def run_retime(filename):
+    """
+    Re-time one ephemeris per PRN to every 2 hour block over 24 days, as
+    generate_ephemerides does, with the scalar and batch methods
+    """
+    inst = RinexPython()
+    newest = {}
+    for ephemeris in inst.iterEphemerides(filename):
+        newest[ephemeris['PRN']] = ephemeris
+    ephemerides = list(newest.values())
+    start_time = inst.getEphemerisDateTime(ephemerides[-1])
+    newDateTimes = [start_time + datetime.timedelta(days=day, hours=hour)
+                    for day in range(0, 24) for hour in range(0, 24, 2)]
+
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    scalar = [inst.changeEphemerisTime(ephemeris, newDateTime)
+              for newDateTime in newDateTimes for ephemeris in ephemerides]
+    scalar_elapsed = time.perf_counter() - start
+    scalar_cpu = time.process_time() - start_cpu
+    log.info("changeEphemerisTime: {} ephemerides in {:.3f} s, {:.1f} us CPU/ephemeris".format(
+        len(scalar), scalar_elapsed, scalar_cpu / len(scalar) * 1e6))
+
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    batch = EphemerisTable.fromEphemerides(ephemerides).changeEphemerisTimes(newDateTimes)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+    log.info("changeEphemerisTimes: {} ephemerides in {:.3f} s, {:.1f} us CPU/ephemeris, {:.0f}x faster".format(
+        len(batch), elapsed, cpu / len(batch) * 1e6, scalar_elapsed / elapsed))
+
+    reference = EphemerisTable.fromEphemerides(scalar)
+    max_diff = max(np.max(np.abs(batch[name].astype(np.float64) - reference[name].astype(np.float64)))
+                   for name in EPHEMERIS_FIELDS)
+    log.info("Maximum difference from changeEphemerisTime {:.3g}".format(max_diff))
+
+
+def write_per_line(inst, filename):
+    """
+    Write a RINEX file the way writeToFile originally did, building every
+    line with the _generateEphemerisLineN methods, for comparison
+    """
+    rinexBuffer = inst._generateHeader()
+    inst.contents['Ephemerides'].sort(key=inst._sortFunction)
+    for ephemeris in inst.contents['Ephemerides']:
+        rinexBuffer.extend(inst._generateEphemeris(ephemeris))
+    with open(filename, 'w') as outputFile:
+        for line in rinexBuffer:
+            outputFile.write(line + "\n")
+
+
+def run_write(filename):
+    inst = RinexPython()
+    inst.parseFromFile(filename)
+    table_inst = RinexPython()
+    table_inst.contents['Header'] = inst.getHeader()
+    table_inst.contents['Ephemerides'] = EphemerisTable.fromRinex(inst)
+    count = inst.getNumEphemerides()
+    outputs = []
+
+    def write(name, function):
+        output = filename + "." + name
+        outputs.append(output)
+        _, elapsed, cpu, peak = measure(lambda: function(output))
+        report(name, count, os.path.getsize(output), elapsed, cpu, peak)
+
+    write("per-line", lambda output: write_per_line(inst, output))
+    write("writeToFile", inst.writeToFile)
+    write("writeToFile-table", table_inst.writeToFile)
+
+    # Skip the PGM / RUN BY / DATE line, it holds the time of writing
+    contents = []
+    for output in outputs:
+        with open(output) as outputFile:
+            lines = outputFile.readlines()
+        contents.append(lines[:1] + lines[2:])
+    log.info("Written files {}".format("match" if all(c == contents[0] for c in contents) else "DO NOT match"))
+
+
+def run_sidecar(filename):
+    with tempfile.TemporaryDirectory() as navDir:
+        navFile = os.path.join(navDir, os.path.basename(filename))
+        shutil.copy(filename, navFile)
+        size = os.path.getsize(navFile)
+
+        for name in ["cold", "warm"]:
+            start_cpu = time.process_time()
+            start = time.perf_counter()
+            header, table = nav_file_cache.loadNavFile(navFile)
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - start_cpu
+            report("loadNavFile " + name, len(table), size, elapsed, cpu, 0)
+            if name == "cold":
+                reference = table
+        log.info("Sidecar results {} parsed file".format("match" if table == reference else "DO NOT match"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenarios", nargs="*", default=SCENARIOS,
+                        help="scenarios to run from {}, default all".format(", ".join(SCENARIOS)))
+    parser.add_argument("-d", "--days", type=int, default=NO_DAYS, help="days in the synthetic nav file")
+    parser.add_argument("-f", "--file", help="nav file to use instead of a synthetic one")
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error("unknown scenario '{}'".format(scenario))
+
+    fmt = "%(asctime)s: %(message)s"
+    logging.basicConfig(format=fmt, level=logging.INFO, datefmt="%H:%M:%S")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        nav_file = args.file
+        if nav_file is None:
+            nav_file = os.path.join(tmpdir, "synthetic.21n")
+            count = write_synthetic_nav_file(nav_file, args.days)
+            log.info("Synthetic nav file: {} days, {} ephemerides, {:.1f} MB".format(
+                args.days, count, os.path.getsize(nav_file) / 1e6))
+
+        for scenario in args.scenarios:
+            if scenario == "parse":
+                run_parse(nav_file)
+            elif scenario == "table":
+                run_table(nav_file)
+            elif scenario == "retime":
+                run_retime(nav_file)
+            elif scenario == "write":
+                run_write(nav_file)
+            elif scenario == "sidecar":
+                run_sidecar(nav_file)
@@ -5,11 +5,61 @@ from datetime import datetime
 from datetime import timedelta
 import math
 import copy
+import itertools
+import operator
 
 # Define an error class that we can throw on error
 class ParseError(Exception):
     pass
 
+# Number of lines in each ephemeris record
+EPHEMERIS_LINES = 8
+
+# Minimum length (excluding the newline) of each ephemeris line, i.e. the
+# column after the last field on the line
+EPHEMERIS_LINE_LENGTHS = (79, 79, 79, 79, 79, 79, 79, 22)
+
+# Field names of the BROADCAST ORBIT lines (ephemeris lines 2-8), each line
+# is 3X followed by up to 4 D19.12 fields
+EPHEMERIS_ORBIT_FIELDS = (
+    ('IODE', 'Crs', 'DeltaN', 'M0'),
+    ('Cuc', 'e', 'Cus', 'SqrtA'),
+    ('Toe', 'Cic', 'OMEGA_uc', 'Cis'),
+    ('i0', 'Crc', 'omega_lc', 'OMEGA_DOT'),
+    ('IDOT', 'L2_Codes', 'GpsWeek', 'L2_P'),
+    ('SV_Accuracy', 'SV_Health', 'TGD', 'IODC'),
+    ('TxTime',))
+
+# Field names of an ephemeris record in file order
+EPHEMERIS_FIELDS = ('PRN', 'TocYear', 'TocMonth', 'TocDay', 'TocHr', 'TocMin', 'TocSec',
+                    'ClockBias', 'ClockDrift', 'ClockDriftRate') + \
+    tuple(itertools.chain.from_iterable(EPHEMERIS_ORBIT_FIELDS))
+
+# Format of a complete ephemeris record, taking a tuple of the fields in
+# file order. Gives the same lines as the _generateEphemerisLineN methods,
+# printf-style formatting is used as it is quicker than str.format()
+EPHEMERIS_TEMPLATE = \
+    "%2d% 3d% 3d% 3d% 3d% 3d% 5.1f%19.12E%19.12E%19.12E\n" + \
+    "   %19.12E%19.12E%19.12E%19.12E\n" * 6 + \
+    "   %19.12E" + f"{0:19.12E}" * 3 + "\n"
+
+# Number of ephemerides formatted and written at a time
+WRITE_CHUNK_EPHEMERIDES = 256
+
+# Define the value for the earth's gravitatinal constant and rotation rate
+WGS384_EARTH_GRAV_CONSTANT = 3.986005e14
+WGS384_EARTH_ROTATIONAL_RATE = 7.2921151467e-5
+
+# Define the number of seconds in a week
+SECONDS_IN_WEEK = 60*60*24*7
+
+# Define the GPS time epoch
+GPS_EPOCH = datetime(1980, 1, 6, 0, 0, 0)
+
+# Convergence limits for the iterative solution of Kepler's equation
+KEPLER_TOLERANCE = 1.0E-14
+KEPLER_MAX_ITERATIONS = 30
+
 # Class to handle the reading/writing of RINEX files
 class RinexPython:
 
@@ -80,27 +130,26 @@ class RinexPython:
     def _parseHeader(self, header):
         logging.debug("_parseHeader called")
 
-        # Work through the header and pull out only the compulsory fields
+        # Work through the header and pull out only the compulsory fields,
+        # the header labels start in column 61
         for line in header :
             # Search for version / type
-            z = re.match("^(.{9}).{11}(.{20}).*RINEX VERSION / TYPE", line)
-            if z != None :
+            if line.find("RINEX VERSION / TYPE", 40) >= 0 :
                 # Found a match, so extract the fields
-                self.contents['Header']['Version']  = float(z.group(1))
+                self.contents['Header']['Version']  = float(line[0:9])
                 # Check the version we are parsing
                 if self.contents['Header']['Version'] != 2.0 :
                     raise ParseError(f"Error only RINEX v2.0 supported. Detected RINEX v{self.contents['Header']['Version']}")
 
-                self.contents['Header']['Type']     = z.group(2)
+                self.contents['Header']['Type']     = line[20:40]
                  
 
             # Search for pgm/run by/date
-            z = re.match("^(.{20})(.{20})(.{20})PGM / RUN BY / DATE", line)
-            if z != None :
+            if line.startswith("PGM / RUN BY / DATE", 60) :
                 # Found a match, so extract the fields
-                self.contents['Header']['Program']  = z.group(1)
-                self.contents['Header']['RunBy']    = z.group(2)
-                self.contents['Header']['Date']     = z.group(3)
+                self.contents['Header']['Program']  = line[0:20]
+                self.contents['Header']['RunBy']    = line[20:40]
+                self.contents['Header']['Date']     = line[40:60]
 
         return 
     
@@ -307,7 +356,7 @@ class RinexPython:
             header.append(line)
 
             # Check whether this is the end of header line
-            if (re.search(".*END OF HEADER", line) != None):
+            if "END OF HEADER" in line:
                 logging.debug("End of header found")
                 # Drop out of the while loop
                 break
@@ -347,18 +396,74 @@ class RinexPython:
         return
 
 
+    # Method to parse an ephemeris record (8 lines) using fixed-column
+    # slicing. The lines are joined so that the 'D' exponent designators
+    # are translated once for the whole record
+    def _parseEphemerisRecord(self, lines):
+        # Check that every field is present, as the per-line parse methods do
+        for i in range(EPHEMERIS_LINES):
+            line = lines[i]
+            if len(line) - line.endswith("\n") < EPHEMERIS_LINE_LENGTHS[i]:
+                raise ParseError(f"Error parsing line {i + 1} of ephemeris")
+
+        record = "".join(lines).replace("D", "E")
+
+        # Line 1 - PRN / EPOCH / SV CLK
+        ephemeris = {
+            'PRN':              int(record[0:2]),
+            'TocYear':          int(record[2:5]),
+            'TocMonth':         int(record[5:8]),
+            'TocDay':           int(record[8:11]),
+            'TocHr':            int(record[11:14]),
+            'TocMin':           int(record[14:17]),
+            'TocSec':           float(record[17:22]),
+            'ClockBias':        float(record[22:41]),
+            'ClockDrift':       float(record[41:60]),
+            'ClockDriftRate':   float(record[60:79]),
+        }
+
+        # Lines 2-8 - BROADCAST ORBIT 1-7
+        start = len(lines[0])
+        for i in range(1, EPHEMERIS_LINES):
+            column = start + 3
+            for name in EPHEMERIS_ORBIT_FIELDS[i - 1]:
+                ephemeris[name] = float(record[column:column + 19])
+                column += 19
+            start += len(lines[i])
+
+        return ephemeris
+
+    # Method to parse a RINEX file incrementally, yielding the ephemerides
+    # one at a time as they are read. The header is parsed into
+    # self.contents['Header'], the ephemerides are not stored in
+    # self.contents. Gives the same results as parseFromFile
+    def iterEphemerides(self, fileName):
+        logging.debug("iterEphemerides called")
+        with open(fileName) as inputFile :
+            # Read up to and including the end of header line
+            header = []
+            for line in inputFile:
+                header.append(line)
+                if "END OF HEADER" in line:
+                    break
+            else:
+                raise ParseError("Error END OF HEADER not found")
+
+            self._parseHeader(header)
+
+            # Each ephemeris is 8 lines long, stop at the first incomplete one
+            while True:
+                lines = list(itertools.islice(inputFile, EPHEMERIS_LINES))
+                if len(lines) != EPHEMERIS_LINES:
+                    break
+                yield self._parseEphemerisRecord(lines)
+
     # Method to parse a RINEX from a file
     def parseFromFile(self, fileName):
         logging.debug("parseFromFile called")
-        # Open the file that we have been passed
-        with open(fileName) as inputFile :
-            # Read the entire file
-            buffer = inputFile.read()
-            # Call the method to parse the contents
-            parsedFile = self.parseFromBuffer(buffer)
-
-        # Return the parsed data
-        return parsedFile
+        # Stream the file rather than reading it all into memory first
+        self.contents['Ephemerides'].extend(self.iterEphemerides(fileName))
+        return None
     
     # Method to generate the header
     #  +--------------------+------------------------------------------+------------+
@@ -589,6 +694,34 @@ class RinexPython:
             
 
     
+    # Method to sort the ephemerides into the order they are written. A
+    # list of dicts is sorted in place, a columnar table (an object with
+    # sort() and iterRows() methods such as EphemerisTable) is replaced by
+    # a sorted copy
+    def _sortEphemerides(self):
+        ephemerides = self.contents['Ephemerides']
+        if isinstance(ephemerides, list):
+            ephemerides.sort(key=self._sortFunction)
+        else:
+            ephemerides = ephemerides.sort()
+            self.contents['Ephemerides'] = ephemerides
+        return ephemerides
+
+    # Method to generate the sorted ephemerides as blocks of text, each
+    # holding up to WRITE_CHUNK_EPHEMERIDES complete records
+    def _generateEphemerisChunks(self):
+        ephemerides = self._sortEphemerides()
+        if isinstance(ephemerides, list):
+            rows = map(operator.itemgetter(*EPHEMERIS_FIELDS), ephemerides)
+        else:
+            rows = ephemerides.iterRows()
+
+        while True:
+            chunk = [EPHEMERIS_TEMPLATE % row for row in itertools.islice(rows, WRITE_CHUNK_EPHEMERIDES)]
+            if not chunk:
+                return
+            yield "".join(chunk)
+
     # Method to write a RINEX file to a buffer
     def writeToBuffer(self):
 
@@ -598,25 +731,20 @@ class RinexPython:
         # Generate the header and apply to the buffer
         rinexBuffer.extend(self._generateHeader())
 
-        # Sort the ephemeris before we write
-        self.contents['Ephemerides'].sort(key=self._sortFunction)
-
-        # Loop over all the ephemerides and add them to the buffer
-        for ephemeris in self.contents['Ephemerides']:
-            rinexBuffer.extend(self._generateEphemeris(ephemeris))
+        # Sort and add the ephemerides to the buffer
+        for chunk in self._generateEphemerisChunks():
+            rinexBuffer.extend(chunk[:-1].split("\n"))
 
         return rinexBuffer
     
-    # Method to write a RINEX file directly to a file
+    # Method to write a RINEX file directly to a file, streaming the
+    # ephemerides rather than generating the whole file in memory
     def writeToFile(self, filename):
-        # Call the method to generate into a buffer
-        rinexBuffer = self.writeToBuffer()
-
-        # Write the buffer to a file
         with open(filename, 'w') as outputFile:
-            # Write all the lines to the file
-            for line in rinexBuffer:
+            for line in self._generateHeader():
                 outputFile.write(line + "\n")
+            for chunk in self._generateEphemerisChunks():
+                outputFile.write(chunk)
 
         return
     
@@ -648,11 +776,8 @@ class RinexPython:
             int(ephemeris['TocSec']))
 
     def _caluculateGPSTime(self, inDate):
-        # Define the GPS time epoch
-        epoch = datetime(1980, 1, 6, 0, 0, 0)
-
         # Calculate the time since epoch
-        timeSinceEpoch = inDate - epoch
+        timeSinceEpoch = inDate - GPS_EPOCH
 
         # Calculuate the gps week
         gpsWeek = int(timeSinceEpoch.days / 7)
@@ -677,13 +802,6 @@ class RinexPython:
     # Define a method to update an ephemeris to a specific date/time
     def changeEphemerisTime(self, originalEphemeris, newDateTime):
 
-        # Define the value for the earth's gravitatinal constant
-        WGS384_EARTH_GRAV_CONSTANT = 3.986005e14
-        WGS384_EARTH_ROTATIONAL_RATE = 7.2921151467e-5
-
-        # Define the number of seconds in a week
-        SECONDS_IN_WEEK = 60*60*24*7
-
         # Declare the updated ephemeris object, and inintialise with the
         # original ephemeris
         updatedEphemeris = copy.copy(originalEphemeris)
@@ -727,7 +845,9 @@ class RinexPython:
         Ek = mk
         EkOld = mk + 1.0    # Set to +1 so that they are different to start the iterations
         # Drop into a look to detect when the process has converged
-        while (abs(Ek - EkOld) < 1.0E-14):
+        iterations = 0
+        while (abs(Ek - EkOld) > KEPLER_TOLERANCE) and (iterations < KEPLER_MAX_ITERATIONS):
+            iterations += 1
             EkOld = Ek
             Ek = EkOld + ( \
                 (mk-EkOld + originalEphemeris['e']*math.sin(EkOld)) /\
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import sys
+
+import numpy as np
+
+import orbit
+
+# gps-gen-realtime steps through a motion file at this rate, one line of
+# time,latitude,longitude,height (degrees and metres, as read by -x) per step
+SAMPLE_RATE_HZ = 10
+
+# Motion files are generated CHUNK_SAMPLES positions at a time so that long
+# runs are never held in memory
+CHUNK_SAMPLES = 6000
+LINE_FORMAT = "%.3f,%.9f,%.9f,%.3f\n"
+
+# Positions are smoothed with a moving average over SMOOTHING_S seconds so
+# that the speed and heading changes between segments are not instantaneous
+SMOOTHING_S = 2.0
+
+# Validation limits
+MAX_SPEED_MS = 515.0
+MAX_ACCELERATION_MS2 = 4 * 9.80665
+DISCONTINUITY_M = 100.0
+MIN_HEIGHT_M = -1000.0
+MAX_HEIGHT_M = 20000.0
+TIME_TOLERANCE_S = 1e-3
+
+# Number of failing samples listed for each check
+MAX_REPORTED = 3
+
+
+# Return the ECEF position of a point displaced east and north (metres) from
+# a geodetic position, in the local tangent plane
+def _displace(latitude, longitude, height, east, north):
+    origin = orbit.geodeticToEcef(latitude, longitude, height)
+    e, n, _ = orbit.enuBasis(origin)
+    return origin + np.multiply.outer(east, e) + np.multiply.outer(north, n)
+
+
+# Return the bearing (degrees clockwise from north) of an ECEF direction at
+# a geodetic position
+def _bearing(latitude, longitude, direction):
+    e, n, _ = orbit.enuBasis(orbit.geodeticToEcef(latitude, longitude, 0.0))
+    return math.degrees(math.atan2(np.dot(direction, e), np.dot(direction, n))) % 360
+
+
+# A trajectory built from segments, each starting where the previous one
+# ended. Speeds are in metres per second, headings in degrees clockwise from
+# north and positions are geodetic (degrees and metres)
+class Trajectory:
+
+    # Constructor, the trajectory starts at rest at the given position
+    def __init__(self, latitude, longitude, height, heading=0.0):
+        self.start = (float(latitude), float(longitude), float(height))
+        self.latitude, self.longitude, self.height = self.start
+        self.heading = float(heading)
+        self.speed = 0.0
+        self.duration = 0.0
+        # (start time, duration, function of segment time returning arrays
+        # of latitude, longitude and height)
+        self.segments = []
+        self.profile = None
+
+    # Construct a trajectory from a description as parsed from JSON:
+    # {"start": {"latitude", "longitude", "height", "heading"},
+    #  "segments": [{"type": "hold", "duration"},
+    #               {"type": "waypoints", "points": [[lat, lon, height, speed], ...]},
+    #               {"type": "line", "distance", "speed", "heading", "height"},
+    #               {"type": "circle", "radius", "speed", "turns", "clockwise"}, ...],
+    #  "altitude_profile": {"times": [...], "heights": [...]}}
+    @classmethod
+    def fromDescription(cls, description):
+        start = description["start"]
+        trajectory = cls(start["latitude"], start["longitude"], start["height"], start.get("heading", 0.0))
+        for segment in description.get("segments", []):
+            kind = segment["type"]
+            if kind == "hold":
+                trajectory.hold(segment["duration"])
+            elif kind == "waypoints":
+                for point in segment["points"]:
+                    trajectory.goTo(*point)
+            elif kind == "line":
+                trajectory.line(segment["distance"], segment["speed"], segment.get("heading"),
+                                segment.get("height"))
+            elif kind == "circle":
+                trajectory.circle(segment["radius"], segment.get("speed"), segment.get("turns", 1.0),
+                                  segment.get("clockwise", True))
+            else:
+                raise ValueError("unknown segment type '{}'".format(kind))
+        if "altitude_profile" in description:
+            profile = description["altitude_profile"]
+            trajectory.altitudeProfile(profile["times"], profile["heights"])
+        return trajectory
+
+    def _addSegment(self, duration, function):
+        self.segments.append((self.duration, duration, function))
+        self.duration += duration
+
+    # Stay at the current position for duration seconds
+    def hold(self, duration):
+        latitude, longitude, height = self.latitude, self.longitude, self.height
+
+        def function(t):
+            return np.full(t.shape, latitude), np.full(t.shape, longitude), np.full(t.shape, height)
+
+        self._addSegment(duration, function)
+        self.speed = 0.0
+
+    # Go in a straight line to a waypoint, arriving at speed. The speed
+    # changes uniformly from the current speed and the height linearly
+    def goTo(self, latitude, longitude, height=None, speed=None):
+        latitude, longitude = float(latitude), float(longitude)
+        height = self.height if height is None else float(height)
+        speed = self.speed if speed is None else float(speed)
+        start = orbit.geodeticToEcef(self.latitude, self.longitude, 0.0)
+        end = orbit.geodeticToEcef(latitude, longitude, 0.0)
+        startHeight = self.height
+        length = math.hypot(np.linalg.norm(end - start), height - startHeight)
+        if length == 0:
+            self.speed = speed
+            return
+        startSpeed = self.speed
+        if startSpeed + speed <= 0:
+            raise ValueError("a waypoint cannot be reached from rest at zero speed")
+        duration = 2 * length / (startSpeed + speed)
+        acceleration = (speed - startSpeed) / duration
+
+        def function(t):
+            fraction = np.clip((startSpeed * t + acceleration * t * t / 2) / length, 0, 1)
+            lat, lon, _ = orbit.ecefToGeodetic(start + np.multiply.outer(fraction, end - start))
+            return lat, lon, startHeight + fraction * (height - startHeight)
+
+        self._addSegment(duration, function)
+        if np.linalg.norm(end - start) > 0:
+            self.heading = _bearing(latitude, longitude, end - start)
+        self.latitude, self.longitude, self.height = latitude, longitude, height
+        self.speed = speed
+
+    # Go distance metres in a straight line, on the current heading unless
+    # one is given, arriving at speed and height
+    def line(self, distance, speed, heading=None, height=None):
+        if heading is None:
+            heading = self.heading
+        end = _displace(self.latitude, self.longitude, 0.0, distance * math.sin(math.radians(heading)),
+                        distance * math.cos(math.radians(heading)))
+        latitude, longitude, _ = orbit.ecefToGeodetic(end)
+        self.goTo(float(latitude), float(longitude), height, speed)
+
+    # Go round a circle of radius metres at a constant speed, by default the
+    # current speed, turning right (clockwise) or left from the current
+    # heading. turns may be fractional, e.g. 0.25 for a 90 degree turn
+    def circle(self, radius, speed=None, turns=1.0, clockwise=True):
+        if speed is None:
+            speed = self.speed
+        if speed <= 0:
+            raise ValueError("circle speed must be positive")
+        sign = 1 if clockwise else -1
+        # The centre is radius metres to the side of the current heading,
+        # bearings from the centre increase when going clockwise
+        toCentre = math.radians(self.heading + sign * 90)
+        centre = _displace(self.latitude, self.longitude, 0.0, radius * math.sin(toCentre),
+                           radius * math.cos(toCentre))
+        east, north, _ = orbit.enuBasis(centre)
+        startBearing = toCentre + math.pi
+        height = self.height
+        duration = 2 * math.pi * radius * turns / speed
+
+        def function(t):
+            bearing = startBearing + sign * speed * t / radius
+            position = centre + np.multiply.outer(radius * np.sin(bearing), east) + \
+                np.multiply.outer(radius * np.cos(bearing), north)
+            lat, lon, _ = orbit.ecefToGeodetic(position)
+            return lat, lon, np.full(t.shape, height)
+
+        self._addSegment(duration, function)
+        endBearing = startBearing + sign * 2 * math.pi * turns
+        lat, lon, _ = orbit.ecefToGeodetic(centre + radius * (math.sin(endBearing) * east +
+                                                              math.cos(endBearing) * north))
+        self.latitude, self.longitude = float(lat), float(lon)
+        self.heading = (math.degrees(endBearing) + sign * 90) % 360
+        self.speed = speed
+
+    # Replace the heights of the segments with a profile interpolated
+    # linearly between heights (metres) at times (seconds from the start)
+    def altitudeProfile(self, times, heights):
+        self.profile = (np.asarray(times, dtype=np.float64), np.asarray(heights, dtype=np.float64))
+
+    # Return the ECEF positions (shape (len(times), 3)) at times seconds from
+    # the start, times outside the trajectory give the start or end position
+    def positions(self, times):
+        t = np.clip(np.asarray(times, dtype=np.float64), 0, self.duration)
+        latitude = np.full(t.shape, self.start[0])
+        longitude = np.full(t.shape, self.start[1])
+        height = np.full(t.shape, self.start[2])
+        if self.segments:
+            starts = np.array([segment[0] for segment in self.segments])
+            index = np.clip(np.searchsorted(starts, t, side='right') - 1, 0, len(self.segments) - 1)
+            for i in np.unique(index):
+                start, duration, function = self.segments[i]
+                mask = index == i
+                latitude[mask], longitude[mask], height[mask] = function(np.minimum(t[mask] - start, duration))
+        if self.profile is not None:
+            height = np.interp(t, *self.profile)
+        return orbit.geodeticToEcef(latitude, longitude, height)
+
+    # Return the number of samples at rate covering the trajectory
+    def sampleCount(self, rate=SAMPLE_RATE_HZ):
+        return int(math.floor(self.duration * rate + 1e-9)) + 1
+
+    # Yield arrays of time,latitude,longitude,height rows for the samples at
+    # rate, chunkSamples at a time, smoothed over smoothing seconds
+    def iterSamples(self, rate=SAMPLE_RATE_HZ, smoothing=SMOOTHING_S, chunkSamples=CHUNK_SAMPLES):
+        count = self.sampleCount(rate)
+        half = int(round(smoothing * rate / 2))
+        window = 2 * half + 1
+        for first in range(0, count, chunkSamples):
+            last = min(first + chunkSamples, count)
+            # Evaluate half a window either side so each chunk is smoothed
+            # exactly as a single pass over the whole trajectory would be
+            ecef = self.positions(np.arange(first - half, last + half) / rate)
+            if half:
+                offset = ecef - ecef[0]
+                total = np.concatenate([np.zeros((1, 3)), np.cumsum(offset, axis=0)])
+                ecef = (total[window:] - total[:-window]) / window + ecef[0]
+            latitude, longitude, height = orbit.ecefToGeodetic(ecef)
+            yield np.column_stack([np.arange(first, last) / rate, latitude, longitude, height])
+
+    # Write the trajectory as a motion file, streaming it a chunk at a time.
+    # Returns the number of lines written
+    def writeToFile(self, fileName, rate=SAMPLE_RATE_HZ, smoothing=SMOOTHING_S):
+        count = 0
+        with open(fileName, "w") as outputFile:
+            for chunk in self.iterSamples(rate, smoothing):
+                outputFile.write("".join(map(LINE_FORMAT.__mod__, map(tuple, chunk.tolist()))))
+                count += len(chunk)
+        return count
+
+
+# Read a motion file into an array of time,latitude,longitude,height rows
+def readMotionFile(fileName):
+    samples = np.loadtxt(fileName, delimiter=",", ndmin=2)
+    if samples.shape[1] != 4:
+        raise ValueError("expected 4 values per line, found {}".format(samples.shape[1]))
+    return samples
+
+
+# Describe up to MAX_REPORTED of the samples where failed is True
+def _describe(message, failed, times, offset):
+    lines = np.flatnonzero(failed)
+    if len(lines) == 0:
+        return []
+    where = ", ".join("line {} (t={:.3f})".format(i + offset + 1, times[i + offset])
+                      for i in lines[:MAX_REPORTED])
+    return ["{} at {} line(s): {}{}".format(message, len(lines), where, ", ..." if len(lines) > MAX_REPORTED else "")]
+
+
+# Check time,latitude,longitude,height samples for the sample rate, ranges,
+# discontinuities and speed and acceleration limits in one vectorised pass.
+# Returns a list of problems, empty if the motion is valid
+def validateMotion(samples, rate=SAMPLE_RATE_HZ, maxSpeed=MAX_SPEED_MS, maxAcceleration=MAX_ACCELERATION_MS2,
+                   discontinuity=DISCONTINUITY_M):
+    samples = np.asarray(samples, dtype=np.float64)
+    if len(samples) == 0:
+        return ["no samples"]
+    times, latitude, longitude, height = samples.T
+    problems = []
+    problems += _describe("value not finite", ~np.all(np.isfinite(samples), axis=1), times, 0)
+    problems += _describe("latitude out of range", np.abs(latitude) > 90, times, 0)
+    problems += _describe("longitude out of range", np.abs(longitude) > 180, times, 0)
+    problems += _describe("height out of range", (height < MIN_HEIGHT_M) | (height > MAX_HEIGHT_M), times, 0)
+    if problems:
+        return problems
+
+    # Time steps and the first and second differences of position, the
+    # differences of line i are reported at line i + 1
+    problems += _describe("time step is not {:g} s".format(1 / rate),
+                          np.abs(np.diff(times) - 1 / rate) > TIME_TOLERANCE_S, times, 1)
+    ecef = orbit.geodeticToEcef(latitude, longitude, height)
+    step = np.linalg.norm(np.diff(ecef, axis=0), axis=1)
+    problems += _describe("discontinuity of more than {:g} m".format(discontinuity), step > discontinuity,
+                          times, 1)
+    problems += _describe("speed above {:g} m/s".format(maxSpeed), step * rate > maxSpeed, times, 1)
+    acceleration = np.linalg.norm(np.diff(ecef, 2, axis=0), axis=1) * rate * rate
+    problems += _describe("acceleration above {:g} m/s^2".format(maxAcceleration),
+                          acceleration > maxAcceleration, times, 1)
+    return problems
+
+
+# Read and validate a motion file, returning a list of problems as for
+# validateMotion
+def validateMotionFile(fileName, rate=SAMPLE_RATE_HZ, **limits):
+    try:
+        samples = readMotionFile(fileName)
+    except (OSError, ValueError) as e:
+        return ["could not be read: {}".format(e)]
+    return validateMotion(samples, rate, **limits)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate and validate gnss_spoof motion files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    generate = subparsers.add_parser("generate", help="generate a motion file from a JSON description")
+    generate.add_argument("description", help="JSON trajectory description")
+    generate.add_argument("output", help="motion file to write")
+    generate.add_argument("-s", "--smoothing", type=float, default=SMOOTHING_S,
+                          help="seconds over which positions are smoothed")
+    validate = subparsers.add_parser("validate", help="validate a motion file")
+    validate.add_argument("motion_file", help="motion file to check")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        with open(args.description) as f:
+            trajectory = Trajectory.fromDescription(json.load(f))
+        lines = trajectory.writeToFile(args.output, smoothing=args.smoothing)
+        print("Wrote {} lines, {:.1f} s".format(lines, trajectory.duration))
+        problems = validateMotionFile(args.output)
+    else:
+        problems = validateMotionFile(args.motion_file)
+    for problem in problems:
+        print("ERROR: {}".format(problem))
+    sys.exit(1 if problems else 0)